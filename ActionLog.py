@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+INITIAL_CAPACITY = 256
+# arrays of an ActionLog holding one value per entry
+ENTRY_FIELDS = (('transfer', np.int32), ('old_status', np.int8), ('new_status', np.int8),
+				('old_timestamp', np.int64), ('new_timestamp', np.int64))
+
+
+class ActionLog:
+	"""
+	Undo/redo history of a transfer protocol, held in growable numpy arrays.
+	* Every status change is an entry: transfer index, old and new status code, old and new timestamp
+	* Entries made by one user action (e.g. completing a transfer and starting the next one, or skipping the rest of
+	  a plate) form a group, along with the protocol cursor (index in the transfer sequence, plate index) before and
+	  after the action
+	* Groups before position are done, groups from position on were undone and can be redone until a new action
+	  is logged
+	Undo and redo move one group, touching only the entries of that group.
+	"""
+
+	def __init__(self):
+		self.num_entries = 0
+		self.num_groups = 0
+		# groups[:position] are done
+		self.position = 0
+		self._open = None
+		for name, dtype in ENTRY_FIELDS:
+			setattr(self, name, np.empty(INITIAL_CAPACITY, dtype=dtype))
+		# group_start[g]:group_start[g + 1] are the entries of group g, cursors[g] is
+		# (index before, plate before, index after, plate after)
+		self.group_start = np.zeros(INITIAL_CAPACITY + 1, dtype=np.int64)
+		self.cursors = np.zeros((INITIAL_CAPACITY, 4), dtype=np.int32)
+
+	def _growEntries(self):
+		for name, dtype in ENTRY_FIELDS:
+			array = getattr(self, name)
+			setattr(self, name, np.concatenate([array, np.empty(len(array), dtype=dtype)]))
+
+	def _growGroups(self):
+		capacity = len(self.cursors)
+		self.group_start = np.concatenate([self.group_start, np.zeros(capacity, dtype=np.int64)])
+		self.cursors = np.concatenate([self.cursors, np.zeros((capacity, 4), dtype=np.int32)])
+
+	def __len__(self):
+		return self.num_groups
+
+	@property
+	def recording(self):
+		"""
+		True while a group is open
+		"""
+		return self._open is not None
+
+	def canUndo(self):
+		return self.position > 0
+
+	def canRedo(self):
+		return self.position < self.num_groups
+
+	def begin(self, cursor):
+		"""
+		Opens a group for the entries of a new action. Its entries replace those of the groups that were undone.
+
+		:param cursor: (index in the transfer sequence, plate index) before the action
+		"""
+		self.num_entries = int(self.group_start[self.position])
+		self._open = cursor
+
+	def append(self, idx, old_status, new_status, old_timestamp, new_timestamp):
+		"""
+		Logs one status change, ignored outside of an open group (e.g. while undoing or restoring a record)
+		"""
+		if self._open is None:
+			return
+		if self.num_entries == len(self.transfer):
+			self._growEntries()
+		entry = self.num_entries
+		self.transfer[entry] = idx
+		self.old_status[entry] = old_status
+		self.new_status[entry] = new_status
+		self.old_timestamp[entry] = old_timestamp
+		self.new_timestamp[entry] = new_timestamp
+		self.num_entries += 1
+
+	def end(self, cursor):
+		"""
+		Closes the open group, which drops the groups that were undone. A group that changed neither a status nor
+		the cursor is dropped instead, keeping them.
+
+		:param cursor: (index in the transfer sequence, plate index) after the action
+		"""
+		before, self._open = self._open, None
+		if before is None:
+			return
+		if self.num_entries == self.group_start[self.position] and tuple(before) == tuple(cursor):
+			self.num_entries = int(self.group_start[self.num_groups])
+			return
+		self.num_groups = self.position
+		if self.num_groups == len(self.cursors):
+			self._growGroups()
+		self.cursors[self.num_groups] = (before[0], before[1], cursor[0], cursor[1])
+		self.num_groups += 1
+		self.group_start[self.num_groups] = self.num_entries
+		self.position = self.num_groups
+
+	def entries(self, group):
+		return range(int(self.group_start[group]), int(self.group_start[group + 1]))
+
+	def undo(self):
+		"""
+		Steps back one group
+
+		:return: (transfer index, status code, timestamp) to restore, latest change first, and the cursor before
+			the group
+		"""
+		self.position -= 1
+		group = self.position
+		changes = [(int(self.transfer[entry]), int(self.old_status[entry]), int(self.old_timestamp[entry]))
+				   for entry in reversed(self.entries(group))]
+		return changes, (int(self.cursors[group, 0]), int(self.cursors[group, 1]))
+
+	def redo(self):
+		"""
+		Steps forward one group
+
+		:return: (transfer index, status code, timestamp) to restore, in logged order, and the cursor after the group
+		"""
+		group = self.position
+		self.position += 1
+		changes = [(int(self.transfer[entry]), int(self.new_status[entry]), int(self.new_timestamp[entry]))
+				   for entry in self.entries(group)]
+		return changes, (int(self.cursors[group, 2]), int(self.cursors[group, 3]))
+
+	def replay(self, status, timestamp, stop=None):
+		"""
+		Reconstructs protocol state by applying the new status and timestamp of every entry of the groups before
+		stop (defaulting to position) to status and timestamp arrays holding the state before the first group
+
+		:return: cursor after the last group applied, or None if none was
+		"""
+		stop = self.position if stop is None else stop
+		if stop == 0:
+			return None
+		end = int(self.group_start[stop])
+		# last entry of each transfer
+		_, from_end = np.unique(self.transfer[:end][::-1], return_index=True)
+		last = end - 1 - from_end
+		status[self.transfer[last]] = self.new_status[last]
+		timestamp[self.transfer[last]] = self.new_timestamp[last]
+		return int(self.cursors[stop - 1, 2]), int(self.cursors[stop - 1, 3])
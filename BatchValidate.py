@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Batch validation of every protocol csv in a folder, without the GUI.
+
+Each file is read and checked the way WelltoWell.loadCsv does it (missing or invalid well names, duplicated source
+and destination wells), with files spread over a pool of worker processes. Usage:
+
+	python -m BatchValidate
+	python -m BatchValidate protocols/ --format csv --output report.csv
+
+The folder defaults to 'protocol_dir' of the config. The report holds one entry per file with its status ('ok',
+'invalid' or 'error' if it could not be read), destination plate, plate and transfer counts, and every bad well
+and duplicated row found. The exit status is 1 if any file is not ok.
+"""
+
+import argparse, csv, functools, json, logging, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from WellLit.Transfer import TError
+from WellToWell import (duplicateRows, duplicateWellErrors, invalidWellNames, readConfig, readProtocolFile,
+						wellNameErrors)
+
+REPORT_COLUMNS = ['file', 'status', 'dest_plate', 'num_plates', 'num_transfers', 'num_bad_wells',
+				  'num_duplicate_sources', 'num_duplicate_destinations', 'errors']
+
+
+def validateProtocol(path, num_wells):
+	"""
+	Reads and validates one protocol csv with the checks of WelltoWell.loadCsv, without logging or a WelltoWell,
+	so that it can run in a worker process or thread
+
+	:return: report dict, see REPORT_COLUMNS. bad_wells, duplicate_sources and duplicate_destinations list every
+		problem found, errors holds them as the messages WelltoWell shows
+	"""
+	report = {'file': str(path), 'status': 'ok', 'dest_plate': None, 'num_plates': 0, 'num_transfers': 0,
+			  'bad_wells': [], 'duplicate_sources': [], 'duplicate_destinations': [], 'errors': []}
+	try:
+		dest_plate, df = readProtocolFile(str(path))
+	except TError as err:
+		report['status'] = 'error'
+		report['errors'].append(' '.join(str(err).split()))
+		return report
+
+	# sheets without a destination plate line are named after the file, as WelltoWell.destPlateName does
+	report['dest_plate'] = Path(path).stem if dest_plate is None else dest_plate
+	report['num_plates'] = int(df['PlateName'].nunique())
+	report['num_transfers'] = len(df)
+
+	invalid = invalidWellNames(df, num_wells)
+	report['bad_wells'] = [{'column': label, 'row': line, 'well': well_name} for label, line, well_name in invalid]
+	# rows with bad well names are left out of the duplicate checks, see duplicateRows
+	source_dupes = duplicateRows(df, ['PlateName', 'SourceWell'])
+	dest_dupes = duplicateRows(df, 'DestWell')
+	report['duplicate_sources'] = [{'plate': plate, 'well': well, 'rows': rows}
+								   for (plate, well), rows in source_dupes.items()]
+	report['duplicate_destinations'] = [{'well': well, 'rows': rows} for well, rows in dest_dupes.items()]
+	report['errors'] = wellNameErrors(invalid, num_wells)[1] + duplicateWellErrors(source_dupes, dest_dupes)[1]
+
+	if report['errors']:
+		report['status'] = 'invalid'
+	return report
+
+
+def validateAll(paths, num_wells, jobs=None):
+	"""
+	Validates protocol csv files over a pool of worker processes
+
+	:return: list of reports, in the order of paths
+	"""
+	jobs = jobs or os.cpu_count() or 1
+	chunksize = max(1, len(paths) // (jobs * 4))
+	with ProcessPoolExecutor(max_workers=jobs) as pool:
+		return list(pool.map(functools.partial(validateProtocol, num_wells=num_wells), paths, chunksize=chunksize))
+
+
+def writeJson(reports, out):
+	json.dump(reports, out, indent=2)
+	out.write('\n')
+
+
+def writeCsv(reports, out):
+	writer = csv.writer(out, lineterminator='\n')
+	writer.writerow(REPORT_COLUMNS)
+	for report in reports:
+		row = dict(report, num_bad_wells=len(report['bad_wells']),
+				   num_duplicate_sources=len(report['duplicate_sources']),
+				   num_duplicate_destinations=len(report['duplicate_destinations']),
+				   errors='; '.join(report['errors']))
+		writer.writerow([row[column] for column in REPORT_COLUMNS])
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog='python -m BatchValidate',
+									 description='Validate every protocol csv in a folder over a pool of processes')
+	parser.add_argument('folder', nargs='?', help='folder of protocol csv files (default: protocol_dir of the config)')
+	parser.add_argument('-c', '--config', default=os.path.join(os.getcwd(), 'wellLitConfig.json'),
+						help='WellLit config file (default: ./wellLitConfig.json)')
+	parser.add_argument('--num-wells', choices=['96', '384', '1536'], help='plate format, overrides the config')
+	parser.add_argument('-j', '--jobs', type=int, help='worker processes (default: number of cores)')
+	parser.add_argument('-f', '--format', choices=['json', 'csv'], default='json', help='report format')
+	parser.add_argument('-o', '--output', help='write the report to this file (default: stdout)')
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=logging.WARNING, format='%(asctime)s [%(levelname)s] - %(message)s')
+
+	# only the plate format and protocol folder are needed, not a WelltoWell with its records, cache and history
+	configs = readConfig(args.config)
+	folder = Path(args.folder or configs['protocol_dir'])
+	paths = sorted(str(path) for path in folder.glob('*.csv'))
+	if not paths:
+		sys.stderr.write('No csv files found in %s\n' % folder)
+		return 1
+
+	start = time.perf_counter()
+	reports = validateAll(paths, args.num_wells or configs['num_wells'], jobs=args.jobs)
+	elapsed = time.perf_counter() - start
+
+	write = writeJson if args.format == 'json' else writeCsv
+	if args.output:
+		with open(args.output, 'w', newline='') as out:
+			write(reports, out)
+	else:
+		write(reports, sys.stdout)
+
+	num_failed = sum(report['status'] != 'ok' for report in reports)
+	sys.stderr.write('%s files validated in %.2f s, %s with problems\n' % (len(reports), elapsed, num_failed))
+	return 1 if num_failed else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
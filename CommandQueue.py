@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+import time
+from collections import deque
+
+
+class CommandQueue:
+	"""
+	Ordered queue of user commands, e.g. keyboard shortcuts, drained by a single consumer.
+	* A command put again within debounce seconds of the last time it was accepted is dropped, so an accidental
+	  double press performs the command once
+	* Commands are taken in the order they were put
+	"""
+
+	def __init__(self, debounce=0.0, clock=time.monotonic):
+		self.debounce = debounce
+		self.clock = clock
+		self._commands = deque()
+		self._last = {}
+
+	def __len__(self):
+		return len(self._commands)
+
+	def put(self, command):
+		"""
+		:return: False if the command was dropped by the debounce
+		"""
+		now = self.clock()
+		last = self._last.get(command)
+		if last is not None and now - last < self.debounce:
+			return False
+		self._last[command] = now
+		self._commands.append(command)
+		return True
+
+	def get(self):
+		return self._commands.popleft()
+
+	def clear(self):
+		"""
+		Drops every queued command
+
+		:return: number of commands dropped
+		"""
+		dropped = len(self._commands)
+		self._commands.clear()
+		return dropped
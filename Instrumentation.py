@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+import builtins, cProfile, functools, io, json, logging, os, pstats, sys, time, tracemalloc
+from collections import deque
+from datetime import datetime
+
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyRecorder:
+	"""
+	Per-operation latency histograms, fed by span() and the timed() decorator.
+	* The last max_samples durations of each operation are kept for percentiles, along with the total count, sum and
+	  maximum of every sample
+	* Recording is skipped entirely while disabled
+	"""
+
+	def __init__(self, enabled=False, max_samples=10000):
+		self.enabled = enabled
+		self.max_samples = max_samples
+		self.reset()
+
+	def reset(self):
+		self.samples = {}
+		self.counts = {}
+		self.totals = {}
+		self.maxima = {}
+
+	def record(self, name, seconds):
+		if name not in self.samples:
+			self.samples[name] = deque(maxlen=self.max_samples)
+			self.counts[name] = 0
+			self.totals[name] = 0.0
+			self.maxima[name] = 0.0
+		self.samples[name].append(seconds)
+		self.counts[name] += 1
+		self.totals[name] += seconds
+		self.maxima[name] = max(self.maxima[name], seconds)
+
+	def summary(self):
+		"""
+		:return: dict of operation -> count, mean, p50, p95, p99 and max latency in milliseconds
+		"""
+		import numpy as np
+		summary = {}
+		# operations may be recorded from other threads, e.g. protocol loading, while the summary is built
+		for name, samples in sorted(list(self.samples.items())):
+			samples = list(samples)
+			values = np.percentile(np.asarray(samples) * 1000.0, PERCENTILES)
+			stats = {'count': self.counts[name], 'mean_ms': self.totals[name] * 1000.0 / self.counts[name]}
+			stats.update({'p%s_ms' % p: float(value) for p, value in zip(PERCENTILES, values)})
+			stats['max_ms'] = self.maxima[name] * 1000.0
+			summary[name] = stats
+		return summary
+
+	def exportJson(self, path):
+		with open(path, 'w') as export:
+			json.dump({'created': datetime.now().isoformat(timespec='seconds'), 'latency': self.summary()}, export,
+					  indent=2)
+
+	def logSummary(self):
+		for name, stats in self.summary().items():
+			logging.info('Latency %s: n=%s p50=%.3f ms p95=%.3f ms p99=%.3f ms max=%.3f ms' % (
+				name, stats['count'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['max_ms']))
+
+
+# recorder shared by every instrumented operation, enabled by WelltoWell from the 'timing_enabled' config entry
+RECORDER = LatencyRecorder()
+
+
+class span:
+	"""
+	Context manager timing a block into RECORDER under name, including blocks left by an exception
+	"""
+	__slots__ = ('name', 'start')
+
+	def __init__(self, name):
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc_info):
+		if RECORDER.enabled:
+			RECORDER.record(self.name, time.perf_counter() - self.start)
+		return False
+
+
+def timed(name):
+	"""
+	Decorator timing every call of a function into RECORDER under name
+	"""
+	def decorate(func):
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			if not RECORDER.enabled:
+				return func(*args, **kwargs)
+			start = time.perf_counter()
+			try:
+				return func(*args, **kwargs)
+			finally:
+				RECORDER.record(name, time.perf_counter() - start)
+		return wrapper
+	return decorate
+
+
+class Profiler:
+	"""
+	Optional whole-session capture, mode 'cprofile' (function call statistics) or 'tracemalloc' (memory allocated
+	by line). stop() writes the capture to output_dir and logs its top entries.
+	"""
+
+	def __init__(self, mode, output_dir):
+		self.mode = mode
+		self.output_dir = output_dir
+		self.profile = None
+
+	def start(self):
+		if self.mode == 'cprofile':
+			self.profile = cProfile.Profile()
+			self.profile.enable()
+		elif self.mode == 'tracemalloc':
+			tracemalloc.start()
+		elif self.mode:
+			logging.warning('Unknown profile_mode %s, profiling disabled' % self.mode)
+
+	def stop(self):
+		"""
+		:return: path of the file written, or None
+		"""
+		stamp = datetime.now().strftime('%Y_%m_%d_%H_%M_%S')
+		if self.mode == 'cprofile' and self.profile is not None:
+			self.profile.disable()
+			path = os.path.join(self.output_dir, 'WelltoWell_profile_%s.prof' % stamp)
+			self.profile.dump_stats(path)
+			top = io.StringIO()
+			pstats.Stats(self.profile, stream=top).sort_stats('cumulative').print_stats(20)
+			logging.info('cProfile capture written to %s\n%s' % (path, top.getvalue()))
+			self.profile = None
+			return path
+		if self.mode == 'tracemalloc' and tracemalloc.is_tracing():
+			snapshot = tracemalloc.take_snapshot()
+			current, peak = tracemalloc.get_traced_memory()
+			tracemalloc.stop()
+			path = os.path.join(self.output_dir, 'WelltoWell_tracemalloc_%s.txt' % stamp)
+			with open(path, 'w') as report:
+				report.write('current %s bytes, peak %s bytes\n' % (current, peak))
+				for stat in snapshot.statistics('lineno')[:50]:
+					report.write('%s\n' % stat)
+			logging.info('tracemalloc capture written to %s, peak %.1f MB' % (path, peak / 2 ** 20))
+			return path
+		return None
+
+
+class ImportTimer:
+	"""
+	Times module imports between start() and stop(), like python -X importtime: for every module imported for the
+	first time, the cumulative time including the modules it imports and the time of the module itself
+	"""
+
+	def __init__(self):
+		self.imports = []
+		self._stack = []
+		self._import = None
+		self.started = None
+		self.elapsed = 0.0
+
+	def start(self):
+		self._import = builtins.__import__
+		builtins.__import__ = self._timedImport
+		self.started = time.perf_counter()
+		return self
+
+	def stop(self):
+		if self._import is not None:
+			builtins.__import__ = self._import
+			self._import = None
+			self.elapsed = time.perf_counter() - self.started
+
+	def _timedImport(self, name, globals=None, locals=None, fromlist=(), level=0):
+		if level or name in sys.modules:
+			return self._import(name, globals, locals, fromlist, level)
+		depth = len(self._stack)
+		self._stack.append(0.0)
+		start = time.perf_counter()
+		try:
+			return self._import(name, globals, locals, fromlist, level)
+		finally:
+			cumulative = time.perf_counter() - start
+			nested = self._stack.pop()
+			if self._stack:
+				self._stack[-1] += cumulative
+			self.imports.append((name, depth, cumulative, cumulative - nested))
+
+	def logSummary(self, top=15):
+		"""
+		Logs the total time spent importing, the slowest top-level imports and the modules slowest to import
+		themselves
+		"""
+		if not self.imports:
+			return
+		total = sum(cumulative for _, depth, cumulative, _ in self.imports if depth == 0)
+		logging.info('Imports took %.0f ms of %.0f ms' % (total * 1000, self.elapsed * 1000))
+		for name, _, cumulative, own in sorted((entry for entry in self.imports if entry[1] == 0),
+											   key=lambda entry: -entry[2])[:top]:
+			logging.info('Import %s: %.1f ms cumulative, %.1f ms self' % (name, cumulative * 1000, own * 1000))
+		for name, _, _, own in sorted(self.imports, key=lambda entry: -entry[3])[:top]:
+			logging.info('Import self time %s: %.1f ms' % (name, own * 1000))
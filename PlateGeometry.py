@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import re
+import numpy as np
+
+# rows, columns of each supported plate format, keyed by the 'num_wells' config entry
+PLATE_FORMATS = {'96': (8, 12), '384': (16, 24), '1536': (32, 48)}
+# row letters (two for rows past Z, e.g. AF on 1536-well plates) and column number, allowing leading zeros in the
+# column and surrounding whitespace
+WELL_NAME = r'^\s*([A-Za-z]{1,2})0*(\d{1,4})\s*$'
+WELL_NAME_RE = re.compile(WELL_NAME)
+NO_WELL = -1
+
+
+def rowLabel(row):
+	"""
+	Letter(s) of a plate row: A-Z, then AA, AB...
+	"""
+	if row < 26:
+		return chr(ord('A') + row)
+	return rowLabel(row // 26 - 1) + chr(ord('A') + row % 26)
+
+
+class PlateGeometry:
+	"""
+	Well addressing of one plate format, computed once per format.
+	Wells are numbered row by row: index = row * num_cols + col, names[index] is the normalized name, e.g. 'B5',
+	and coordinates[index] its (row, col) position on the grid.
+	"""
+
+	def __init__(self, num_rows, num_cols):
+		self.num_rows = num_rows
+		self.num_cols = num_cols
+		self.num_wells = num_rows * num_cols
+		self.row_labels = [rowLabel(row) for row in range(num_rows)]
+		self.rows = np.repeat(np.arange(num_rows), num_cols)
+		self.cols = np.tile(np.arange(num_cols), num_rows)
+		self.names = np.array(['%s%s' % (self.row_labels[row], col + 1) for row, col in zip(self.rows, self.cols)],
+							  dtype=object)
+		self.coordinates = np.column_stack([self.rows, self.cols]).astype(float)
+		# normalized name -> well index
+		self.index = {name: idx for idx, name in enumerate(self.names)}
+		self._row_index = {label: row for row, label in enumerate(self.row_labels)}
+
+	def wellIndex(self, name):
+		"""
+		Index of a well name in any accepted spelling, e.g. ' b05', or NO_WELL if it is not a well of the plate
+		"""
+		match = WELL_NAME_RE.match(name) if isinstance(name, str) else None
+		if match is None:
+			return NO_WELL
+		row = self._row_index.get(match.group(1).upper())
+		col = int(match.group(2))
+		if row is None or not 1 <= col <= self.num_cols:
+			return NO_WELL
+		return row * self.num_cols + col - 1
+
+	def wellIndices(self, wells):
+		"""
+		Vectorized wellIndex of a pandas Series of well names
+
+		:return: int64 array, NO_WELL where a name is missing or is not a well of the plate
+		"""
+		import pandas as pd
+		parts = wells.astype('string').str.extract(WELL_NAME)
+		row = parts[0].str.upper().map(self._row_index).astype('float64').to_numpy()
+		col = pd.to_numeric(parts[1]).astype('float64').to_numpy()
+		with np.errstate(invalid='ignore'):
+			valid = ~np.isnan(row) & (col >= 1) & (col <= self.num_cols)
+		return np.where(valid, np.nan_to_num(row) * self.num_cols + np.nan_to_num(col) - 1, NO_WELL).astype(np.int64)
+
+
+_GEOMETRIES = {}
+
+
+def plateGeometry(num_wells):
+	"""
+	PlateGeometry of the format given by num_wells, defaulting to 96 wells
+	"""
+	key = str(num_wells) if str(num_wells) in PLATE_FORMATS else '96'
+	if key not in _GEOMETRIES:
+		_GEOMETRIES[key] = PlateGeometry(*PLATE_FORMATS[key])
+	return _GEOMETRIES[key]
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import hashlib, logging, os, tempfile, zipfile
+from pathlib import Path
+import numpy as np
+from TransferStore import TransferStore
+
+# bump when the cached layout or the validation rules change, so stale entries are never read
+CACHE_VERSION = 2
+# arrays of a TransferStore saved in a cache entry
+STORE_ARRAYS = ('plate_names', 'plate', 'well_names', 'source_well', 'dest_well')
+
+
+def protocolKey(path, num_wells):
+	"""
+	Cache key of a protocol csv: sha256 of its contents, the plate format and the cache version.
+	Any change to the file gives a new key, so modified protocols are never served from the cache.
+	"""
+	digest = hashlib.sha256()
+	digest.update(('%s:%s:' % (CACHE_VERSION, num_wells)).encode())
+	with open(path, 'rb') as protocol:
+		for chunk in iter(lambda: protocol.read(1 << 20), b''):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+
+class ProtocolCache:
+	"""
+	On-disk cache of validated protocols, one .npz file per protocol holding the arrays of its TransferStore.
+	* Entries are keyed by protocolKey, so a protocol is validated once per content and plate format
+	* Entries are written atomically, a corrupt or unreadable entry is treated as a miss and removed
+	* The cache is kept under max_bytes by evicting the least recently used entries, tracked by file mtime
+	"""
+
+	def __init__(self, cache_dir, max_bytes=64 * 2 ** 20):
+		self.cache_dir = Path(cache_dir)
+		self.max_bytes = int(max_bytes)
+
+	def entryPath(self, key):
+		return self.cache_dir / (key + '.npz')
+
+	def get(self, key):
+		"""
+		:return: (destination plate name, None if the csv has no destination line, TransferStore), or None on a miss
+		"""
+		if self.max_bytes <= 0:
+			return None
+		path = self.entryPath(key)
+		try:
+			with np.load(path, allow_pickle=False) as entry:
+				arrays = {name: entry[name] for name in STORE_ARRAYS}
+				dest_plate = str(entry['dest_plate'][0]) if bool(entry['has_dest_plate'][0]) else None
+			os.utime(path)
+		except FileNotFoundError:
+			return None
+		except (OSError, ValueError, KeyError, zipfile.BadZipFile) as err:
+			logging.warning('Removing unreadable protocol cache entry %s: %s' % (path, err))
+			self.remove(path)
+			return None
+
+		store = TransferStore(arrays['plate_names'].astype(object), arrays['plate'], arrays['well_names'].astype(object),
+							  arrays['source_well'], arrays['dest_well'], dest_plate=dest_plate or '')
+		return dest_plate, store
+
+	def put(self, key, dest_plate, store):
+		"""
+		Saves the arrays of a validated protocol's TransferStore, then evicts entries over the size limit.
+		Failing to write the cache is logged and otherwise ignored.
+		"""
+		if self.max_bytes <= 0:
+			return
+		arrays = {name: getattr(store, name) for name in STORE_ARRAYS}
+		arrays['plate_names'] = arrays['plate_names'].astype(str)
+		arrays['well_names'] = arrays['well_names'].astype(str)
+		try:
+			self.cache_dir.mkdir(parents=True, exist_ok=True)
+			fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+			try:
+				with os.fdopen(fd, 'wb') as entry:
+					np.savez(entry, dest_plate=np.array([dest_plate or '']),
+							 has_dest_plate=np.array([dest_plate is not None]), **arrays)
+				os.replace(tmp_path, self.entryPath(key))
+			except BaseException:
+				self.remove(tmp_path)
+				raise
+		except OSError as err:
+			logging.warning('Could not write protocol cache entry for %s: %s' % (key, err))
+			return
+		self.evict()
+
+	def evict(self):
+		"""
+		Removes the least recently used entries until the cache fits in max_bytes
+		"""
+		try:
+			entries = [(path.stat(), path) for path in self.cache_dir.glob('*.npz')]
+		except OSError:
+			return
+		total = sum(stat.st_size for stat, _ in entries)
+		for stat, path in sorted(entries, key=lambda entry: entry[0].st_mtime):
+			if total <= self.max_bytes:
+				break
+			self.remove(path)
+			total -= stat.st_size
+
+	def remove(self, path):
+		try:
+			os.remove(path)
+		except OSError:
+			pass
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import json, logging, os, tempfile, threading
+from datetime import datetime
+from pathlib import Path
+from BatchValidate import validateProtocol
+from TransferJournal import RECORD_NAME
+
+# bump when the entry layout or the validation rules change, so that every protocol is validated again
+CATALOG_VERSION = 1
+STATUSES = ('ok', 'invalid', 'error')
+
+
+class ProtocolCatalog:
+	"""
+	Metadata of the protocol csv files in a folder, for the protocol browser: destination plate, number of source
+	plates and transfers, result of the last validation and date of the last run found in the records folder.
+	* Entries are kept in a json file and listed from memory, so the folder is not read when the browser opens
+	* refresh() scans the folders and validates only files whose mtime or size changed, it is meant to run on a
+	  background thread while entries are listed. Files are validated with BatchValidate.validateProtocol, which
+	  neither logs nor touches the WelltoWell of the GUI.
+	"""
+
+	def __init__(self, num_wells, path):
+		self.num_wells = str(num_wells)
+		self.path = Path(path)
+		self.entries = {}
+		self._lock = threading.Lock()
+		try:
+			with open(self.path) as catalog:
+				saved = json.load(catalog)
+			if saved.get('version') == CATALOG_VERSION and saved.get('num_wells') == self.num_wells:
+				self.entries = saved['entries']
+		except FileNotFoundError:
+			pass
+		except (OSError, ValueError, KeyError) as err:
+			logging.warning('Rebuilding unreadable protocol catalog %s: %s' % (self.path, err))
+
+	def search(self, text='', status=None):
+		"""
+		Entries whose file name or destination plate contains text (ignoring case), optionally only those with the
+		given validation status, most recently modified first
+		"""
+		text = text.strip().lower()
+		with self._lock:
+			entries = list(self.entries.values())
+		return sorted((entry for entry in entries
+					   if (status is None or entry['status'] == status)
+					   and (text in entry['name'].lower() or text in (entry['dest_plate'] or '').lower())),
+					  key=lambda entry: -entry['mtime'])
+
+	def get(self, path):
+		with self._lock:
+			return self.entries.get(str(path))
+
+	def refresh(self, protocol_dir, records_dir):
+		"""
+		Brings the catalog up to date with the csv files of protocol_dir and the records of records_dir, and saves it
+
+		:return: number of protocols validated
+		"""
+		files = {}
+		with os.scandir(protocol_dir) as scan:
+			for item in scan:
+				if item.name.lower().endswith('.csv') and item.is_file():
+					stat = item.stat()
+					files[str(Path(protocol_dir) / item.name)] = (stat.st_mtime_ns, stat.st_size)
+		last_runs = lastRuns(records_dir)
+
+		num_validated = 0
+		for path, (mtime, size) in files.items():
+			entry = self.get(path)
+			if entry is None or entry['mtime'] != mtime or entry['size'] != size:
+				entry = catalogEntry(validateProtocol(path, self.num_wells), mtime, size)
+				num_validated += 1
+			else:
+				entry = dict(entry)
+			entry['last_run'] = last_runs.get(Path(path).stem, '')
+			with self._lock:
+				self.entries[path] = entry
+		with self._lock:
+			for path in [path for path in self.entries if path not in files]:
+				del self.entries[path]
+		self.save()
+		return num_validated
+
+	def save(self):
+		with self._lock:
+			saved = {'version': CATALOG_VERSION, 'num_wells': self.num_wells, 'entries': self.entries}
+			try:
+				self.path.parent.mkdir(parents=True, exist_ok=True)
+				fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, suffix='.tmp')
+				with os.fdopen(fd, 'w') as catalog:
+					json.dump(saved, catalog)
+				os.replace(tmp_path, self.path)
+			except OSError as err:
+				logging.warning('Failed to save protocol catalog %s: %s' % (self.path, err))
+
+
+def catalogEntry(report, mtime, size):
+	"""
+	Catalog entry of a BatchValidate report
+	"""
+	return {'path': report['file'], 'name': Path(report['file']).name, 'mtime': mtime, 'size': size,
+			'dest_plate': report['dest_plate'], 'num_plates': report['num_plates'],
+			'num_transfers': report['num_transfers'], 'status': report['status'],
+			'num_errors': len(report['errors']), 'errors': report['errors'][:5],
+			'validated': datetime.now().strftime('%Y-%m-%d %H:%M'), 'last_run': ''}
+
+
+def lastRuns(records_dir):
+	"""
+	Date of the latest transfer record or journal of each protocol in records_dir
+
+	:return: dict of protocol file stem -> 'YYYY-mm-dd HH:MM'
+	"""
+	latest = {}
+	try:
+		with os.scandir(records_dir) as scan:
+			for item in scan:
+				name = RECORD_NAME.match(item.name)
+				if name is not None and name.group('timestamp') > latest.get(name.group('stem'), ''):
+					latest[name.group('stem')] = name.group('timestamp')
+	except OSError as err:
+		logging.warning('Cannot list records in %s: %s' % (records_dir, err))
+	return {stem: datetime.strptime(stamp, '%Y_%m_%d_%H_%M_%S').strftime('%Y-%m-%d %H:%M')
+			for stem, stamp in latest.items()}
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Throughput and quality metrics over the transfer records of every session in a folder.
+
+Record files are parsed once: the transfers of each file are kept in an index next to the protocol cache, keyed by
+path, mtime and size, and a file is only parsed again when it is new or changed. Usage:
+
+	python -m RecordAnalytics
+	python -m RecordAnalytics records/ --output analytics/
+
+The folder defaults to 'records_dir' of the config. Two tables are printed, or written as csv files to --output:
+* sessions.csv: per session (one transfer record, or the journal of a session that never wrote one), the number
+  of transfers by status, the time from the first to the last finished transfer, transfers completed per minute
+  over that time, and the number and median duration of plate swaps: the time between the last transfer of a
+  source plate and the first transfer of the next one
+* plates.csv: per source plate, the number of transfers by status and the skip and fail rates
+"""
+
+import argparse, hashlib, json, logging, os, sys, tempfile, time, zipfile
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from TransferJournal import RECORD_HEADER, RECORD_NAME
+
+INDEX_VERSION = 1
+STATUS_NAMES = ('uncompleted', 'completed', 'skipped', 'failed', 'started')
+STATUS_CODE = {name: code for code, name in enumerate(STATUS_NAMES)}
+# arrays of an index entry, one value per transfer but for plate_names
+ENTRY_ARRAYS = ('plate_names', 'plate', 'status', 'timestamp')
+NO_TIMESTAMP = -1
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def parseRecordFile(path):
+	"""
+	Parses a transfer record or journal csv into arrays, keeping the last row of each transfer
+
+	:return: dict of ENTRY_ARRAYS: source plate names, the plate code, status code and timestamp (ms since the
+		epoch, NO_TIMESTAMP if unfinished) of each transfer
+
+	Raises ValueError if the file is not a transfer record
+	"""
+	df = pd.read_csv(path, dtype=str, keep_default_na=False)
+	if list(df.columns) != RECORD_HEADER:
+		raise ValueError('%s is not a transfer record' % path)
+	# journals hold one row per state change, the last one is the state of the transfer
+	df = df.drop_duplicates(subset=['Source plate', 'Source well', 'Destination well'], keep='last')
+	plate, plate_names = pd.factorize(df['Source plate'])
+	status = df['Status'].map(STATUS_CODE)
+	if status.isna().any():
+		raise ValueError('%s holds unknown transfer statuses' % path)
+	stamps = pd.to_datetime(df['Timestamp'].where(df['Timestamp'] != ''), format=TIMESTAMP_FORMAT)
+	timestamp = np.where(stamps.isna(), NO_TIMESTAMP, stamps.to_numpy(dtype='datetime64[ms]').astype(np.int64))
+	return {'plate_names': np.asarray(plate_names, dtype=str), 'plate': plate.astype(np.int32),
+			'status': status.to_numpy(dtype=np.int8), 'timestamp': timestamp.astype(np.int64)}
+
+
+def sessionFiles(records_dir):
+	"""
+	Record file of each session in a folder: its transfer record, or its journal if no record was written
+
+	:return: dict of session name (protocol stem and timestamp) -> path, sorted by name
+	"""
+	sessions = {}
+	for path in Path(records_dir).glob('*_transfer_*.csv'):
+		name = RECORD_NAME.match(path.name)
+		if name is None:
+			continue
+		session = '%s_%s' % (name.group('stem'), name.group('timestamp'))
+		if name.group('kind') == 'record' or session not in sessions:
+			sessions[session] = path
+	return dict(sorted(sessions.items()))
+
+
+class AnalyticsIndex:
+	"""
+	Persistent index of parsed record files, one .npz file of ENTRY_ARRAYS per record file and an index.json
+	mapping each record path to its mtime, size and entry. Entries are written atomically, like ProtocolCache.
+	"""
+
+	def __init__(self, index_dir):
+		self.index_dir = Path(index_dir)
+		self.index_path = self.index_dir / 'index.json'
+		self.files = {}
+		self.num_parsed = 0
+		try:
+			with open(self.index_path) as index:
+				saved = json.load(index)
+			if saved.get('version') == INDEX_VERSION:
+				self.files = saved['files']
+		except FileNotFoundError:
+			pass
+		except (OSError, ValueError, KeyError) as err:
+			logging.warning('Rebuilding unreadable analytics index %s: %s' % (self.index_path, err))
+
+	def entryPath(self, path):
+		return self.index_dir / (hashlib.sha1(str(path).encode()).hexdigest() + '.npz')
+
+	def load(self, path):
+		"""
+		Arrays of a record file, parsed again only if its mtime or size changed since it was indexed
+
+		Raises OSError or ValueError if the file cannot be parsed
+		"""
+		stat = os.stat(path)
+		known = self.files.get(str(path))
+		if known is not None and known['mtime'] == stat.st_mtime_ns and known['size'] == stat.st_size:
+			try:
+				with np.load(self.entryPath(path), allow_pickle=False) as entry:
+					return {name: entry[name] for name in ENTRY_ARRAYS}
+			except (OSError, ValueError, KeyError, zipfile.BadZipFile) as err:
+				logging.warning('Parsing %s again, its analytics entry is unreadable: %s' % (path, err))
+
+		arrays = parseRecordFile(path)
+		self.num_parsed += 1
+		self.index_dir.mkdir(parents=True, exist_ok=True)
+		entry_path = self.entryPath(path)
+		fd, tmp_path = tempfile.mkstemp(dir=self.index_dir, suffix='.tmp')
+		try:
+			with os.fdopen(fd, 'wb') as entry:
+				np.savez(entry, **arrays)
+			os.replace(tmp_path, entry_path)
+		except BaseException:
+			try:
+				os.remove(tmp_path)
+			except OSError:
+				pass
+			raise
+		self.files[str(path)] = {'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+		return arrays
+
+	def prune(self, paths):
+		"""
+		Removes the entries of record files that are not in paths any more
+		"""
+		keep = set(map(str, paths))
+		for path in [path for path in self.files if path not in keep]:
+			del self.files[path]
+			try:
+				os.remove(self.entryPath(path))
+			except OSError:
+				pass
+
+	def save(self):
+		self.index_dir.mkdir(parents=True, exist_ok=True)
+		fd, tmp_path = tempfile.mkstemp(dir=self.index_dir, suffix='.tmp')
+		with os.fdopen(fd, 'w') as index:
+			json.dump({'version': INDEX_VERSION, 'files': self.files}, index)
+		os.replace(tmp_path, self.index_path)
+
+
+def loadTransfers(records_dir, index):
+	"""
+	Transfers of every session in records_dir, through the index
+
+	:return: (session names, DataFrame of every transfer with its session, source plate, status and timestamp
+		codes), sessions whose files cannot be parsed are logged and left out
+	"""
+	files = sessionFiles(records_dir)
+	names, parts = [], []
+	for session, path in files.items():
+		try:
+			arrays = index.load(path)
+		except (OSError, ValueError) as err:
+			logging.warning('Skipping record %s: %s' % (path, err))
+			continue
+		parts.append((len(names), arrays))
+		names.append(session)
+	index.prune(files.values())
+
+	if not parts:
+		return names, pd.DataFrame({'session': np.empty(0, dtype=np.int64), 'plate': np.empty(0, dtype=object),
+									'status': np.empty(0, dtype=np.int8), 'timestamp': np.empty(0, dtype=np.int64)})
+	return names, pd.DataFrame({
+		'session': np.concatenate([np.full(len(arrays['plate']), session) for session, arrays in parts]),
+		'plate': np.concatenate([arrays['plate_names'][arrays['plate']] for _, arrays in parts]).astype(object),
+		'status': np.concatenate([arrays['status'] for _, arrays in parts]),
+		'timestamp': np.concatenate([arrays['timestamp'] for _, arrays in parts])})
+
+
+def statusCounts(df, by):
+	"""
+	Number of transfers with each status per group, with a transfers column holding the total
+	"""
+	counts = pd.crosstab(df[by], df['status']).reindex(columns=range(len(STATUS_NAMES)), fill_value=0)
+	counts.columns = list(STATUS_NAMES)
+	counts.insert(0, 'transfers', counts.sum(axis=1))
+	return counts
+
+
+def sessionTable(names, df):
+	"""
+	Per-session counts, throughput and plate swap times, see the module docstring
+	"""
+	table = statusCounts(df, 'session').reindex(range(len(names)), fill_value=0)
+	finished = df[df['timestamp'] != NO_TIMESTAMP]
+	span = finished.groupby('session')['timestamp'].agg(['min', 'max'])
+	minutes = ((span['max'] - span['min']) / 60000.0).reindex(table.index)
+	table['active_min'] = minutes.round(2)
+	table['completed_per_min'] = (table['completed'] / minutes.where(minutes > 0)).round(2)
+
+	# plate swaps: consecutive transfers actually performed (completed or failed) from different source plates.
+	# Skipped transfers are left out, the transfers skipped when moving on to the next plate share one timestamp.
+	performed = finished[finished['status'].isin([STATUS_CODE['completed'], STATUS_CODE['failed']])]
+	order = np.lexsort((performed['timestamp'].to_numpy(), performed['session'].to_numpy()))
+	session = performed['session'].to_numpy()[order]
+	plate = performed['plate'].to_numpy()[order]
+	timestamp = performed['timestamp'].to_numpy()[order]
+	swap = (session[1:] == session[:-1]) & (plate[1:] != plate[:-1])
+	swaps = pd.DataFrame({'session': session[1:][swap], 'seconds': (timestamp[1:] - timestamp[:-1])[swap] / 1000.0})
+	swap_stats = swaps.groupby('session')['seconds'].agg(['count', 'median'])
+	table['plate_swaps'] = swap_stats['count'].reindex(table.index, fill_value=0).astype(np.int64)
+	table['median_swap_s'] = swap_stats['median'].reindex(table.index).round(1)
+
+	table.index = pd.Index(names, name='session')
+	return table
+
+
+def plateTable(df):
+	"""
+	Per-source-plate counts and skip and fail rates, over every session
+	"""
+	table = statusCounts(df, 'plate')
+	table.index.name = 'source_plate'
+	table['skip_rate'] = (table['skipped'] / table['transfers']).round(3)
+	table['fail_rate'] = (table['failed'] / table['transfers']).round(3)
+	return table
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog='python -m RecordAnalytics',
+									 description='Throughput and quality metrics over transfer records')
+	parser.add_argument('folder', nargs='?', help='folder of transfer records (default: records_dir of the config)')
+	parser.add_argument('-c', '--config', default=os.path.join(os.getcwd(), 'wellLitConfig.json'),
+						help='WellLit config file (default: ./wellLitConfig.json)')
+	parser.add_argument('--index', help='index folder (default: analytics folder of the protocol cache)')
+	parser.add_argument('-o', '--output', help='write sessions.csv and plates.csv to this folder (default: print)')
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=logging.WARNING, format='%(asctime)s [%(levelname)s] - %(message)s')
+
+	folder, index_dir = args.folder, args.index
+	if folder is None or index_dir is None:
+		# read the folders from the config, a WelltoWell would open the transfer history database
+		from WellToWell import readConfig
+		configs = readConfig(args.config)
+		folder = folder or configs['records_dir']
+		index_dir = index_dir or Path(configs['cache_dir']) / 'analytics'
+
+	start = time.perf_counter()
+	index = AnalyticsIndex(index_dir)
+	names, df = loadTransfers(folder, index)
+	index.save()
+	sessions, plates = sessionTable(names, df), plateTable(df)
+	elapsed = time.perf_counter() - start
+
+	if args.output:
+		os.makedirs(args.output, exist_ok=True)
+		sessions.to_csv(os.path.join(args.output, 'sessions.csv'))
+		plates.to_csv(os.path.join(args.output, 'plates.csv'))
+	else:
+		with pd.option_context('display.max_rows', None, 'display.width', 200):
+			sys.stdout.write('%s\n\n%s\n' % (sessions.to_string(), plates.to_string()))
+	sys.stderr.write('%s sessions, %s transfers in %.2f s, %s record files parsed\n' % (
+		len(names), len(df), elapsed, index.num_parsed))
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+SQLite store of transfer history across runs.
+
+Every session (a protocol loaded or resumed) and every transfer state change journaled during it are written to
+one database, indexed by source plate and well, destination plate and well, and timestamp, so that the history of
+a well is one query away rather than spread over many record csv files. Usage:
+
+	python -m RecordStore records.db sessions
+	python -m RecordStore records.db history "Plate 1" A1
+	python -m RecordStore records.db history "Dest plate" B2 --dest
+	python -m RecordStore records.db export 3 -o test_sheet1_transfer_record.csv
+	python -m RecordStore records.db import records/
+
+export writes the latest state of every transfer of a session in the transfer record csv layout, import adds
+existing transfer record and journal csv files as sessions, skipping sessions already in the store.
+
+A protocol is stored once, with its transfers, and a session only records the state changes made during it.
+Sessions are identified by the protocol name and start time of their record and journal files, so a session
+recorded live and its record file imported later are one session.
+"""
+
+import argparse, csv, hashlib, json, logging, sqlite3, sys, threading
+from datetime import datetime
+from pathlib import Path
+from TransferJournal import RECORD_HEADER, RECORD_KEYS, RECORD_NAME, readRecordRows, transferKey, writeRecordRows
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS protocols (
+	id INTEGER PRIMARY KEY,
+	name TEXT NOT NULL,
+	dest_plate TEXT NOT NULL,
+	num_transfers INTEGER NOT NULL,
+	fingerprint TEXT NOT NULL,
+	UNIQUE (name, dest_plate, fingerprint)
+);
+CREATE TABLE IF NOT EXISTS transfers (
+	protocol_id INTEGER NOT NULL REFERENCES protocols (id),
+	transfer INTEGER NOT NULL,
+	source_plate TEXT NOT NULL,
+	source_well TEXT NOT NULL,
+	dest_well TEXT NOT NULL,
+	PRIMARY KEY (protocol_id, transfer)
+);
+CREATE TABLE IF NOT EXISTS sessions (
+	id INTEGER PRIMARY KEY,
+	protocol_id INTEGER NOT NULL REFERENCES protocols (id),
+	started TEXT NOT NULL,
+	session_key TEXT UNIQUE
+);
+CREATE TABLE IF NOT EXISTS events (
+	id INTEGER PRIMARY KEY,
+	session_id INTEGER NOT NULL REFERENCES sessions (id),
+	transfer INTEGER NOT NULL,
+	timestamp TEXT,
+	source_plate TEXT NOT NULL,
+	source_well TEXT NOT NULL,
+	dest_plate TEXT NOT NULL,
+	dest_well TEXT NOT NULL,
+	status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_source ON events (source_plate, source_well);
+CREATE INDEX IF NOT EXISTS events_dest ON events (dest_plate, dest_well);
+CREATE INDEX IF NOT EXISTS events_timestamp ON events (timestamp);
+CREATE INDEX IF NOT EXISTS events_session ON events (session_id, transfer);
+"""
+EVENT_COLUMNS = ('session_id', 'transfer', 'timestamp', 'source_plate', 'source_well', 'dest_plate', 'dest_well',
+				 'status')
+INSERT_EVENT = 'INSERT INTO events (%s) VALUES (%s)' % (', '.join(EVENT_COLUMNS), ', '.join('?' * len(EVENT_COLUMNS)))
+
+
+def sessionKey(path):
+	"""
+	Key of the session a transfer record or journal file belongs to, the same for both files of a session: protocol
+	file stem and start timestamp, or None if the file is not named like the records WelltoWell writes
+	"""
+	name = RECORD_NAME.match(Path(path).name)
+	if name is None:
+		return None
+	return '%s_%s' % (name.group('stem'), name.group('timestamp'))
+
+
+def protocolFingerprint(transfers):
+	"""
+	sha1 of the (source plate, source well, dest well) of every transfer of a protocol, in order
+	"""
+	return hashlib.sha1(json.dumps([list(map(str, transfer)) for transfer in transfers]).encode()).hexdigest()
+
+
+class RecordStore:
+	"""
+	Transfer history database. The connection is shared by the thread journaling transfers and the RecordWriter
+	thread committing them, every use of it holds the store's lock.
+	"""
+
+	def __init__(self, path):
+		self.path = Path(path)
+		self._lock = threading.Lock()
+		self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+		with self._lock:
+			# write ahead logging lets history queries read while a session is being written
+			self._db.execute('PRAGMA journal_mode=WAL')
+			self._db.executescript(SCHEMA)
+			self._db.commit()
+
+	def close(self):
+		with self._lock:
+			self._db.close()
+
+	def startSession(self, protocol_path, dest_plate, transfers, started, key=None, batch_size=20, syncer=None):
+		"""
+		Starts recording a session, or continues the session of key if it was recorded before, e.g. when an
+		interrupted session is resumed. The protocol is stored by file name, destination plate and transfers, so the
+		same protocol loaded from different folders is stored once.
+
+		:param transfers: (source plate, source well, dest well) of every transfer of the protocol, in order
+		:param key: session key, see sessionKey
+		:return: RecordSession, its created attribute is False for a continued session
+		"""
+		transfers = [tuple(map(str, transfer)) for transfer in transfers]
+		protocol = (Path(protocol_path).name, dest_plate, protocolFingerprint(transfers))
+		with self._lock, self._db:
+			row = self._db.execute('SELECT id FROM protocols WHERE name = ? AND dest_plate = ? AND fingerprint = ?',
+								   protocol).fetchone()
+			if row is None:
+				protocol_id = self._db.execute(
+					'INSERT INTO protocols (name, dest_plate, fingerprint, num_transfers) VALUES (?, ?, ?, ?)',
+					protocol + (len(transfers),)).lastrowid
+				self._db.executemany('INSERT INTO transfers (protocol_id, transfer, source_plate, source_well, '
+									 'dest_well) VALUES (?, ?, ?, ?, ?)',
+									 [(protocol_id, idx) + transfer for idx, transfer in enumerate(transfers)])
+			else:
+				protocol_id = row[0]
+			row = None
+			if key is not None:
+				row = self._db.execute('SELECT id FROM sessions WHERE session_key = ?', (key,)).fetchone()
+			if row is None:
+				session_id = self._db.execute('INSERT INTO sessions (protocol_id, started, session_key) VALUES (?, ?, ?)',
+											  (protocol_id, started, key)).lastrowid
+			else:
+				session_id = row[0]
+		session = RecordSession(self, session_id, batch_size=batch_size, syncer=syncer)
+		session.created = row is None
+		return session
+
+	def insertEvents(self, events):
+		"""
+		Inserts event rows (see EVENT_COLUMNS) in a single transaction
+		"""
+		with self._lock, self._db:
+			self._db.executemany(INSERT_EVENT, events)
+
+	def query(self, sql, parameters=()):
+		with self._lock:
+			return self._db.execute(sql, parameters).fetchall()
+
+	def sessions(self):
+		"""
+		:return: (session id, started, protocol file name, destination plate, number of transfers, number of events)
+			of every session, oldest first
+		"""
+		return self.query('SELECT sessions.id, started, name, dest_plate, num_transfers, '
+						  '(SELECT COUNT(*) FROM events WHERE session_id = sessions.id) '
+						  'FROM sessions JOIN protocols ON protocols.id = protocol_id ORDER BY sessions.id')
+
+	def wellHistory(self, plate, well, dest=False):
+		"""
+		Every event of a source well, or of a destination well if dest is set, oldest first
+
+		:return: list of (session id, record row) pairs, see RECORD_HEADER
+		"""
+		column = 'dest' if dest else 'source'
+		rows = self.query('SELECT session_id, %s FROM events WHERE %s_plate = ? AND %s_well = ? ORDER BY id' %
+						  (', '.join(RECORD_KEYS), column, column), (plate, well))
+		return [(row[0], list(row[1:])) for row in rows]
+
+	def sessionRecord(self, session_id):
+		"""
+		Latest state of every transfer of a session, in protocol order, as transfer record rows. Transfers without
+		events were never started.
+
+		:return: list of rows, empty for an unknown session
+		"""
+		rows = self.query(
+			'SELECT events.timestamp, transfers.source_plate, transfers.source_well, protocols.dest_plate, '
+			'transfers.dest_well, COALESCE(events.status, \'uncompleted\') '
+			'FROM sessions JOIN protocols ON protocols.id = sessions.protocol_id '
+			'JOIN transfers ON transfers.protocol_id = protocols.id '
+			'LEFT JOIN events ON events.id = (SELECT MAX(id) FROM events WHERE session_id = sessions.id '
+			'AND transfer = transfers.transfer) '
+			'WHERE sessions.id = ? ORDER BY transfers.transfer', (session_id,))
+		return [['' if value is None else value for value in row] for row in rows]
+
+	def exportRecord(self, session_id, path):
+		"""
+		Writes the transfer record csv of a session, in the layout written by TransferJournal.compact
+		"""
+		writeRecordRows(path, self.sessionRecord(session_id))
+
+	def importRecord(self, path, protocol_path=None):
+		"""
+		Adds a transfer record or journal csv as a session, unless its session was recorded or imported before, e.g.
+		from the other file of the session. The protocol and start time are taken from the file name when it is
+		named like the records WelltoWell writes.
+
+		:return: session id, or None if the session was already in the store
+		"""
+		path = Path(path)
+		key = sessionKey(path) or str(path.resolve())
+		with self._lock:
+			known = self._db.execute('SELECT id FROM sessions WHERE session_key = ?', (key,)).fetchone()
+		if known is not None:
+			return None
+		rows = list(readRecordRows(path).values())
+		if not rows:
+			return None
+		name = RECORD_NAME.match(path.name)
+		if name is not None:
+			protocol_path = protocol_path or name.group('stem') + '.csv'
+			started = name.group('timestamp')
+		else:
+			protocol_path = protocol_path or path.stem + '.csv'
+			started = datetime.fromtimestamp(path.stat().st_mtime).strftime('%Y_%m_%d_%H_%M_%S')
+		session = self.startSession(protocol_path, rows[0][3], [transferKey(row) for row in rows], started, key=key)
+		if not session.created:
+			return None
+		# transfers never started have no event. Unfinished transfers have an empty timestamp in record files, and
+		# a NULL one in the store.
+		self.insertEvents([(session.session_id, transfer, row[0] or None) + tuple(row[1:])
+						   for transfer, row in enumerate(rows) if row[5] != 'uncompleted'])
+		return session.session_id
+
+
+class RecordSession:
+	"""
+	Records the transfer state changes of one session, with the append/sync/close interface of a TransferJournal.
+	* Changes are buffered and inserted in one transaction per batch of batch_size, by syncer(session) if given,
+	  e.g. RecordWriter.sync
+	* Each event keeps the index of its transfer in the protocol, so the session record can be rebuilt in order
+	* Database errors never reach the caller, so the history never interrupts a protocol or its csv records: the
+	  first one is logged and the events are kept to be inserted with the next batch
+	"""
+
+	def __init__(self, store, session_id, batch_size=20, syncer=None):
+		self.store = store
+		self.session_id = session_id
+		self.path = store.path
+		self.batch_size = max(1, int(batch_size))
+		self.syncer = syncer
+		self.created = True
+		self.failing = False
+		self._pending = []
+		self._lock = threading.Lock()
+
+	def event(self, transfer):
+		return (self.session_id, int(transfer['unique_id'])) + tuple(transfer[key] for key in RECORD_KEYS)
+
+	def append(self, transfer):
+		with self._lock:
+			self._pending.append(self.event(transfer))
+			due = len(self._pending) >= self.batch_size
+		if due:
+			if self.syncer is not None:
+				self.syncer(self)
+			else:
+				self.sync()
+
+	def appendAll(self, transfers):
+		with self._lock:
+			self._pending.extend(self.event(transfer) for transfer in transfers)
+		self.sync()
+
+	def sync(self):
+		with self._lock:
+			events, self._pending = self._pending, []
+		if not events:
+			return
+		try:
+			self.store.insertEvents(events)
+		except sqlite3.Error as err:
+			with self._lock:
+				self._pending[:0] = events
+			if not self.failing:
+				logging.error('Cannot record %s transfer events to %s, retrying with the next batch: %s' % (
+					len(events), self.path, err))
+				self.failing = True
+			return
+		if self.failing:
+			logging.info('Recording transfer events to %s again' % self.path)
+			self.failing = False
+
+	def close(self):
+		self.sync()
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog='python -m RecordStore', description='Query the transfer history database')
+	parser.add_argument('database', help='database file, the record_db config entry')
+	commands = parser.add_subparsers(dest='command', required=True)
+	commands.add_parser('sessions', help='list the recorded sessions')
+	history = commands.add_parser('history', help='every recorded state of a well')
+	history.add_argument('plate')
+	history.add_argument('well')
+	history.add_argument('--dest', action='store_true', help='look up a destination well rather than a source well')
+	export = commands.add_parser('export', help='write the transfer record csv of a session')
+	export.add_argument('session', type=int)
+	export.add_argument('-o', '--output', required=True, help='record csv to write')
+	import_records = commands.add_parser('import', help='add transfer record and journal csv files as sessions')
+	import_records.add_argument('paths', nargs='+', help='csv files, or folders of csv files')
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=logging.WARNING, format='%(asctime)s [%(levelname)s] - %(message)s')
+	store = RecordStore(args.database)
+	try:
+		writer = csv.writer(sys.stdout, lineterminator='\n')
+		if args.command == 'sessions':
+			writer.writerow(['Session', 'Started', 'Protocol', 'Destination plate', 'Transfers', 'Events'])
+			writer.writerows(store.sessions())
+		elif args.command == 'history':
+			writer.writerow(['Session'] + RECORD_HEADER)
+			writer.writerows([session_id] + row for session_id, row in store.wellHistory(args.plate, args.well,
+																						 dest=args.dest))
+		elif args.command == 'export':
+			if not store.sessionRecord(args.session):
+				sys.stderr.write('Unknown session %s\n' % args.session)
+				return 1
+			store.exportRecord(args.session, args.output)
+		else:
+			paths = []
+			for path in map(Path, args.paths):
+				paths.extend(sorted(path.glob('*.csv')) if path.is_dir() else [path])
+			for path in paths:
+				try:
+					session_id = store.importRecord(path)
+				except (OSError, ValueError) as err:
+					sys.stderr.write('Skipped %s: %s\n' % (path, err))
+					continue
+				if session_id is not None:
+					sys.stderr.write('Imported %s as session %s\n' % (path, session_id))
+	finally:
+		store.close()
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
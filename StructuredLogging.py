@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import json, logging, logging.handlers, os, queue, sys
+from datetime import datetime
+
+LOG_NAME = 'WelltoWell_Log.jsonl'
+# structured fields of a record written as json keys when set, e.g. by logging.info(msg, extra={'action': 'next'})
+FIELDS = ('action', 'outcome', 'latency_ms', 'transfer', 'source_plate', 'source_well', 'dest_plate', 'dest_well',
+		  'status')
+
+
+class JsonLinesFormatter(logging.Formatter):
+	"""
+	Formats a record as one json object per line: time, level, logger, message and any FIELDS set on the record
+	"""
+
+	def format(self, record):
+		entry = {'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+				 'level': record.levelname, 'logger': record.name, 'message': record.getMessage()}
+		for field in FIELDS:
+			if hasattr(record, field):
+				entry[field] = getattr(record, field)
+		if record.exc_info and not record.exc_text:
+			record.exc_text = self.formatException(record.exc_info)
+		if record.exc_text:
+			entry['message'] += '\n' + record.exc_text
+		return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+	"""
+	QueueHandler over a bounded queue that never blocks the logging thread: records logged while the queue is full
+	are dropped and counted, and a warning with the number dropped is queued once there is room again
+	"""
+
+	def __init__(self, log_queue):
+		super(DroppingQueueHandler, self).__init__(log_queue)
+		self.dropped = 0
+		self._unreported = 0
+
+	def enqueue(self, record):
+		try:
+			if self._unreported:
+				self.queue.put_nowait(logging.makeLogRecord({
+					'name': 'logging', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+					'msg': '%s log records dropped, the log queue was full' % self._unreported}))
+				self._unreported = 0
+			self.queue.put_nowait(record)
+		except queue.Full:
+			self.dropped += 1
+			self._unreported += 1
+
+
+class LogListener(logging.handlers.QueueListener):
+	"""
+	QueueListener whose stop() gives up rather than failing or hanging when the log file stalls: it waits at most
+	stop_timeout seconds for room in a full queue to put its sentinel, then as long for the thread to finish
+	"""
+
+	def __init__(self, log_queue, *handlers, stop_timeout=10.0, **kwargs):
+		super(LogListener, self).__init__(log_queue, *handlers, **kwargs)
+		self.stop_timeout = stop_timeout
+
+	def enqueue_sentinel(self):
+		self.queue.put(self._sentinel, timeout=self.stop_timeout)
+
+	def stop(self):
+		"""
+		:return: True once every queued record is written, False if the thread is still stuck writing
+		"""
+		try:
+			self.enqueue_sentinel()
+		except queue.Full:
+			return False
+		self._thread.join(self.stop_timeout)
+		if self._thread.is_alive():
+			return False
+		self._thread = None
+		return True
+
+
+class LoggingSession:
+	"""
+	Routes the root logger through a DroppingQueueHandler to a QueueListener thread writing json lines to a log
+	file rotated at midnight, so that a slow or stalled disk, e.g. a network drive, never blocks a user action.
+	stop() restores the root logger and writes the queued records, waiting at most stop_timeout seconds for room in a
+	full queue.
+	"""
+
+	def __init__(self, log_dir, level=logging.INFO, queue_size=10000, backup_days=30, stop_timeout=10.0):
+		self.log_dir = log_dir
+		try:
+			os.makedirs(log_dir, exist_ok=True)
+			target = logging.handlers.TimedRotatingFileHandler(os.path.join(log_dir, LOG_NAME), when='midnight',
+																backupCount=backup_days, encoding='utf-8')
+		except OSError as err:
+			sys.stderr.write('Cannot write logs to %s, logging to stderr: %s\n' % (log_dir, err))
+			target = logging.StreamHandler()
+		target.setFormatter(JsonLinesFormatter())
+		self.target = target
+		self.handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+		self.listener = LogListener(self.handler.queue, target, respect_handler_level=True, stop_timeout=stop_timeout)
+
+		root = logging.getLogger()
+		self._saved = (root.handlers[:], root.level)
+		for handler in root.handlers[:]:
+			root.removeHandler(handler)
+		root.addHandler(self.handler)
+		root.setLevel(level)
+		self.listener.start()
+
+	def stop(self):
+		root = logging.getLogger()
+		root.removeHandler(self.handler)
+		handlers, level = self._saved
+		for handler in handlers:
+			root.addHandler(handler)
+		root.setLevel(level)
+		if not self.listener.stop():
+			# the listener is still stuck writing, leave its daemon thread and file handler to the end of the process
+			sys.stderr.write('Log file %s stalled, %s queued log records were not written\n' %
+							 (self.log_dir, self.handler.queue.qsize()))
+			return
+		# written straight to the file, the dropping handler could drop the count itself
+		if self.handler.dropped:
+			self.target.handle(logging.makeLogRecord({
+				'name': 'logging', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+				'msg': '%s log records were dropped in this session' % self.handler.dropped}))
+		self.target.close()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+import csv, io, locale, logging, os, queue, re, tempfile, threading
+from collections import OrderedDict
+from pathlib import Path
+
+RECORD_HEADER = ['Timestamp', 'Source plate', 'Source well', 'Destination plate', 'Destination well', 'Status']
+RECORD_KEYS = ['timestamp', 'source_plate', 'source_well', 'dest_plate', 'dest_well', 'status']
+# <protocol stem>_transfer_<record|journal>_<timestamp>.csv, as written by WelltoWell.recordPath
+RECORD_NAME = re.compile(r'^(?P<stem>.*)_transfer_(?P<kind>record|journal)_(?P<timestamp>\d{4}(_\d{2}){5})\.csv$')
+
+
+def transferKey(row):
+	"""
+	Key identifying a transfer in a record or journal row: (source plate, source well, dest well)
+	"""
+	return row[1], row[2], row[4]
+
+
+def readRecordRows(path, size=None, encoding=None):
+	"""
+	Reads a transfer record or journal file, keeping the last row written for each transfer.
+
+	:param path: path to a record or journal csv
+	:param size: only read the first size bytes of the file, decoded with encoding
+	:return: OrderedDict of transferKey -> row, in order of first appearance
+	"""
+	if size is None:
+		with open(path, mode='r', newline='') as record:
+			return parseRecordRows(record, path)
+	with open(path, mode='rb') as record:
+		text = record.read(size).decode(encoding or locale.getpreferredencoding(False))
+	return parseRecordRows(io.StringIO(text, newline=''), path)
+
+
+def parseRecordRows(record, path):
+	rows = OrderedDict()
+	reader = csv.reader(record)
+	header = next(reader, None)
+	if header != RECORD_HEADER:
+		raise ValueError('%s is not a transfer record' % path)
+	for row in reader:
+		# a crash mid-append can leave a truncated last line
+		if len(row) != len(RECORD_HEADER):
+			continue
+		rows[transferKey(row)] = row
+	return rows
+
+
+def writeRecordRows(path, rows):
+	"""
+	Writes a transfer record to a temporary file, then renames it over path, so that a crash never leaves a
+	truncated record
+	"""
+	path = Path(path)
+	fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.stem, suffix='.tmp')
+	try:
+		with os.fdopen(fd, mode='w', newline='') as logfile:
+			log_writer = csv.writer(logfile, delimiter=',', lineterminator='\n')
+			log_writer.writerow(RECORD_HEADER)
+			log_writer.writerows(rows)
+			logfile.flush()
+			os.fsync(logfile.fileno())
+		os.replace(tmp_path, path)
+	except BaseException:
+		try:
+			os.remove(tmp_path)
+		except OSError:
+			pass
+		raise
+
+
+class TransferJournal:
+	"""
+	Append-only journal of transfer state changes, in the same column layout as the transfer record.
+	* One line is appended for every status change and flushed to the OS immediately
+	* Lines are fsync'd to disk in batches of batch_size, by syncer(journal) if given, e.g. RecordWriter.sync
+	* compact() rebuilds a record csv holding the latest state of every transfer
+	Appending, syncing and compacting may happen on different threads.
+	"""
+
+	def __init__(self, path, batch_size=20, syncer=None):
+		self.path = Path(path)
+		self.batch_size = max(1, int(batch_size))
+		self.syncer = syncer
+		self._pending = 0
+		self._lock = threading.Lock()
+		new_file = not self.path.exists() or self.path.stat().st_size == 0
+		self._file = open(self.path, mode='a', newline='')
+		self._writer = csv.writer(self._file, delimiter=',', lineterminator='\n')
+		if new_file:
+			self._writer.writerow(RECORD_HEADER)
+			self._file.flush()
+
+	def append(self, transfer):
+		with self._lock:
+			self._writer.writerow([transfer[key] for key in RECORD_KEYS])
+			self._file.flush()
+			self._pending += 1
+			due = self._pending >= self.batch_size
+			if due:
+				self._pending = 0
+		if due:
+			if self.syncer is not None:
+				self.syncer(self)
+			else:
+				self.sync()
+
+	def appendAll(self, transfers):
+		"""
+		Appends a batch of transfers, e.g. the initial state of a newly loaded protocol, with a single fsync
+		"""
+		with self._lock:
+			self._writer.writerows([transfer[key] for key in RECORD_KEYS] for transfer in transfers)
+		self.sync()
+
+	def sync(self):
+		with self._lock:
+			if self._file.closed:
+				return
+			self._file.flush()
+			self._pending = 0
+			# fsync a duplicate descriptor outside the lock, so appends do not wait on the disk
+			fd = os.dup(self._file.fileno())
+		try:
+			os.fsync(fd)
+		finally:
+			os.close(fd)
+
+	def close(self):
+		self.sync()
+		with self._lock:
+			if not self._file.closed:
+				self._file.close()
+
+	def compact(self, record_path):
+		"""
+		Writes a transfer record with the latest state of each transfer in the journal, in protocol order.
+		Lines appended while the record is written are left for the next compaction.
+		"""
+		with self._lock:
+			if self._file.closed:
+				size = None
+			else:
+				self._file.flush()
+				size = os.fstat(self._file.fileno()).st_size
+		rows = readRecordRows(self.path, size=size, encoding=self._file.encoding)
+		writeRecordRows(record_path, rows.values())
+
+
+class RecordWriter:
+	"""
+	Writes transfer records and fsyncs journals on a background thread, so that user actions never wait on the disk.
+	* Requests queued while a write is in progress are coalesced: a burst of compactions of the same record is
+	  written once, from the latest state of the journal
+	* flush() waits for every queued request, e.g. before a protocol is finished or the program exits
+	* Errors are logged and kept, takeError() returns the first one since it was last called
+	"""
+
+	def __init__(self):
+		self._queue = queue.Queue()
+		self._thread = None
+		self._error = None
+
+	def start(self):
+		if self._thread is None or not self._thread.is_alive():
+			self._thread = threading.Thread(target=self._run, name='RecordWriter', daemon=True)
+			self._thread.start()
+
+	def compact(self, journal, record_path):
+		self.start()
+		self._queue.put(('compact', journal, Path(record_path)))
+
+	def sync(self, journal):
+		self.start()
+		self._queue.put(('sync', journal, None))
+
+	def flush(self):
+		if self._thread is not None and self._thread.is_alive():
+			self._queue.join()
+
+	def takeError(self):
+		"""
+		:return: (path, exception) of the first failed write since the last call, or None
+		"""
+		error, self._error = self._error, None
+		return error
+
+	def stop(self):
+		"""
+		Finishes every queued request and stops the thread
+		"""
+		if self._thread is not None and self._thread.is_alive():
+			self._queue.put(None)
+			self._thread.join()
+		self._thread = None
+
+	def _run(self):
+		while True:
+			batch = [self._queue.get()]
+			while True:
+				try:
+					batch.append(self._queue.get_nowait())
+				except queue.Empty:
+					break
+
+			# one request per journal sync or record, in order of their latest request
+			requests = OrderedDict()
+			for request in batch:
+				if request is not None:
+					key = (request[0], request[1] if request[0] == 'sync' else request[2])
+					requests.pop(key, None)
+					requests[key] = request
+			try:
+				for kind, journal, record_path in requests.values():
+					path = record_path if kind == 'compact' else getattr(journal, 'path', None)
+					try:
+						if kind == 'sync':
+							journal.sync()
+						else:
+							journal.compact(record_path)
+					except (OSError, ValueError) as err:
+						logging.error('Failed to write %s: %s' % (path, err))
+						self._keepError(path, err)
+					except Exception as err:
+						# a bad request must never stop the thread, flush() and stop() would wait on it forever
+						logging.exception('Unexpected error writing %s' % path)
+						self._keepError(path, err)
+			finally:
+				for _ in batch:
+					self._queue.task_done()
+			if None in batch:
+				return
+
+	def _keepError(self, path, err):
+		if self._error is None:
+			self._error = (path, err)
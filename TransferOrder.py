@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+# orders of the transfers within a source plate, see orderTransfers
+ORDERS = ('csv', 'serpentine', 'nearest', '2opt')
+# groups of transfers that keep their csv order relative to each other, see constraintBlocks
+CONSTRAINTS = ('none', 'dest_column', 'dest_row')
+
+
+def moveCosts(source_xy, dest_xy):
+	"""
+	Matrix of the cost of moving from one transfer to another: the distance travelled over the source plate plus the
+	distance travelled over the destination plate, in wells
+	"""
+	def distances(xy):
+		delta = xy[:, None, :] - xy[None, :, :]
+		return np.sqrt((delta ** 2).sum(axis=-1))
+	return distances(source_xy) + distances(dest_xy)
+
+
+def pathLength(costs, order):
+	order = np.asarray(order)
+	if len(order) < 2:
+		return 0.0
+	return float(costs[order[:-1], order[1:]].sum())
+
+
+def serpentineOrder(source_xy):
+	"""
+	Source wells row by row, alternating the direction of each row
+	"""
+	rows, cols = source_xy[:, 0], source_xy[:, 1]
+	return np.lexsort((np.where(rows % 2 == 0, cols, -cols), rows))
+
+
+def nearestNeighbourOrder(costs):
+	"""
+	Greedy path from the first transfer, always moving to the cheapest transfer not yet visited
+	"""
+	num_transfers = len(costs)
+	order = [0]
+	visited = np.zeros(num_transfers, dtype=bool)
+	visited[0] = True
+	for _ in range(num_transfers - 1):
+		step = np.where(visited, np.inf, costs[order[-1]])
+		nearest = int(np.argmin(step))
+		order.append(nearest)
+		visited[nearest] = True
+	return np.array(order, dtype=np.int64)
+
+
+def twoOptOrder(costs, order=None, max_passes=50):
+	"""
+	Improves an open path by reversing segments while that shortens it, keeping the first transfer in place.
+	Starts from the nearest neighbour path by default.
+	"""
+	order = nearestNeighbourOrder(costs) if order is None else np.array(order, dtype=np.int64)
+	num_transfers = len(order)
+	for _ in range(max_passes):
+		improved = False
+		for i in range(1, num_transfers - 1):
+			# reversing order[i:j + 1] replaces the moves (i - 1, i) and (j, j + 1) by (i - 1, j) and (i, j + 1)
+			j = np.arange(i + 1, num_transfers)
+			before = order[i - 1]
+			removed = costs[before, order[i]] + np.append(costs[order[j[:-1]], order[j[:-1] + 1]], 0.0)
+			added = costs[before, order[j]] + np.append(costs[order[i], order[j[:-1] + 1]], 0.0)
+			gain = removed - added
+			best = int(np.argmax(gain))
+			if gain[best] > 1e-9:
+				order[i:j[best] + 1] = order[i:j[best] + 1][::-1].copy()
+				improved = True
+		if not improved:
+			break
+	return order
+
+
+def constraintBlocks(dest_xy, constraint):
+	"""
+	Block number of each transfer. Blocks are performed in order of their first transfer in the csv, and only
+	transfers within a block are reordered: 'dest_column' fills the destination plate column by column in csv
+	order, 'dest_row' row by row, 'none' puts every transfer of the plate in one block.
+	"""
+	if constraint == 'dest_column':
+		keys = dest_xy[:, 1]
+	elif constraint == 'dest_row':
+		keys = dest_xy[:, 0]
+	else:
+		return np.zeros(len(dest_xy), dtype=np.int64)
+	_, first, blocks = np.unique(keys, return_index=True, return_inverse=True)
+	# renumber blocks by first appearance
+	rank = np.empty(len(first), dtype=np.int64)
+	rank[np.argsort(first, kind='stable')] = np.arange(len(first))
+	return rank[blocks]
+
+
+def orderTransfers(source_xy, dest_xy, method, constraint='none'):
+	"""
+	Orders the transfers of one source plate to shorten the path of the pipette over both plates
+
+	:param source_xy: grid coordinates of the source wells, in csv order
+	:param dest_xy: grid coordinates of the destination wells, in csv order
+	:param method: one of ORDERS
+	:param constraint: one of CONSTRAINTS
+	:return: order (indices into the csv order), path length in csv order, path length in the new order. The csv
+		order is kept if the heuristic does not shorten the path.
+	"""
+	num_transfers = len(source_xy)
+	costs = moveCosts(source_xy, dest_xy)
+	csv_order = np.arange(num_transfers)
+	if method == 'csv' or num_transfers < 3:
+		length = pathLength(costs, csv_order)
+		return csv_order, length, length
+
+	blocks = constraintBlocks(dest_xy, constraint)
+	order = []
+	for block in range(blocks.max() + 1):
+		members = np.flatnonzero(blocks == block)
+		block_costs = costs[np.ix_(members, members)]
+		if method == 'serpentine':
+			block_order = serpentineOrder(source_xy[members])
+		elif method == 'nearest':
+			block_order = nearestNeighbourOrder(block_costs)
+		else:
+			block_order = twoOptOrder(block_costs)
+		order.append(members[block_order])
+	order = np.concatenate(order)
+	before, after = pathLength(costs, csv_order), pathLength(costs, order)
+	# never make the path longer than the csv order, e.g. a serpentine over the source plate scattering the dest wells
+	if after >= before:
+		return csv_order, before, before
+	return order, before, after
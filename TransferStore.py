@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+import time
+from collections.abc import Mapping
+from datetime import datetime
+import numpy as np
+from WellLit.Transfer import TStatus
+
+# status codes stored in TransferStore.status
+STATUSES = list(TStatus)
+STATUS_CODE = {status: code for code, status in enumerate(STATUSES)}
+# statuses of a transfer that has not been finished, and so has no timestamp
+UNFINISHED = (TStatus.uncompleted, TStatus.started)
+NO_TIMESTAMP = -1
+# keys of a WellLit Transfer dict
+TRANSFER_KEYS = ('unique_id', 'source_plate', 'dest_plate', 'source_well', 'dest_well', 'timestamp', 'status')
+
+
+def formatTimestamp(ms):
+	"""
+	Formats milliseconds since the epoch the way transfer records are timestamped, or None if not set
+	"""
+	if ms == NO_TIMESTAMP:
+		return None
+	return datetime.fromtimestamp(ms / 1000.0).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+
+def parseTimestamp(timestamp):
+	"""
+	Inverse of formatTimestamp
+	"""
+	if not timestamp:
+		return NO_TIMESTAMP
+	return int(round(datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S.%f').timestamp() * 1000))
+
+
+class TransferView(Mapping):
+	"""
+	Transfer-compatible, read/write view of one transfer in a TransferStore.
+	Supports the dict keys of a WellLit Transfer, along with its status attribute, updateStatus and resetTransfer.
+	"""
+	__slots__ = ('store', 'idx')
+
+	def __init__(self, store, idx):
+		self.store = store
+		self.idx = idx
+
+	def __getitem__(self, key):
+		store, idx = self.store, self.idx
+		if key == 'unique_id':
+			return idx
+		if key == 'source_plate':
+			return store.plate_names[store.plate[idx]]
+		if key == 'dest_plate':
+			return store.dest_plate
+		if key == 'source_well':
+			return store.well_names[store.source_well[idx]]
+		if key == 'dest_well':
+			return store.well_names[store.dest_well[idx]]
+		if key == 'timestamp':
+			return formatTimestamp(store.timestamp[idx])
+		if key == 'status':
+			return self.status.name
+		raise KeyError(key)
+
+	def __iter__(self):
+		return iter(TRANSFER_KEYS)
+
+	def __len__(self):
+		return len(TRANSFER_KEYS)
+
+	def __repr__(self):
+		return repr(dict(self))
+
+	@property
+	def status(self):
+		return STATUSES[self.store.status[self.idx]]
+
+	def updateStatus(self, status):
+		self.store.updateStatus(self.idx, status)
+
+	def resetTransfer(self):
+		self.store.resetTransfer(self.idx)
+
+
+class TransferStore(Mapping):
+	"""
+	Columnar store of the transfers in a protocol, indexed by integer transfer index.
+	* Source plate and well names are stored once, transfers hold integer codes into plate_names and well_names
+	  (the well indices of the plate's PlateGeometry for a store built from a DataFrame)
+	* Transfers are grouped by source plate, each plate spans a contiguous index range
+	* Status codes and timestamps (ms since the epoch, NO_TIMESTAMP if unset) are kept in numpy arrays
+	* The number of finished transfers in each plate and the set of transfers with each status in each plate are
+	  kept up to date on every status change, so completion, remaining-count and membership queries never rescan
+	  the protocol
+	* Indexing the store returns a Transfer-compatible TransferView
+	"""
+
+	def __init__(self, plate_names, plate, well_names, source_well, dest_well, dest_plate=''):
+		self.plate_names = plate_names
+		self.plate = plate
+		self.well_names = well_names
+		self.source_well = source_well
+		self.dest_well = dest_well
+		self.dest_plate = dest_plate
+		self.status = np.full(len(plate), STATUS_CODE[TStatus.uncompleted], dtype=np.int8)
+		self.timestamp = np.full(len(plate), NO_TIMESTAMP, dtype=np.int64)
+		# transfers of plate p are plate_starts[p]:plate_starts[p + 1]
+		self.plate_starts = np.searchsorted(plate, np.arange(len(plate_names) + 1)).astype(np.int64)
+		self.plate_sizes = np.diff(self.plate_starts)
+		# incremented on every status change, for views caching results derived from the statuses
+		self.version = 0
+		# indices of transfers whose status changed since the last call to takeChanged
+		self.changed = set()
+		# ActionLog fed by updateStatus, set by the protocol
+		self.action_log = None
+		self.recount()
+
+	@classmethod
+	def fromDataFrame(cls, df, geometry, dest_plate=''):
+		"""
+		Builds a store from a validated transfer DataFrame with PlateName, SourceWell and DestWell columns.
+		Plates keep the order of their first appearance in the csv, transfers keep csv order within a plate.
+		Wells are stored as their index in the PlateGeometry, well_names is the geometry's table of names.
+
+		Raises ValueError if a well name is not a normalized name of a well of the geometry
+		"""
+		import pandas as pd
+		plate_codes, plate_names = pd.factorize(df['PlateName'].to_numpy())
+		order = np.argsort(plate_codes, kind='stable')
+		wells = []
+		for column in ('SourceWell', 'DestWell'):
+			indices = pd.Series(df[column].to_numpy()[order]).map(geometry.index)
+			if indices.isna().any():
+				raise ValueError('%s holds names that are not wells of a %s well plate' % (column, geometry.num_wells))
+			wells.append(indices.to_numpy(dtype=np.int32))
+		return cls(np.asarray(plate_names, dtype=object), plate_codes[order].astype(np.int32), geometry.names,
+				   wells[0], wells[1], dest_plate=dest_plate)
+
+	def reorder(self, order):
+		"""
+		Permutes the transfers of a newly built store, before any status change
+
+		:param order: permutation of the transfer indices that keeps every transfer within its plate's span
+		"""
+		order = np.asarray(order)
+		if not np.array_equal(self.plate[order], self.plate):
+			raise ValueError('Transfers can only be reordered within their plate')
+		self.source_well = self.source_well[order]
+		self.dest_well = self.dest_well[order]
+
+	def __getitem__(self, idx):
+		if not 0 <= idx < len(self.plate):
+			raise KeyError(idx)
+		return TransferView(self, int(idx))
+
+	def __iter__(self):
+		return iter(range(len(self.plate)))
+
+	def __len__(self):
+		return len(self.plate)
+
+	def __contains__(self, idx):
+		return isinstance(idx, (int, np.integer)) and 0 <= idx < len(self.plate)
+
+	def transferKeys(self):
+		"""
+		(source plate, source well, dest well) of every transfer, in index order
+		"""
+		return list(zip(self.plate_names[self.plate], self.well_names[self.source_well],
+						self.well_names[self.dest_well]))
+
+	def plateSpan(self, plate_idx):
+		return range(int(self.plate_starts[plate_idx]), int(self.plate_starts[plate_idx + 1]))
+
+	def recount(self):
+		"""
+		Rebuilds the finished counters and the per-plate status index from the arrays, after statuses are written to
+		the arrays directly
+		"""
+		finished = self.timestamp != NO_TIMESTAMP
+		self.plate_finished = np.bincount(self.plate[finished], minlength=len(self.plate_names)).astype(np.int64)
+		self.num_finished = int(finished.sum())
+
+		# members[plate_idx][status code] is the set of transfer indices in the plate with that status
+		self.members = []
+		for plate_idx in range(len(self.plate_names)):
+			span = self.plateSpan(plate_idx)
+			codes = self.status[span.start:span.stop]
+			plate_members = {code: set() for code in range(len(STATUSES))}
+			for code in np.unique(codes).tolist():
+				plate_members[code] = set((np.flatnonzero(codes == code) + span.start).tolist())
+			self.members.append(plate_members)
+		self.version += 1
+
+	def updateStatus(self, idx, status):
+		timestamp = NO_TIMESTAMP if status in UNFINISHED else int(time.time() * 1000)
+		old_code, old_timestamp = int(self.status[idx]), int(self.timestamp[idx])
+		self.restoreStatus(idx, STATUS_CODE[status], timestamp)
+		if self.action_log is not None:
+			self.action_log.append(idx, old_code, STATUS_CODE[status], old_timestamp, timestamp)
+
+	def restoreStatus(self, idx, code, timestamp):
+		"""
+		Sets the status code and timestamp of a transfer as they are, e.g. to undo a status change, without logging
+		it to the action log
+		"""
+		was_finished = self.timestamp[idx] != NO_TIMESTAMP
+		old_code, new_code = int(self.status[idx]), code
+		self.status[idx] = new_code
+		self.timestamp[idx] = timestamp
+
+		plate_idx = self.plate[idx]
+		change = int(self.timestamp[idx] != NO_TIMESTAMP) - int(was_finished)
+		if change:
+			self.plate_finished[plate_idx] += change
+			self.num_finished += change
+		if old_code != new_code:
+			self.members[plate_idx][old_code].discard(idx)
+			self.members[plate_idx][new_code].add(idx)
+		self.changed.add(idx)
+		self.version += 1
+
+	def takeChanged(self):
+		"""
+		Returns the indices of transfers whose status changed since the previous call, and clears them
+		"""
+		changed, self.changed = self.changed, set()
+		return changed
+
+	def resetTransfer(self, idx):
+		self.updateStatus(idx, TStatus.uncompleted)
+
+	def plateRemaining(self, plate_idx):
+		"""
+		Number of transfers in a plate that have not been finished
+		"""
+		return int(self.plate_sizes[plate_idx] - self.plate_finished[plate_idx])
+
+	def remaining(self):
+		"""
+		Number of transfers in the protocol that have not been finished
+		"""
+		return len(self.plate) - self.num_finished
+
+	def plateMembers(self, plate_idx, statuses):
+		"""
+		Sorted indices of the transfers in a plate with any of the given statuses
+		"""
+		plate_members = self.members[plate_idx]
+		return sorted(idx for status in statuses for idx in plate_members[STATUS_CODE[status]])
+
+	def withStatus(self, status, span=None):
+		"""
+		Indices of the transfers with the given status, optionally limited to a range of indices
+		"""
+		start, stop = (span.start, span.stop) if span is not None else (0, len(self.plate))
+		return np.flatnonzero(self.status[start:stop] == STATUS_CODE[status]) + start
+
+	def unfinished(self, span=None):
+		"""
+		Indices of the transfers that have not been completed, skipped or failed
+		"""
+		start, stop = (span.start, span.stop) if span is not None else (0, len(self.plate))
+		return np.flatnonzero(self.timestamp[start:stop] == NO_TIMESTAMP) + start
+
+
+class StatusLists(Mapping):
+	"""
+	Lazily materialized view of the transfer indices with each status, standing in for TransferProtocol.lists.
+	Each transfer is in exactly one list, the started transfer is not in 'uncompleted'.
+	A list is built from the store's per-plate status index when first read after a status change.
+	"""
+
+	def __init__(self, store):
+		self.store = store
+		self._cache = {}
+		self._version = -1
+
+	def __getitem__(self, name):
+		if self._version != self.store.version:
+			self._cache = {}
+			self._version = self.store.version
+		if name not in self._cache:
+			self._cache[name] = [idx for plate_idx in range(len(self.store.plate_names))
+								 for idx in self.store.plateMembers(plate_idx, (TStatus[name],))]
+		return self._cache[name]
+
+	def __iter__(self):
+		return iter(status.name for status in STATUSES)
+
+	def __len__(self):
+		return len(STATUSES)
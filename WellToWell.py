@@ -2,12 +2,312 @@
 # Joana Cabrera
 # 3/15/2020
 
-import logging, csv, uuid, datetime, os, re, json
-import pandas as pd
+import logging, csv, codecs, datetime, functools, os, re, json, sqlite3, time
 import numpy as np
 from datetime import datetime
 from pathlib import Path
-from WellLit.Transfer import Transfer, TransferProtocol, TError, TStatus, TConfirm
+from WellLit.Transfer import TransferProtocol, TError, TStatus, TConfirm
+from TransferJournal import TransferJournal, RecordWriter, RECORD_NAME, readRecordRows
+from RecordStore import RecordStore, sessionKey
+from TransferStore import TransferStore, StatusLists, STATUS_CODE, UNFINISHED, parseTimestamp
+from ProtocolCache import ProtocolCache, protocolKey
+from Instrumentation import RECORDER, Profiler, timed
+from TransferOrder import ORDERS, CONSTRAINTS, orderTransfers
+from PlateGeometry import PLATE_FORMATS, WELL_NAME, plateGeometry
+from ActionLog import ActionLog
+
+
+# columns of a protocol csv after the destination plate line
+PROTOCOL_COLUMNS = ['PlateName', 'SourceWell', 'DestWell']
+HEADER_WORDS = re.compile(r'plate|well|source|dest', re.IGNORECASE)
+# pandas is imported by the functions reading protocols rather than here, so that the GUI starts without waiting for it
+
+
+def readConfig(config_path):
+	"""
+	Reads a WellLit config file, replacing a protocol, records or cache folder that does not exist with the protocols,
+	records or cache folder of the working directory, as WelltoWell does
+
+	:return: dict of config entries
+	"""
+	with open(config_path) as json_file:
+		configs = json.load(json_file)
+	cwd = os.getcwd()
+	for key, default in (('protocol_dir', '/protocols/'), ('records_dir', '/records/'), ('cache_dir', '/cache/')):
+		if not os.path.isdir(configs.get(key, '')):
+			configs[key] = cwd + default
+	return configs
+
+
+def plateShape(num_wells):
+	"""
+	(rows, columns) of the plate format given by num_wells, defaulting to 96 wells
+	"""
+	geometry = plateGeometry(num_wells)
+	return geometry.num_rows, geometry.num_cols
+
+
+def normalizeWellNames(wells, num_wells):
+	"""
+	Normalizes a column of well names in one vectorized pass, e.g. 'b05' -> 'B5'
+
+	:param wells: pandas Series of well names
+	:param num_wells: plate format, '96', '384' or '1536'
+	:return: Series of normalized names, NaN where a name is missing or is not a well of the plate
+	"""
+	import pandas as pd
+	geometry = plateGeometry(num_wells)
+	# NO_WELL (-1) picks the NaN appended to the names
+	names = np.append(geometry.names, np.nan)
+	return pd.Series(names[geometry.wellIndices(wells)], index=wells.index, dtype=object)
+
+
+def invalidWellNames(df, num_wells):
+	"""
+	Normalizes the SourceWell and DestWell columns of a transfer DataFrame in place, see normalizeWellNames
+
+	:return: list of ('source' or 'destination', csv line number, well name or None if missing) of every missing
+		or invalid well name
+	"""
+	import pandas as pd
+	invalid = []
+	for column, label in [('SourceWell', 'source'), ('DestWell', 'destination')]:
+		normalized = normalizeWellNames(df[column], num_wells)
+		for row_idx in np.flatnonzero(normalized.isna().to_numpy()):
+			well_name = df[column].iat[row_idx]
+			invalid.append((label, int(df.index[row_idx]), None if pd.isna(well_name) else well_name))
+		df[column] = normalized
+	return invalid
+
+
+def duplicateRows(df, subset):
+	"""
+	Finds rows sharing the same values in the subset columns, in a single grouped pass
+
+	:param df: transfer DataFrame
+	:param subset: column name, or list of column names
+	:return: dict of duplicated value (tuple for a list of columns) -> list of index labels (csv line numbers for a
+		DataFrame from readProtocolCsv) of the rows with that value
+	"""
+	mask = df.duplicated(subset=subset, keep=False).to_numpy()
+	if not mask.any():
+		return {}
+	# rows with a missing or invalid well name are not duplicates of each other
+	dupes = df.loc[mask, subset if isinstance(subset, list) else [subset]].dropna()
+	return {key: [int(idx) for idx in indices] for key, indices in dupes.groupby(subset, sort=False).groups.items()}
+
+
+def wellNameErrors(invalid, num_wells):
+	"""
+	Messages for the missing or invalid well names found by invalidWellNames
+
+	:return: summary message (None if there are no invalid names), list of one message per name
+	"""
+	errors = []
+	for label, line, well_name in invalid:
+		if well_name is None:
+			errors.append('Missing %s well name in row %s' % (label, line))
+		else:
+			errors.append('Invalid %s well name %s in row %s' % (label, well_name, line))
+	if not errors:
+		return None, errors
+	return 'CSV file has %s missing or invalid well names for a %s well plate' % (len(errors), num_wells), errors
+
+
+def duplicateWellErrors(source_dupes, dest_dupes):
+	"""
+	Messages for the duplicated source and destination wells found by duplicateRows
+
+	:return: summary message (None if there are no duplicates), list of one message per duplicated well
+	"""
+	errors = []
+	for (plate, well), indices in source_dupes.items():
+		errors.append('SourceWell %s of plate %s is duplicated in rows %s' % (well, plate, indices))
+	for well, indices in dest_dupes.items():
+		errors.append('DestWell %s is duplicated in rows %s' % (well, indices))
+	if source_dupes and dest_dupes:
+		return 'CSV file has duplicate well sources and destinations', errors
+	if source_dupes:
+		return 'CSV file has duplicate well sources', errors
+	if dest_dupes:
+		return 'CSV file has duplicate well destinations', errors
+	return None, errors
+
+
+def validateTransfers(df, num_wells):
+	"""
+	Normalizes the well names of a transfer DataFrame in place, then runs the checks of WelltoWell.checkWellNames
+	and WelltoWell.checkDuplicates without logging, so that it can run on any thread
+
+	:return: summary message and list of errors of the first check that fails, (None, []) if the transfers are valid
+	"""
+	summary, errors = wellNameErrors(invalidWellNames(df, num_wells), num_wells)
+	if summary is None:
+		summary, errors = duplicateWellErrors(duplicateRows(df, ['PlateName', 'SourceWell']),
+											  duplicateRows(df, 'DestWell'))
+	return summary, errors
+
+
+def detectEncoding(path):
+	"""
+	Encoding of a protocol csv from its byte order mark, 'utf-8' if it has none
+	"""
+	with open(path, 'rb') as protocol:
+		head = protocol.read(4)
+	if head.startswith(codecs.BOM_UTF8):
+		return 'utf-8-sig'
+	if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+		return 'utf-16'
+	return 'utf-8'
+
+
+def isHeaderRow(fields):
+	"""
+	True for a column header row such as 'source plate,source well,destination well'
+	"""
+	return (len(fields) >= 3 and HEADER_WORDS.search(' '.join(fields)) is not None
+			and re.match(WELL_NAME, fields[1]) is None and re.match(WELL_NAME, fields[2]) is None)
+
+
+def readProtocolRows(path, encoding):
+	"""
+	Reads a protocol csv with the given encoding, see readProtocolCsv
+	"""
+	import pandas as pd
+	dest_plate = None
+	line_no = 0
+	with open(path, mode='r', newline='', encoding=encoding) as protocol:
+		# the destination plate line and column header are parsed here, the transfer rows that follow are handed to
+		# pandas' C parser, continuing from the same position in the file
+		while True:
+			position = protocol.tell()
+			line = protocol.readline()
+			if not line:
+				break
+			fields = [field.strip() for field in next(csv.reader([line]), [])][:len(PROTOCOL_COLUMNS)]
+			if not any(fields):
+				line_no += 1
+				continue
+			if dest_plate is None and not any(fields[1:]):
+				dest_plate = fields[0]
+			elif not isHeaderRow(fields):
+				protocol.seek(position)
+				break
+			line_no += 1
+
+		df = pd.read_csv(protocol, header=None, names=PROTOCOL_COLUMNS, usecols=range(len(PROTOCOL_COLUMNS)),
+						 dtype=str, keep_default_na=False, na_values=[''], skip_blank_lines=False)
+
+	# index rows by their line number in the file
+	df.index = pd.Index(np.arange(len(df)) + line_no + 1, name='Line')
+	# strip plate names once per distinct name rather than once per row, a name of spaces is a missing name
+	codes, names = pd.factorize(df['PlateName'])
+	names = np.append(np.asarray([name.strip() or np.nan for name in names], dtype=object), np.nan)
+	df['PlateName'] = names[codes]
+	# drop blank rows, including rows of spaces, only looking at the wells of rows without a plate name
+	unnamed = df.loc[df['PlateName'].isna(), PROTOCOL_COLUMNS[1:]]
+	if len(unnamed) > 0:
+		blank = unnamed.apply(lambda wells: wells.fillna('').str.strip() == '').all(axis=1)
+		df = df.drop(blank.index[blank.to_numpy()])
+	return dest_plate, df
+
+
+def readProtocolCsv(path):
+	"""
+	Reads a protocol csv in a single pass. The file may start with a byte order mark, a line holding
+	only the destination plate name, and a column header row, in that order. Blank rows are ignored. Files that
+	are not utf-8 are read as Windows-1252, the encoding Excel saves csv files with.
+
+	:param path: protocol csv
+	:return: destination plate name (None if the file has no destination line),
+		DataFrame of PlateName, SourceWell and DestWell indexed by line number in the csv
+
+	Raises OSError if the file cannot be read, ValueError if it cannot be decoded or parsed
+	"""
+	encoding = detectEncoding(path)
+	try:
+		try:
+			return readProtocolRows(path, encoding)
+		except UnicodeDecodeError:
+			if encoding != 'utf-8':
+				raise
+			return readProtocolRows(path, 'cp1252')
+	except csv.Error as err:
+		raise ValueError(str(err))
+
+
+def readProtocolFile(csv):
+	"""
+	Reads a protocol csv and checks that it holds transfers, all with a source plate, without logging
+
+	:return: destination plate name as read from the csv (None if it has no destination line), DataFrame of
+		transfers
+
+	Raises TError holding the message for the user if the file cannot be read or holds no transfers
+	"""
+	try:
+		dest_plate, df = readProtocolCsv(csv)
+	except (OSError, ValueError) as err:
+		raise TError('Failed to load file csv \n %s \n %s' % (csv, err))
+	if len(df) == 0:
+		raise TError('No transfers found in csv file \n %s' % csv)
+	missing = df.index[df['PlateName'].isna()]
+	if len(missing) > 0:
+		raise TError('CSV file has %s rows without a source plate name, in rows %s' % (len(missing), list(missing)))
+	return dest_plate, df
+
+
+class LoadCancelled(Exception):
+	"""
+	Raised inside WelltoWell.prepareLoad when loading is cancelled
+	"""
+
+
+class LoadOutcome:
+	"""
+	Result of WelltoWell.prepareLoad, handed from a loading thread back to the UI thread
+	* error holds the TError raised if the csv could not be read or is invalid
+	* cancelled is True if loading was cancelled before it finished
+	* otherwise store holds the validated transfers, ready for WelltoWell.commitLoad
+	* message is the status message for the user, shown by commitLoad
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self.dest_plate = None
+		self.df = None
+		self.store = None
+		self.cached = False
+		self.error = None
+		self.message = None
+		self.cancelled = False
+
+	@property
+	def ok(self):
+		return self.error is None and not self.cancelled and self.store is not None
+
+
+def userAction(name):
+	"""
+	Decorator logging a user action as a structured record once it is done, see WelltoWell.logAction
+	"""
+	def decorate(method):
+		@functools.wraps(method)
+		def wrapper(self, *args, **kwargs):
+			uid = self.tp.current_uid if self.tp is not None else None
+			start = time.perf_counter()
+			outcome = 'error'
+			try:
+				result = method(self, *args, **kwargs)
+				outcome = 'ok'
+				return result
+			except TConfirm:
+				outcome = 'confirm'
+				raise
+			finally:
+				self.logAction(name, outcome, uid, time.perf_counter() - start)
+		return wrapper
+	return decorate
 
 
 class WelltoWell:
@@ -16,7 +316,7 @@ class WelltoWell:
 	* Loads a csv file into a pandas DataFrame, checking for duplicates or invalid Well labels
 	* Parses a validated DataFrame into a TransferProtocol
 	* Passes user commands (next, skip etc) to TransferProtocol
-	* Writes Transfers to transferlog.csv
+	* Appends every transfer state change to a journal, compacted into a transfer record csv on demand
 
 	Raises TError if user incorrectly specifies csv source file, or uses gui before transfer is loaded
 	"""
@@ -28,22 +328,46 @@ class WelltoWell:
 		self.tp = None
 		self.timestamp = ''
 		self.dest_plate = ''
+		self.journal = None
+		self.record_session = None
+		# writes transfer records and journal fsyncs off the calling thread
+		self.record_writer = RecordWriter()
 		cwd = os.getcwd()
-		
-		with open(config_path) as json_file:
-			configs = json.load(json_file)
+		configs = readConfig(config_path)
 
 		self.save_path = configs['records_dir']
 		self.load_path = configs['protocol_dir']
 		self.num_wells = configs['num_wells']
-
-		if not os.path.isdir(self.save_path):
-			self.save_path = cwd + '/records/'
-
-		if not os.path.isdir(self.load_path):
-			self.load_path = cwd + '/protocols/'
+		self.journal_batch_size = configs.get('journal_batch_size', 20)
+		# a keyboard shortcut pressed again within this many ms is ignored by the GUI
+		self.key_debounce_ms = configs.get('key_debounce_ms', 100)
+		self.cache = ProtocolCache(configs['cache_dir'], max_bytes=configs.get('cache_max_mb', 64) * 2 ** 20)
+		RECORDER.enabled = bool(configs.get('timing_enabled', False))
+		self.profile_mode = configs.get('profile_mode', '')
+		# latency histograms and profiles go to a subfolder of the log directory, away from the transfer records
+		self.timings_dir = os.path.join(configs.get('log_dir', '') or os.path.join(cwd, 'logs'), 'timings')
+		self.profiler = None
+		self.transfer_order = configs.get('transfer_order', 'csv')
+		self.transfer_order_constraint = configs.get('transfer_order_constraint', 'none')
+		if self.transfer_order not in ORDERS:
+			logging.warning('Unknown transfer_order %s, keeping csv order' % self.transfer_order)
+			self.transfer_order = 'csv'
+		if self.transfer_order_constraint not in CONSTRAINTS:
+			logging.warning('Unknown transfer_order_constraint %s, ignoring it' % self.transfer_order_constraint)
+			self.transfer_order_constraint = 'none'
+
+		# optional database of the transfer history of every session, see RecordStore. Tools that never run a
+		# protocol, e.g. batch validation, read the config with readConfig and leave it closed
+		self.record_store = None
+		record_db = configs.get('record_db', '')
+		if record_db:
+			try:
+				self.record_store = RecordStore(record_db)
+			except (OSError, sqlite3.Error) as err:
+				logging.error('Cannot open transfer history database %s, history is not recorded: %s' % (record_db, err))
 
 	def reset(self):
+		self.closeJournal()
 		self.csv = ''
 		self.msg = ''
 		self.df = None
@@ -64,30 +388,50 @@ class WelltoWell:
 			self.log('No Transfer Protocol loaded. \n Load a CSV file to begin')
 			raise TError(self.msg)
 
+	@timed('wtw.next')
+	@userAction('next')
 	def next(self):
 		if self.tp_present():
 			self.tp.next()
 
+	@timed('wtw.skip')
+	@userAction('skip')
 	def skip(self):
 		if self.tp_present():
 			self.tp.skip()
 
+	@timed('wtw.failed')
+	@userAction('failed')
 	def failed(self):
 		if self.tp_present():
 			self.tp.failed()
 
+	@timed('wtw.undo')
+	@userAction('undo')
 	def undo(self):
 		if self.tp_present():
 			self.tp.undo()
 
+	@timed('wtw.redo')
+	@userAction('redo')
+	def redo(self):
+		if self.tp_present():
+			self.tp.redo()
+
+	@timed('wtw.nextPlate')
+	@userAction('nextPlate')
 	def nextPlate(self):
 		if self.tp_present():
 			self.tp.nextPlate()
 
+	@timed('wtw.nextPlateOverride')
+	@userAction('nextPlateOverride')
 	def nextPlateOverride(self):
 		if self.tp_present():
 			self.tp.nextPlateOverride()
 
+	@timed('wtw.nextPlateConfirm')
+	@userAction('nextPlateConfirm')
 	def nextPlateConfirm(self):
 		if self.tp_present():
 			self.tp.nextPlateConfirm()
@@ -96,158 +440,447 @@ class WelltoWell:
 		self.msg = msg
 		logging.info(msg)
 
+	def logAction(self, action, outcome, uid, seconds):
+		"""
+		Logs a user action with structured fields: the action, its outcome ('ok', 'confirm' or 'error'), how long it
+		took, and the index, plate, wells and resulting status of the transfer that was current when it started
+		"""
+		fields = {'action': action, 'outcome': outcome, 'latency_ms': round(seconds * 1000.0, 3)}
+		if self.tp is not None and uid in self.tp.transfers:
+			transfer = self.tp.transfers[uid]
+			fields.update(transfer=int(uid), source_plate=transfer['source_plate'],
+						  source_well=transfer['source_well'], dest_plate=transfer['dest_plate'],
+						  dest_well=transfer['dest_well'], status=transfer['status'])
+		logging.info('Action %s: %s' % (action, outcome), extra=fields)
+
+	def startProfiling(self):
+		"""
+		Starts the capture set by the 'profile_mode' config entry, if any: 'cprofile' or 'tracemalloc'
+		"""
+		if self.profile_mode and self.profiler is None:
+			try:
+				os.makedirs(self.timings_dir, exist_ok=True)
+			except OSError as err:
+				logging.error('Cannot write profiles to %s, profiling disabled: %s' % (self.timings_dir, err))
+				return
+			self.profiler = Profiler(self.profile_mode, self.timings_dir)
+			self.profiler.start()
+
+	def reportTimings(self, path=None):
+		"""
+		Appends the latency histograms of the session to the log and writes them as JSON, then stops profiling
+
+		:param path: JSON file, defaults to WelltoWell_timings_<timestamp>.json in the timings directory
+		"""
+		if self.profiler is not None:
+			self.profiler.stop()
+			self.profiler = None
+		if not RECORDER.samples:
+			return
+		RECORDER.logSummary()
+		try:
+			if path is None:
+				os.makedirs(self.timings_dir, exist_ok=True)
+				path = os.path.join(self.timings_dir,
+									'WelltoWell_timings_%s.json' % datetime.now().strftime('%Y_%m_%d_%H_%M_%S'))
+			RECORDER.exportJson(path)
+			logging.info('Latency histograms written to %s' % path)
+		except OSError as err:
+			logging.error('Cannot write latency histograms to %s: %s' % (path, err))
+
 	def finishTransferProtocol(self):
 		self.timestamp = ''
 
 	def loadCsv(self, csv):
 		"""
-		Validates a csv file as being free of duplicates before loading constructing a TransferProtocol from it
+		Validates a csv file as being free of duplicates before loading constructing a TransferProtocol from it.
+		A protocol already validated with the same contents and plate format is loaded from the protocol cache
+		instead, without parsing or validating it again; self.df is None in that case.
 
 		:param csv: absolute path to csv to be used
 
 		Raises TError if there are problems importing the file
 		Raises TConfirm if the file loads successfully
 		"""
+		raise TConfirm(self.commitLoad(self.prepareLoad(csv)))
+
+	@timed('wtw.prepareLoad')
+	def prepareLoad(self, csv, progress=None, cancel=None):
+		"""
+		Parses and validates a protocol csv into a LoadOutcome without changing the loaded protocol or the messages
+		of this WelltoWell, so that it can run on a worker thread while the current protocol is in use. The outcome
+		is applied with commitLoad.
+
+		:param csv: absolute path to csv to be used
+		:param progress: called with the name of each stage completed: 'parsed', 'validated' and 'built'
+		:param cancel: threading.Event, loading stops at the next stage once it is set
+		:return: LoadOutcome, holding the TError raised by validation if the csv is invalid
+		"""
+		outcome = LoadOutcome(csv)
+
+		def stage(name):
+			if cancel is not None and cancel.is_set():
+				raise LoadCancelled()
+			if progress is not None:
+				progress(name)
+
 		try:
-			# read the first line of the csv as the destination plate name
-			self.dest_plate = list(pd.read_csv(csv, nrows=0))[0]
-			self.df = pd.read_csv(csv, skiprows=1, names=['PlateName', 'SourceWell', 'DestWell'])
-			self.log('CSV file %s loaded' % csv)
-			self.csv = csv
-		except:
-			self.log('Failed to load file csv \n %s' % csv)
-			raise TError(self.msg)
+			try:
+				key = protocolKey(csv, self.num_wells)
+			except OSError:
+				key = None
+			cached = self.cache.get(key) if key is not None else None
+
+			if cached is not None:
+				outcome.dest_plate, outcome.store = cached
+				outcome.cached = True
+				stage('parsed')
+				stage('validated')
+			else:
+				outcome.dest_plate, outcome.df = readProtocolFile(csv)
+				stage('parsed')
+				summary, errors = validateTransfers(outcome.df, self.num_wells)
+				if summary is not None:
+					outcome.message = summary
+					raise TError(summary + '\n' + '\n'.join(errors))
+				stage('validated')
+				outcome.store = TransferStore.fromDataFrame(outcome.df, plateGeometry(self.num_wells))
+				if key is not None:
+					self.cache.put(key, outcome.dest_plate, outcome.store)
+			# the cache holds transfers in csv order, so the order can be changed without invalidating it
+			self.orderTransfers(outcome.store)
+			stage('built')
+			outcome.message = 'CSV file %s loaded%s' % (csv, ' from protocol cache' if outcome.cached else '')
+		except TError as err:
+			outcome.error = err
+			# errors reading the file are their own summary
+			if outcome.message is None:
+				outcome.message = str(err)
+		except LoadCancelled:
+			logging.info('Loading of %s cancelled' % csv)
+			outcome.cancelled = True
+		return outcome
+
+	@timed('wtw.orderTransfers')
+	def orderTransfers(self, store):
+		"""
+		Reorders the transfers of each source plate of a newly built store with the 'transfer_order' heuristic,
+		logging the projected pipette path length over both plates before and after
+		"""
+		if self.transfer_order == 'csv':
+			return
+		order = np.arange(len(store))
+		before = after = 0.0
+		well_xy = plateGeometry(self.num_wells).coordinates
+		for plate_idx in range(len(store.plate_names)):
+			span = store.plateSpan(plate_idx)
+			plate_order, plate_before, plate_after = orderTransfers(
+				well_xy[store.source_well[span.start:span.stop]], well_xy[store.dest_well[span.start:span.stop]],
+				self.transfer_order, self.transfer_order_constraint)
+			order[span.start:span.stop] = plate_order + span.start
+			before += plate_before
+			after += plate_after
+		store.reorder(order)
+		logging.info('Transfer order %s (%s): projected path length %.1f -> %.1f wells (%.0f%%)' % (
+			self.transfer_order, self.transfer_order_constraint, before, after,
+			100.0 * (after - before) / before if before else 0.0))
+
+	def commitLoad(self, outcome):
+		"""
+		Makes the protocol of a successful LoadOutcome the loaded protocol and opens its journal. The messages of the
+		outcome are logged here, on the thread the protocol is used from.
 
-		hasSourDupes, msg_s = self.checkDuplicateSource()
-		self.checkWellNames()
-		if hasSourDupes:
-			self.log('CSV file has duplicate well sources')
-			raise TError(self.msg)
-		else:
-			self.tp = WTWTransferProtocol(wtw=self, df=self.df)
-			self.log('TransferProtocol with %s transfers in %s plates created' %
-					 (self.tp.num_transfers, self.tp.num_plates))
-			self.timestamp = datetime.now().strftime('%Y_%m_%d_%H_%M_%S')
-			load_plate_msg = '\n Please load plate ' + self.tp.current_plate_name + ' to begin'
-			raise TConfirm(self.msg + load_plate_msg)
-
-	def checkWellNames(self):
-		if self.num_wells == "384":
-			for row_idx, well_name in enumerate(list(self.df['SourceWell'])):
-				if well_name == np.nan:
-					raise TError('Missing well name in row %s or improperly formatted csv' % str(row_idx + 2))
-				# strip off leading zeros from well names
-				well_name = well_name[0] + well_name[1:].lstrip('0')
-				self.df['SourceWell'][row_idx] = well_name
-
-				if not re.match(r'([a-p]|[A-P])([1-9](?!.)|1[0-9]|2[0-4])', well_name):
-					raise TError('Invalid source well name %s in row %s of csv file' % (well_name, str(row_idx + 2)))
-
-			for row_idx, well_name in enumerate(list(self.df['DestWell'])):
-				if well_name == np.nan:
-					raise TError('Missing well name in row %s or improperly formatted csv' % str(row_idx + 2))
-
-				well_name = well_name[0] + well_name[1:].lstrip('0')
-				self.df['DestWell'][row_idx] = well_name
-				if not re.match(r'([a-p]|[A-P])([1-9](?!.)|1[0-9]|2[0-4])', well_name):
-					raise TError(
-						'Invalid destination well name %s in row %s of csv file' % (well_name, str(row_idx + 2)))
+		:return: message for the user
 
-		else:
-			for row_idx, well_name in enumerate(list(self.df['SourceWell'])):
-				if well_name == np.nan:
-					raise TError('Missing well name in row %s or improperly formatted csv' %str(row_idx + 2))
+		Raises the TError of a failed LoadOutcome
+		"""
+		if outcome.error is not None:
+			self.log(outcome.message)
+			raise outcome.error
+		logging.info(outcome.message)
+		self.reset()
+		self.csv = outcome.path
+		self.df = outcome.df
+		self.dest_plate = self.destPlateName(outcome.path, outcome.dest_plate)
+		outcome.store.dest_plate = self.dest_plate
+		self.tp = WTWTransferProtocol(wtw=self, store=outcome.store)
+
+		self.log('TransferProtocol with %s transfers in %s plates created' %
+				 (self.tp.num_transfers, self.tp.num_plates))
+		self.timestamp = datetime.now().strftime('%Y_%m_%d_%H_%M_%S')
+		self.openJournal()
+		return self.msg + '\n Please load plate ' + self.tp.current_plate_name + ' to begin'
+
+	def readCsv(self, csv):
+		"""
+		Reads the destination plate name and the transfers of a protocol csv into self.dest_plate and self.df.
+		Sheets without a destination plate line are named after the file.
 
-				well_name = well_name[0] + well_name[1:].lstrip('0')
-				self.df['SourceWell'][row_idx] = well_name
+		Raises TError if the file cannot be read or holds no transfers
+		"""
+		dest_plate, df = self.readProtocol(csv)
+		self.dest_plate = self.destPlateName(csv, dest_plate)
+		self.df = df
+		self.csv = csv
 
-				if not re.match(r'([a-h]|[A-H])([1-9](?!.)|1[0-2])', well_name):
-					raise TError('Invalid source well name %s in row %s of csv file' %(well_name, str(row_idx + 2)))
+	def readProtocol(self, csv):
+		"""
+		Reads a protocol csv with readProtocolFile, logging the outcome as the current message, see readCsv
 
-			for row_idx, well_name in enumerate(list(self.df['DestWell'])):
-				if well_name == np.nan:
-					raise TError('Missing well name in row %s or improperly formatted csv' % str(row_idx + 2))
+		:return: destination plate name as read from the csv (None if it has no destination line), DataFrame of
+			transfers
 
-				well_name = well_name[0] + well_name[1:].lstrip('0')
-				self.df['DestWell'][row_idx] = well_name
+		Raises TError if the file cannot be read or holds no transfers
+		"""
+		try:
+			dest_plate, df = readProtocolFile(csv)
+		except TError as err:
+			self.log(str(err))
+			raise TError(self.msg)
 
-				if not re.match(r'([a-h]|[A-H])([1-9](?!.)|1[0-2])', well_name):
-					raise TError('Invalid destination well name %s in row %s of csv file' %(well_name, str(row_idx + 2)))
+		self.log('CSV file %s loaded' % csv)
+		return dest_plate, df
 
-	def checkDuplicateDestination(self):
-		hasDupes = False
-		dupes_mask = self.df.duplicated(subset='TargetWell')
-		dupes = self.df.where(dupes_mask).dropna()
-		duplicates = set(dupes['TargetWell'].values)
-		error_msg = ''
+	def destPlateName(self, csv, dest_plate):
+		if dest_plate is None:
+			dest_plate = Path(csv).stem
+			logging.info('CSV file %s has no destination plate line, using %s' % (csv, dest_plate))
+		return dest_plate
 
-		if len(duplicates) == 0:
-			return hasDupes, error_msg
-		else:
-			hasDupes = True
+	def latestRecord(self):
+		"""
+		Most recently modified transfer record or journal file in the records directory, or None
+		"""
+		records = [path for path in Path(self.save_path).glob('*_transfer_*.csv') if RECORD_NAME.match(path.name)]
+		if not records:
+			return None
+		return max(records, key=lambda path: path.stat().st_mtime)
 
-		for element in duplicates:
-			subset = self.df.where(self.df['TargetWell'] == element).dropna()
+	def resumeFromRecord(self, path=None):
+		"""
+		Rebuilds a TransferProtocol and its current position from a transfer record or journal file, so that an
+		interrupted session can be continued. The transfers in the file were validated when the protocol was first
+		loaded, so the source csv is not read or re-validated. A record is resumed from the journal of its session
+		instead when the journal is newer. Further state changes are appended to the journal of the interrupted
+		session.
 
-			indices = []
-			for index, row in subset.iterrows():
-				indices.append(index)
-				target = row['TargetWell']
-			error_msg = error_msg + 'TargetWell %s is duplicated in rows %s ' % (target, indices)
-		return hasDupes, error_msg
+		:param path: record or journal file to resume from, defaults to the latest one in the records directory
 
-	def checkDuplicateSource(self):
-		plates = self.df['PlateName'].drop_duplicates().values
+		Raises TError if there is no usable record file
+		Raises TConfirm if the session is resumed successfully
+		"""
+		if path is None:
+			path = self.latestRecord()
+			if path is None:
+				self.log('No transfer record found in %s to resume from' % self.save_path)
+				raise TError(self.msg)
 
-		hasDupes = False
-		error_msg = []
-		msg = ''
+		path = Path(path)
+		name = RECORD_NAME.match(path.name)
+		if name is not None and name.group('kind') == 'record':
+			# the journal holds every change, the record only those compacted before it was written
+			journal_path = path.with_name('%s_transfer_journal_%s.csv' % (name.group('stem'), name.group('timestamp')))
+			try:
+				if journal_path.stat().st_mtime_ns >= path.stat().st_mtime_ns:
+					path, name = journal_path, RECORD_NAME.match(journal_path.name)
+			except OSError:
+				pass
+		try:
+			rows = readRecordRows(path)
+		except (OSError, ValueError):
+			self.log('Failed to read transfer record \n %s' % path)
+			raise TError(self.msg)
+		if name is None or len(rows) == 0:
+			self.log('File %s is not a transfer record that can be resumed' % path)
+			raise TError(self.msg)
 
-		for plate in plates:
-			batch = self.df.where(self.df['PlateName'] == plate).dropna()
+		import pandas as pd
+		self.reset()
+		keys = list(rows.keys())
+		self.df = pd.DataFrame(keys, columns=['PlateName', 'SourceWell', 'DestWell'])
+		self.dest_plate = next(iter(rows.values()))[3]
+		self.csv = os.path.join(self.load_path, name.group('stem') + '.csv')
+		self.timestamp = name.group('timestamp')
 
-			dupes_mask = batch.duplicated(subset='SourceWell')
-			dupes = batch.where(dupes_mask).dropna()
-			duplicates = set(dupes['SourceWell'].values)
+		try:
+			self.tp = WTWTransferProtocol(wtw=self, df=self.df)
+		except ValueError as err:
+			self.reset()
+			self.log('Transfer record %s does not match the %s well plate format \n %s' % (path.name, self.num_wells, err))
+			raise TError(self.msg)
+		self.tp.restoreState(rows)
+		# changes are appended to the journal of the session, which starts with the restored state unless it is the
+		# file the state was read from
+		self.openJournal(snapshot=path.resolve() != self.recordPath('journal').resolve())
+
+		self.log('Resumed TransferProtocol with %s transfers in %s plates from %s' %
+				 (self.tp.num_transfers, self.tp.num_plates, path.name))
+		if self.tp.protocolComplete():
+			raise TConfirm(self.msg + '\n Transfer protocol is already complete')
+		raise TConfirm(self.msg + '\n Please load plate ' + self.tp.current_plate_name + ' to continue')
+
+	def checkWellNames(self, df=None):
+		"""
+		Normalizes the SourceWell and DestWell columns in place (uppercase, no leading zeros) and checks that every
+		name is a well of the configured plate format.
 
-			if len(duplicates) == 0:
-				continue
-			else:
-				hasDupes = True
+		:param df: transfer DataFrame, defaults to self.df
 
-			for element in duplicates:
-				subset = batch.where(batch['SourceWell'] == element).dropna()
+		Raises TError listing every missing or invalid well name in the csv
+		"""
+		summary, errors = wellNameErrors(invalidWellNames(self.df if df is None else df, self.num_wells), self.num_wells)
+		if summary is not None:
+			self.log(summary)
+			raise TError(self.msg + '\n' + '\n'.join(errors))
 
-				indices = []
-				for index, row in subset.iterrows():
-					indices.append(index)
-				msg = msg + 'SourceWell %s is duplicated in rows %s' % (element, indices)
+	def checkDuplicateDestination(self, df=None):
+		"""
+		Checks that every destination well is used by at most one transfer
+
+		:param df: transfer DataFrame, defaults to self.df
+		:return: hasDupes, dict of DestWell -> csv line numbers of every transfer into that well
+		"""
+		duplicates = duplicateRows(self.df if df is None else df, 'DestWell')
+		return len(duplicates) > 0, duplicates
 
-			error_msg.append(msg)
+	def checkDuplicateSource(self, df=None):
+		"""
+		Checks that every well of each source plate is used by at most one transfer
 
-		return hasDupes, error_msg
+		:param df: transfer DataFrame, defaults to self.df
+		:return: hasDupes, dict of (PlateName, SourceWell) -> csv line numbers of every transfer from that well
+		"""
+		duplicates = duplicateRows(self.df if df is None else df, ['PlateName', 'SourceWell'])
+		return len(duplicates) > 0, duplicates
+
+	def checkDuplicates(self, df=None):
+		"""
+		Raises TError listing every duplicated source and destination well in the csv
+
+		:param df: transfer DataFrame, defaults to self.df
+		"""
+		_, source_dupes = self.checkDuplicateSource(df)
+		_, dest_dupes = self.checkDuplicateDestination(df)
+		summary, errors = duplicateWellErrors(source_dupes, dest_dupes)
+		if summary is not None:
+			self.log(summary)
+			raise TError(self.msg + '\n' + '\n'.join(errors))
 
 	def abortTransfer(self):
 		if self.tp_present():
+			self.closeJournal()
 			self.tp = None
 			self.df = None
 
-	def writeTransferRecordFiles(self, _):
+	def recordPath(self, kind='record'):
+		"""
+		Path of the file of the given kind ('record' or 'journal') for the currently loaded protocol
+		"""
 		csv_filename = Path(self.csv).stem
-		filename = Path(csv_filename + '_' + 'transfer_record_' + self.timestamp + '.csv')
-		record_path_filename = Path(self.save_path + str(filename))
+		filename = Path(csv_filename + '_' + 'transfer_' + kind + '_' + self.timestamp + '.csv')
+		return Path(self.save_path + str(filename))
+
+	def openJournal(self, snapshot=True):
+		"""
+		Opens the transfer journal for the loaded protocol
+
+		:param snapshot: start the journal with the current state of every transfer
+		"""
+		self.closeJournal()
+		journal_path = self.recordPath('journal')
+		try:
+			self.journal = TransferJournal(journal_path, batch_size=self.journal_batch_size,
+										   syncer=self.record_writer.sync)
+			if snapshot:
+				self.journal.appendAll(self.tp.transfers[tf_id] for tf_id in self.tp.tf_seq)
+		except OSError:
+			raise TError('Cannot write journal file to ' + str(journal_path))
+		self.tp.journal = self.journal
+		if self.record_store is not None:
+			self.openRecordSession(journal_path)
+
+	def openRecordSession(self, journal_path):
+		"""
+		Starts recording the loaded protocol to the transfer history database, or continues recording the session of
+		journal_path. A session resumed from a record that is new to the database starts with the restored state of
+		the transfers that were started or finished.
+		Failing to record the history is logged without interrupting the protocol.
+		"""
+		store = self.tp.transfers
 		try:
-			with open(record_path_filename, mode='w') as logfile:
-				log_writer = csv.writer(logfile, delimiter=',',  lineterminator='\n')
-				log_writer.writerow(['Timestamp', 'Source plate', 'Source well', 'Destination plate', 'Destination well', 'Status'])
-				keys = ['timestamp', 'source_plate', 'source_well', 'dest_plate', 'dest_well', 'status']
-				for transfer_id in self.tp.tf_seq:
-					transfer = self.tp.transfers[transfer_id]
-					#if transfer['status'] is not 'uncompleted':
-					log_writer.writerow([transfer[key] for key in keys])
+			self.record_session = self.record_store.startSession(
+				self.csv, self.dest_plate, store.transferKeys(), self.timestamp, key=sessionKey(journal_path),
+				batch_size=self.journal_batch_size, syncer=self.record_writer.sync)
+			if self.record_session.created:
+				restored = np.flatnonzero(store.status != STATUS_CODE[TStatus.uncompleted])
+				self.record_session.appendAll(store[int(idx)] for idx in restored)
+		except (OSError, sqlite3.Error) as err:
+			logging.error('Cannot record session to %s: %s' % (self.record_store.path, err))
+			self.record_session = None
+		self.tp.record_session = self.record_session
+
+	def closeJournal(self):
+		if self.journal is not None:
+			self.journal.close()
+			self.journal = None
+		if self.record_session is not None:
+			self.record_session.close()
+			self.record_session = None
+
+	@timed('wtw.writeTransferRecordFiles')
+	def writeTransferRecordFiles(self, _, wait=False):
+		"""
+		Compacts the transfer journal into a transfer record csv. Called when a plate or protocol is finished,
+		individual state changes are already persisted by the journal. The record is written by the record writer
+		thread, repeated calls before it is written are coalesced into a single write.
+
+		:param wait: wait until the record is written
+
+		Raises TError if no protocol is loaded, or if this or an earlier record write failed
+		"""
+		if self.tp_present() and self.journal is None:
+			self.log('No transfer journal open to write the transfer record from')
+			raise TError(self.msg)
+		self.raiseRecordError()
+		record_path_filename = self.recordPath('record')
+		self.record_writer.compact(self.journal, record_path_filename)
+		if wait:
+			self.flushRecords()
 			self.log('Wrote transfer record to ' + str(record_path_filename))
-		except:
-			raise TError('Cannot write log file to ' + str(record_path_filename))
+		else:
+			self.log('Writing transfer record to ' + str(record_path_filename))
+
+	def flushRecords(self):
+		"""
+		Waits for every queued record write and journal fsync
+
+		Raises TError if a write failed
+		"""
+		self.record_writer.flush()
+		self.raiseRecordError()
+
+	def raiseRecordError(self):
+		error = self.record_writer.takeError()
+		if error is not None:
+			raise TError('Cannot write log file to ' + str(error[0]))
+
+
+def loggedAction(method):
+	"""
+	Decorator making the status changes and cursor move of a protocol action one group of the protocol's action log,
+	including actions that end by raising TError or TConfirm after changing a status
+	"""
+	@functools.wraps(method)
+	def wrapper(self, *args, **kwargs):
+		action_log = self.action_log
+		if action_log is None or action_log.recording:
+			return method(self, *args, **kwargs)
+		action_log.begin(self.cursor())
+		try:
+			return method(self, *args, **kwargs)
+		finally:
+			action_log.end(self.cursor())
+	return wrapper
 
 
 class WTWTransferProtocol(TransferProtocol):
@@ -258,70 +891,91 @@ class WTWTransferProtocol(TransferProtocol):
 
 	Raises TError if user tries to skip incomplete source plate
 	"""
-	def __init__(self, wtw=None, df=None, **kwargs):
+	def __init__(self, wtw=None, df=None, store=None, **kwargs):
 		super(WTWTransferProtocol, self).__init__(**kwargs)
 		self.transfers_by_plate = {}
 		self.df = df
 		self.msg = ''
-		if self.df is not None:
-			self.buildTransferProtocol(wtw, df)
+		self.journal = None
+		self.record_session = None
+		self.action_log = None
+		if self.df is not None or store is not None:
+			self.buildTransferProtocol(wtw, df, store=store)
 
-	def buildTransferProtocol(self, wtw, df):
+	def buildTransferProtocol(self, wtw, df, store=None):
 		"""
-		Builds a transfer protocol for well to well transfers
+		Builds a transfer protocol for well to well transfers. Transfers are held in a columnar TransferStore and
+		identified by their integer index in the protocol, grouped by source plate.
 		:param wtw: parent well to well object
 		:param df: pandas dataframe containing transfer information
+		:param store: TransferStore of an already validated protocol, used instead of df
 		:return:
 		"""
-		if df is not None:
-			self.plate_names = df['PlateName'].unique()
-
-			# organize transfers into a dict by unique_id, collect id's into lists by plateName
-			for plate_name in self.plate_names:
-				plate_df = df[df['PlateName'] == plate_name]
-				plate_transfers = []
-				for idx, plate_df_entry in plate_df.iterrows():
-					src_plt = plate_df_entry[0]
-					dest_plt = wtw.dest_plate
-					src_well = plate_df_entry[1]
-					dest_well = plate_df_entry[2]
-					unique_id = str(uuid.uuid1())
-
-					tf = Transfer(unique_id,
-								  source_plate=src_plt, dest_plate=dest_plt, source_well=src_well.upper(), dest_well=dest_well.upper())
-					plate_transfers.append(unique_id)
-					self.transfers[unique_id] = tf
-
-				self.transfers_by_plate[plate_name] = plate_transfers
-
-			# produce numpy array of ids to be performed in a sequence, grouped by plate.
-			current_idx = 0
+		if store is None and df is not None:
+			store = TransferStore.fromDataFrame(df, plateGeometry(wtw.num_wells), dest_plate=wtw.dest_plate)
+		if store is not None:
+			self.transfers = store
+			self.lists = StatusLists(self.transfers)
+			self.plate_names = self.transfers.plate_names
 			self.num_transfers = len(self.transfers)
-			self.tf_seq = np.empty(self.num_transfers, dtype=object)
+			self.num_plates = len(self.plate_names)
 
-			for plate in self.plate_names:
-				plate = self.transfers_by_plate[plate]
-				for tf_id in plate:
-					self.tf_seq[current_idx] = tf_id
-					current_idx += 1
+			# transfer indices in the sequence they are performed, and the index range of each plate
+			self.tf_seq = np.arange(self.num_transfers)
+			self.transfers_by_plate = {}
+			self.plate_sizes = {}
+			for plate_idx, plate in enumerate(self.plate_names):
+				self.transfers_by_plate[plate] = self.transfers.plateSpan(plate_idx)
+				self.plate_sizes[plate] = len(self.transfers_by_plate[plate])
 
 			self._current_idx = 0  # index in tf_seq
 			self._current_plate = 0  # index in plate_names
+			self.action_log = self.transfers.action_log = ActionLog()
 
-			self.current_uid = self.tf_seq[self._current_idx]
-			self.current_plate_name = self.plate_names[self._current_plate]
-			self.num_plates = len(self.plate_names)
-			self.plate_sizes = {}
-			for plate in self.plate_names:
-				self.plate_sizes[plate] = len(self.transfers_by_plate[plate])
-			self.sortTransfers()
+			self.synchronize()
 			self.plateComplete_bool = False
 
+	def restoreState(self, rows):
+		"""
+		Restores the status and timestamp of each transfer from record rows, matched by
+		(source plate, source well, dest well), then moves the cursor to the transfer in progress: the started
+		transfer if there is one, otherwise the first transfer that has not been finished. If that transfer is the
+		first of its plate, the cursor stays on the finished plate before it, so that the next plate is confirmed
+		as it would have been.
+
+		:param rows: dict of transferKey -> record row, as returned by TransferJournal.readRecordRows
+		"""
+		store = self.transfers
+		index = {key: idx for idx, key in enumerate(store.transferKeys())}
+		for key, row in rows.items():
+			idx = index.get(key)
+			if idx is not None:
+				store.status[idx] = STATUS_CODE[TStatus[row[5]]]
+				store.timestamp[idx] = parseTimestamp(row[0])
+		store.recount()
+
+		started = store.withStatus(TStatus.started)
+		unfinished = store.unfinished()
+		if len(started):
+			resume_idx = int(started[-1])
+		elif len(unfinished):
+			resume_idx = int(unfinished[0])
+			plate_idx = int(store.plate[resume_idx])
+			if plate_idx > 0 and resume_idx == store.plate_starts[plate_idx]:
+				resume_idx -= 1
+		else:
+			resume_idx = self.num_transfers - 1
+
+		self._current_idx = resume_idx
+		self._current_plate = int(store.plate[resume_idx])
+		# actions before the record was written cannot be undone
+		self.action_log = store.action_log = ActionLog()
+		self.synchronize()
+
 	def canUpdate(self):
 		"""
 		Checks to see that current transfer has already been timestamped with a status or started.
 		"""
-		self.sortTransfers()
 		# update if there is no timestamp or if it only just started
 		if (self.current_transfer['timestamp'] is None) or (self.current_transfer.status == TStatus.started):
 			return True
@@ -330,13 +984,37 @@ class WTWTransferProtocol(TransferProtocol):
 					 (self.tf_id(), self.transfers[self.current_uid]['status']))
 			return False
 
+	def journalTransfer(self, uid):
+		if self.journal is not None:
+			self.journal.append(self.transfers[uid])
+		if self.record_session is not None:
+			self.record_session.append(self.transfers[uid])
+
 	def complete(self):
 		if self.canUpdate():
 			self.transfers[self.current_uid].updateStatus(TStatus.completed)
+			self.journalTransfer(self.current_uid)
 
 	def start(self):
 		if self.canUpdate():
 			self.transfers[self.current_uid].updateStatus(TStatus.started)
+			self.journalTransfer(self.current_uid)
+
+	@loggedAction
+	def skip(self):
+		uid = self.current_uid
+		try:
+			super(WTWTransferProtocol, self).skip()
+		finally:
+			self.journalTransfer(uid)
+
+	@loggedAction
+	def failed(self):
+		uid = self.current_uid
+		try:
+			super(WTWTransferProtocol, self).failed()
+		finally:
+			self.journalTransfer(uid)
 
 	def completeCheck(self):
 		if self.plateComplete():
@@ -347,6 +1025,7 @@ class WTWTransferProtocol(TransferProtocol):
 				self.log('Plate %s is complete, press next plate to continue ' % self.current_plate_name)
 				raise TError(self.msg)
 
+	@loggedAction
 	def next(self):
 		"""
 		If the current transfer has not been started, start it.
@@ -354,14 +1033,13 @@ class WTWTransferProtocol(TransferProtocol):
 		Increment idx to next transfer
 		:return:
 		"""
-		self.sortTransfers()
-
 		if self.plateComplete():
 			self.completeCheck()
 
 		# if just starting, mark the first transfer as started
 		if self.current_transfer.status == TStatus.uncompleted:
 			self.transfers[self.current_uid].updateStatus(TStatus.started)
+			self.journalTransfer(self.current_uid)
 			self.log('')
 
 		# once started the sequence, mark the current transfer as complete and start the next transfer
@@ -382,7 +1060,6 @@ class WTWTransferProtocol(TransferProtocol):
 		"""
 		Moves index to the next transfer in a plate. If plate full or transfer complete, raises flag
 		"""
-		self.canUndo = True
 		if self.plateComplete():
 			self.completeCheck()
 		else:
@@ -399,17 +1076,25 @@ class WTWTransferProtocol(TransferProtocol):
 			raise TConfirm('Are you sure you wish to finish the plate?')
 		else:
 			self.log('Warning: Plate %s not yet complete ' % self.current_plate_name)
-			skipped_transfers_in_plate = list(
-				set(self.lists['uncompleted']) &
-				set(self.transfers_by_plate[self.current_plate_name]))
 			msg = self.msg
-			self.log('Confirm to skip %s remaining transfers.  Are you sure?' %
-					 len(skipped_transfers_in_plate))
+			self.log('Confirm to skip %s remaining transfers.  Are you sure?' % self.numRemaining())
 			raise TError(msg + self.msg)
 
+	@loggedAction
 	def nextPlateConfirm(self):
-		self.canUndo = False
+		"""
+		Moves to the next plate once the current plate is complete
+
+		Raises TError if the current plate is incomplete, or is the last plate of an incomplete protocol
+		"""
+		if not self.plateComplete():
+			self.log('Plate %s not yet complete, %s transfers remaining' %
+					 (self.current_plate_name, self.numRemaining()))
+			raise TError(self.msg)
 		if not self.protocolComplete():
+			if self._current_plate + 1 >= len(self.plate_names):
+				self.log('Plate %s is the last plate' % self.current_plate_name)
+				raise TError(self.msg)
 			self.current_plate_increment()
 			self.current_idx_increment()
 			self.log('Please load plate %s' % self.current_plate_name)
@@ -417,6 +1102,7 @@ class WTWTransferProtocol(TransferProtocol):
 		else:
 			self.log('TransferProtocol is complete')
 
+	@loggedAction
 	def nextPlateOverride(self):
 		"""
 		Marks any incomplete transfers in the current plate as skipped and moves to the next plate
@@ -424,13 +1110,12 @@ class WTWTransferProtocol(TransferProtocol):
 		raises TConfirm to notify how many transfers skipped
 		"""
 		# collect leftover transfers
-		skipped_transfers_in_plate = list(
-			set(self.lists['uncompleted']) &
-			set(self.transfers_by_plate[self.current_plate_name]))
+		skipped_transfers_in_plate = self.remainingInPlate()
 
 		# Mark uncomplete transfers as skipped for this plate
 		for tf in skipped_transfers_in_plate:
 			self.transfers[tf].updateStatus(TStatus.skipped)
+			self.journalTransfer(tf)
 
 		self.log('Remaining %s transfers in plate %s skipped. \n' %
 				 (len(skipped_transfers_in_plate), self.current_plate_name))
@@ -442,37 +1127,82 @@ class WTWTransferProtocol(TransferProtocol):
 			msg = 'Please load plate %s' % self.current_plate_name
 			raise TConfirm(self.msg + msg)
 
+	@timed('tp.sortTransfers')
+	def sortTransfers(self):
+		"""
+		Overrides superclass sortTransfers. The store keeps its per-plate status index up to date on every status
+		change and self.lists is a lazily materialized StatusLists view of it, so there is nothing to re-sort.
+		"""
+
+	def remainingInPlate(self):
+		"""
+		Indices of the transfers in the current plate that have not been finished
+		"""
+		return self.transfers.plateMembers(self._current_plate, UNFINISHED)
+
+	def numRemaining(self, plate_idx=None):
+		"""
+		Number of unfinished transfers in a plate, defaulting to the current plate
+		"""
+		if plate_idx is None:
+			plate_idx = self._current_plate
+		return self.transfers.plateRemaining(plate_idx)
+
+	@timed('tp.plateComplete')
 	def plateComplete(self):
+		"""
+		Constant time check that every transfer in the current plate is finished, using the store's plate counters
+		"""
 		self.synchronize()
-		self.sortTransfers()
-		for tf in self.transfers_by_plate[self.current_plate_name]:
-			if self.transfers[tf]['timestamp'] is None:
-				return False
-		return True
+		return self.transfers.plateRemaining(self._current_plate) == 0
 
+	def protocolComplete(self):
+		"""
+		Overrides superclass protocolComplete with a constant time check of the store's counters
+		"""
+		return self.transfers.remaining() == 0
+
+	def cursor(self):
+		"""
+		(index in tf_seq, plate index) of the current transfer
+		"""
+		return self._current_idx, self._current_plate
 
 	def undo(self):
 		"""
-        When a transfer is undone:
-        - there must be at least one 'finished state' transfer: skipped, failed, completed.
-        - The current started transfer is reset. index decrements one, resets the previous transfer, then re-starts it.
-        - From there that previous transfer can be marked as skipped, failed, or completed.
+		Overrides superclass undo with a multi-level undo: the last action in the action log (a transfer completed,
+		skipped or failed, a plate confirmed or skipped...) is reverted, restoring the status and timestamp of every
+		transfer it changed along with the current transfer and plate. Actions can be undone one after the other
+		back to the loading of the protocol, across plates, and are redone with redo until a new action is taken.
+		"""
+		if self.action_log is None or not self.action_log.canUndo():
+			self.log('Cannot undo previous operation')
+			return
+		changes, cursor = self.action_log.undo()
+		self.restoreChanges(changes, cursor)
+		self.log('Undone, current transfer: %s' % self.tf_id())
 
-		Overrides superclass undo to disalllow undo-ing immediately after switching plates
+	def redo(self):
 		"""
+		Repeats the last action undone
+		"""
+		if self.action_log is None or not self.action_log.canRedo():
+			self.log('Nothing to redo')
+			return
+		changes, cursor = self.action_log.redo()
+		self.restoreChanges(changes, cursor)
+		self.log('Redone, current transfer: %s' % self.tf_id())
+
+	def restoreChanges(self, changes, cursor):
+		"""
+		Writes the (transfer index, status code, timestamp) changes of an undo or redo to the store and the journal,
+		then moves to the transfer and plate of cursor
+		"""
+		for idx, code, timestamp in changes:
+			self.transfers.restoreStatus(idx, code, timestamp)
+			self.journalTransfer(idx)
+		self._current_idx, self._current_plate = cursor
 		self.synchronize()
-		self.sortTransfers()
-		if self.canUndo:
-			if not self.plateComplete():
-				self.transfers[self.current_uid].resetTransfer()
-				self.current_idx_decrement()
-			self.transfers[self.current_uid].resetTransfer()
-			self.transfers[self.current_uid].updateStatus(TStatus.started)
-			self.sortTransfers()
-			self.canUndo = False
-			self.log('transfer marked incomplete: %s' % self.tf_id())
-		else:
-			self.log('Cannot undo previous operation')
 
 	def current_plate_increment(self):
 		self._current_plate += 1
@@ -487,7 +1217,7 @@ class WTWTransferProtocol(TransferProtocol):
 		Overrides superclass synchronize to support multiple plates
 		:return:
 		"""
-		self.current_uid = self.tf_seq[self._current_idx]
-		self.current_transfer = self.transfers[self.current_uid ]
+		self.current_uid = int(self.tf_seq[self._current_idx])
+		self.current_transfer = self.transfers[self.current_uid]
 		self.current_plate_name = self.plate_names[self._current_plate]
 
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Headless runner for well-to-well transfer protocols.
+
+Loads a protocol csv (or resumes a transfer record/journal), replays a script of user actions read from a file or
+stdin, and writes the transfer record, without Kivy or the WellLit hardware. Usage:
+
+	python -m WellToWellCLI protocols/good.csv --script actions.txt
+	echo "next 5" | python -m WellToWellCLI protocols/good.csv
+
+Scripts hold one action per line, optionally followed by a repeat count, e.g. 'next 20'. Blank lines and text after
+'#' are ignored. Actions behave as the matching GUI buttons and keyboard shortcuts do:
+	next, skip, failed              step through the current plate
+	undo, redo                      undo the last action, or redo the last action undone
+	nextPlate                       move to the next plate if the current one is complete
+	nextPlateOverride               skip the rest of the current plate and move to the next one
+	write                           compact the journal into the transfer record
+	finish                          write the transfer record and end the protocol
+"""
+
+import argparse, logging, os, sys
+from WellLit.Transfer import TError, TConfirm, TStatus
+from WellToWell import WelltoWell, RECORD_NAME
+from Instrumentation import RECORDER
+
+ACTIONS = ('next', 'skip', 'failed', 'undo', 'redo', 'nextPlate', 'nextPlateOverride', 'write', 'finish')
+
+
+def parseScript(lines):
+	"""
+	Parses script lines into (line number, action) pairs, expanding repeat counts
+
+	Raises ValueError on unknown actions or malformed repeat counts
+	"""
+	for line_no, line in enumerate(lines, start=1):
+		words = line.split('#', 1)[0].split()
+		if not words:
+			continue
+		action = words[0]
+		if action not in ACTIONS or len(words) > 2:
+			raise ValueError('Invalid action "%s" on line %s of script' % (line.strip(), line_no))
+		repeat = int(words[1]) if len(words) == 2 else 1
+		for _ in range(repeat):
+			yield line_no, action
+
+
+class ScriptedSession:
+	"""
+	Drives a WelltoWell protocol with scripted user actions, following the same flow as WelltoWellWidget:
+	* the first transfer is started once a protocol is loaded
+	* a complete plate is confirmed automatically on nextPlate
+	TError and TConfirm raised by an action are reported and counted rather than shown in popups. Any other exception
+	is reported and counted as an error of its action, so that one bad action does not end a long scripted run.
+	"""
+
+	def __init__(self, wtw, out=sys.stdout, verbose=False):
+		self.wtw = wtw
+		self.out = out
+		self.verbose = verbose
+		self.num_actions = 0
+		self.num_errors = 0
+
+	def report(self, line_no, action, outcome, msg):
+		if self.verbose or outcome == 'error':
+			msg = ' '.join(str(msg).split())
+			self.out.write('%s %s: %s %s\n' % (line_no, action, outcome, msg))
+
+	def load(self, path):
+		"""
+		Loads a protocol csv, or resumes a transfer record or journal file. Returns True on success.
+		"""
+		try:
+			if RECORD_NAME.match(os.path.basename(path)):
+				self.wtw.resumeFromRecord(path)
+			else:
+				self.wtw.loadCsv(path)
+		except TError as err:
+			self.report(0, 'load', 'error', err)
+			return False
+		except TConfirm as conf:
+			self.report(0, 'load', 'ok', conf)
+		if self.wtw.tp.current_transfer.status == TStatus.uncompleted:
+			self.perform(0, 'next')
+		return True
+
+	def perform(self, line_no, action):
+		self.num_actions += 1
+		try:
+			if action == 'write':
+				self.wtw.writeTransferRecordFiles(None, wait=True)
+			elif action == 'finish':
+				if self.wtw.tp_present():
+					self.wtw.writeTransferRecordFiles(None, wait=True)
+					self.wtw.reset()
+			elif action == 'nextPlate':
+				try:
+					self.wtw.nextPlate()
+				except TConfirm:
+					self.wtw.nextPlateConfirm()
+			else:
+				getattr(self.wtw, action)()
+			self.report(line_no, action, 'ok', self.wtw.tp.msg if self.wtw.tp_present_bool() else self.wtw.msg)
+		except TError as err:
+			self.num_errors += 1
+			self.report(line_no, action, 'error', err)
+		except TConfirm as conf:
+			self.report(line_no, action, 'ok', conf)
+		except Exception as err:
+			self.num_errors += 1
+			logging.exception('Unexpected error on line %s: %s' % (line_no, action))
+			self.report(line_no, action, 'error', '%s: %s' % (type(err).__name__, err))
+
+	def run(self, actions):
+		for line_no, action in actions:
+			self.perform(line_no, action)
+
+	def summary(self):
+		"""
+		One line summary of the actions replayed and the status of every transfer
+		"""
+		counts = ''
+		if self.wtw.tp_present_bool():
+			lists = self.wtw.tp.lists
+			counts = ', '.join('%s %s' % (len(lists[status.name]), status.name) for status in TStatus)
+		return '%s actions, %s errors. %s' % (self.num_actions, self.num_errors, counts)
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog='python -m WellToWellCLI',
+									 description='Replay a script of user actions on a transfer protocol without the GUI')
+	parser.add_argument('protocol', help='protocol csv, or a transfer record/journal file to resume')
+	parser.add_argument('-s', '--script', default='-', help='file of actions, one per line (default: stdin)')
+	parser.add_argument('-c', '--config', default=os.path.join(os.getcwd(), 'wellLitConfig.json'),
+						help='WellLit config file (default: ./wellLitConfig.json)')
+	parser.add_argument('--num-wells', choices=['96', '384', '1536'], help='plate format, overrides the config')
+	parser.add_argument('--records-dir', help='directory for the journal and transfer record, overrides the config')
+	parser.add_argument('-v', '--verbose', action='store_true', help='print the outcome of every action')
+	parser.add_argument('--log-level', default='WARNING', help='logging level for messages on stderr')
+	parser.add_argument('--timings', help='write per-action latency percentiles to this JSON file')
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s [%(levelname)s] - %(message)s')
+
+	wtw = WelltoWell(args.config)
+	if args.timings:
+		RECORDER.enabled = True
+	if args.num_wells:
+		wtw.num_wells = args.num_wells
+	if args.records_dir:
+		os.makedirs(args.records_dir, exist_ok=True)
+		wtw.save_path = os.path.join(args.records_dir, '')
+
+	script = sys.stdin if args.script == '-' else open(args.script)
+	try:
+		actions = list(parseScript(script))
+	except ValueError as err:
+		parser.error(str(err))
+	finally:
+		if script is not sys.stdin:
+			script.close()
+
+	session = ScriptedSession(wtw, verbose=args.verbose)
+	if not session.load(args.protocol):
+		return 1
+	session.run(actions)
+	if args.timings:
+		wtw.reportTimings(args.timings)
+
+	if wtw.tp_present_bool():
+		sys.stdout.write(session.summary() + '\n')
+		try:
+			wtw.writeTransferRecordFiles(None, wait=True)
+			sys.stdout.write(wtw.msg + '\n')
+		except TError as err:
+			sys.stdout.write(str(err) + '\n')
+			return 1
+		finally:
+			wtw.closeJournal()
+	else:
+		sys.stdout.write(session.summary() + '\n')
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
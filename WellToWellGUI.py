@@ -1,17 +1,39 @@
+from Instrumentation import ImportTimer, span, timed
+# imports of the GUI, written to the session log at startup
+IMPORT_TIMER = ImportTimer().start()
 import kivy
 kivy.require('1.11.1')
 from kivy.app import App
+from kivy.lang import Builder
 from kivy.uix.floatlayout import FloatLayout
+from kivy.uix.button import Button
+from kivy.utils import escape_markup
 # noinspection ProblematicWhitespace
 from kivy.core.window import Window
 from kivy.uix.popup import Popup
-from kivy.properties import ObjectProperty, StringProperty
-from datetime import datetime
-from pathlib import Path
-import logging, os
+from kivy.uix.modalview import ModalView
+from kivy.properties import ObjectProperty, StringProperty, BooleanProperty
+from kivy.clock import Clock
+from concurrent.futures import ThreadPoolExecutor
+import json, logging, os, threading, time
 from WellLit.WellLitGUI import WellLitWidget
 from WellLit.Transfer import TError, TConfirm, TStatus
-from WellToWell import WelltoWell
+from WellToWell import WelltoWell, RECORD_NAME
+from ProtocolCatalog import ProtocolCatalog
+from CommandQueue import CommandQueue
+from StructuredLogging import LoggingSession
+IMPORT_TIMER.stop()
+
+# keyboard shortcuts -> command performed by WelltoWellWidget.drainCommands
+KEY_COMMANDS = {'n': 'next', 'p': 'nextPlate', 'u': 'undo', 'r': 'redo'}
+
+# plate widget built by WelltoWellWidget.buildPlates
+PLATE_KV = '''
+WellPlot:
+    shape: 'circle'
+    type: '%s'
+'''
+
 
 class LoadDialog(FloatLayout):
     load = ObjectProperty(None)
@@ -19,6 +41,149 @@ class LoadDialog(FloatLayout):
     load_path = StringProperty('')
 
 
+class ProtocolRow(Button):
+    path = StringProperty('')
+    selected = BooleanProperty(False)
+    browser = ObjectProperty(None)
+
+
+class ProtocolBrowser(FloatLayout):
+    """
+    Protocol picker listing the entries of a ProtocolCatalog: destination plate, plate and transfer counts, last
+    validation result and last run of each protocol, filtered by search text and validation status. Rows are built
+    from the catalog in memory, so the dialog opens without listing protocol_dir; refreshRows is called again once
+    the background refresh of the catalog is done. Other files, e.g. transfer records to resume, are opened with the
+    file chooser of LoadDialog.
+    """
+    load = ObjectProperty(None)
+    cancel = ObjectProperty(None)
+    browse = ObjectProperty(None)
+    catalog = ObjectProperty(None)
+    search = StringProperty('')
+    status_filter = StringProperty('all')
+    selected = StringProperty('')
+    details = StringProperty('')
+    STATUS_FILTERS = ['all', 'ok', 'invalid', 'error']
+    STATUS_COLORS = {'ok': '7fff7f', 'invalid': 'ff7f7f', 'error': 'ff7f7f'}
+
+    def __init__(self, **kwargs):
+        super(ProtocolBrowser, self).__init__(**kwargs)
+        self.refreshRows()
+
+    def on_search(self, *_):
+        self.refreshRows()
+
+    def on_status_filter(self, *_):
+        self.refreshRows()
+
+    def refreshRows(self):
+        status = None if self.status_filter == 'all' else self.status_filter
+        self.ids.rows.data = [{'text': self.rowText(entry), 'path': entry['path'], 'browser': self,
+                               'selected': entry['path'] == self.selected}
+                              for entry in self.catalog.search(self.search, status)]
+
+    def rowText(self, entry):
+        status = entry['status'] if entry['status'] == 'ok' else '%s (%s problems)' % (entry['status'],
+                                                                                        entry['num_errors'])
+        return '[b]%s[/b]  %s\n%s plates, %s transfers  [color=%s]%s[/color]  last run %s' % (
+            escape_markup(entry['name']), escape_markup(entry['dest_plate'] or ''), entry['num_plates'],
+            entry['num_transfers'], self.STATUS_COLORS[entry['status']], status, entry['last_run'] or 'never')
+
+    def select(self, path):
+        self.selected = path
+        entry = self.catalog.get(path)
+        if entry is None:
+            self.details = ''
+        else:
+            self.details = 'Validated %s. %s' % (entry['validated'], ' '.join(entry['errors']))
+        self.refreshRows()
+
+    def loadSelected(self):
+        self.load([self.selected] if self.selected else [])
+
+
+class PlateRenderer:
+    """
+    Pushes well states to the source and destination plates of a WelltoWellWidget, keeping the state last pushed
+    for each well so that only wells whose state changed are redrawn. Transfers whose status changed are taken from
+    the protocol's TransferStore, so a render after a single action touches a handful of wells whatever the size of
+    the plate. All wells are redrawn when a protocol is loaded or the source plate changes. Wells are tracked by
+    their index in the plate geometry and only named when pushed to a plate.
+    """
+    EMPTY, FILLED, TARGET = 'empty', 'filled', 'target'
+
+    def __init__(self, widget):
+        self.widget = widget
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Forces the next render to redraw every well
+        """
+        self._tp = None
+        self._plate_idx = None
+        self._states = {}
+
+    def render(self, tp):
+        store = tp.transfers
+        changed = store.takeChanged()
+        if tp is not self._tp or tp._current_plate != self._plate_idx:
+            self.widget.ids.source_plate.pl.emptyWells()
+            self.widget.ids.dest_plate.pl.emptyWells()
+            self._states = {}
+            self._tp, self._plate_idx = tp, tp._current_plate
+            # every well starts out empty, so only wells of the current plate and filled wells need pushing
+            candidates = set(tp.transfers_by_plate[tp.current_plate_name]) | set(tp.lists['completed'])
+            redraw = {'source', 'dest'}
+        else:
+            candidates = changed
+            redraw = set()
+
+        for tf_id in candidates:
+            for plate, well, state in self.wellStates(tp, tf_id):
+                if self._states.get((plate, well), self.EMPTY) != state:
+                    self.push(plate, well, state)
+                    redraw.add(plate)
+
+        for plate in redraw:
+            self.plateWidget(plate).pl.show()
+
+    def wellStates(self, tp, tf_id):
+        """
+        (plate, well index, state) of the source and destination wells of a transfer. Source wells of other plates
+        than the current one are not shown.
+        """
+        store = tp.transfers
+        status = store[tf_id].status
+        if status == TStatus.started and tf_id == tp.current_uid:
+            dest_state = source_state = self.TARGET
+        elif status == TStatus.completed:
+            source_state, dest_state = self.EMPTY, self.FILLED
+        elif status in (TStatus.uncompleted, TStatus.started, TStatus.skipped):
+            source_state, dest_state = self.FILLED, self.EMPTY
+        else:
+            source_state = dest_state = self.EMPTY
+
+        states = [('dest', int(store.dest_well[tf_id]), dest_state)]
+        if tf_id in tp.transfers_by_plate[tp.current_plate_name]:
+            states.append(('source', int(store.source_well[tf_id]), source_state))
+        return states
+
+    def plateWidget(self, plate):
+        return self.widget.ids.source_plate if plate == 'source' else self.widget.ids.dest_plate
+
+    def push(self, plate, well, state):
+        pl = self.plateWidget(plate).pl
+        name = self._tp.transfers.well_names[well]
+        if state == self.TARGET:
+            pl.markTarget(name)
+        elif state == self.FILLED:
+            pl.markFilled(name)
+        else:
+            pl.markEmpty(name)
+        self._states[(plate, well)] = state
+
+
 class WelltoWellWidget(WellLitWidget):
     """
     Loads csv files as directed by user to build well-to-well transfer protocols, and provides functionality
@@ -29,6 +194,8 @@ class WelltoWellWidget(WellLitWidget):
     source_plate = StringProperty()
     current_tf_id = StringProperty()
     status = StringProperty()
+    loading = BooleanProperty(False)
+    LOAD_STAGES = {'parsed': 'Parsed', 'validated': 'Validated', 'built': 'Built transfer protocol from'}
 
     def __init__(self, **kwargs):
         super(WelltoWellWidget, self).__init__(**kwargs)
@@ -39,12 +206,28 @@ class WelltoWellWidget(WellLitWidget):
         self.dest_plate = ''
         self.source_plate = ''
         self.current_tf_id = ''
-        self.status = 'Shortcuts: \n n: next transfer \n p: next plate \n q: quit program'
+        self.status = 'Shortcuts: \n n: next transfer \n p: next plate \n u: undo \n r: redo \n q: quit program'
         self.load_path = self.wtw.load_path
         self.filename = ''
+        self.renderer = PlateRenderer(self)
+        self.wtw.startProfiling()
+        # protocols are parsed and validated on a worker thread, see startLoad
+        self.loader = ThreadPoolExecutor(max_workers=1)
+        self.load_cancel = None
+        # metadata of the protocols in protocol_dir for the load dialog, refreshed on its own thread so that a slow
+        # protocol folder never holds up loading
+        self.catalog = ProtocolCatalog(self.wtw.num_wells, self.wtw.cache.cache_dir / 'protocol_catalog.json')
+        self.scanner = ThreadPoolExecutor(max_workers=1)
+        self.catalog_refresh = None
+        self.refreshCatalog()
+        # keyboard commands are queued and performed once per frame by drainCommands
+        self.commands = CommandQueue(debounce=self.wtw.key_debounce_ms / 1000.0)
+        self.drain_trigger = Clock.create_trigger(self.drainCommands)
+        # side effects ('lights', 'record') postponed to the end of drainCommands, None outside of it
+        self.deferred = None
 
     def reset(self):
-        self.status = 'Shortcuts: \n n: next transfer \n p: next plate \n q: quit program'
+        self.status = 'Shortcuts: \n n: next transfer \n p: next plate \n u: undo \n r: redo \n q: quit program'
         self.dest_plate = ''
         self.source_plate = ''
 
@@ -52,10 +235,46 @@ class WelltoWellWidget(WellLitWidget):
         self.showPopup('Are you sure you want to exit?', 'Confirm exit', func=self.quit)
 
     def _on_keyboard_up(self, keyboard, keycode, text, modifiers):
-        if keycode[1] == 'n':
-            self.next()
-        if keycode[1] == 'p':
-            self.nextPlate(None)
+        command = KEY_COMMANDS.get(keycode[1])
+        if command is None:
+            return
+        # a key meant for the main screen must not act behind a popup the operator has not read yet
+        if self.popupOpen():
+            logging.info('Key %s ignored while a popup is open' % keycode[1])
+            return
+        if self.commands.put(command):
+            self.drain_trigger()
+        else:
+            logging.info('Key %s ignored, pressed again within %s ms' % (keycode[1], self.wtw.key_debounce_ms))
+
+    def popupOpen(self):
+        return any(isinstance(child, ModalView) for child in Window.children)
+
+    def drainCommands(self, dt):
+        """
+        Performs the queued keyboard commands in order, once per frame. Every state transition is applied, while
+        the plates are redrawn and the transfer record queued for writing once for the whole batch. If a command
+        opens a popup, the commands queued after it are dropped: they were pressed before the popup was shown.
+        """
+        self.deferred = set()
+        try:
+            with span('key.batch'):
+                while len(self.commands):
+                    if self.popupOpen():
+                        logging.info('%s queued commands dropped, a popup is open' % self.commands.clear())
+                        break
+                    command = self.commands.get()
+                    with span('key.' + command):
+                        if command == 'nextPlate':
+                            self.nextPlate(None)
+                        else:
+                            getattr(self, command)()
+        finally:
+            deferred, self.deferred = self.deferred, None
+            if 'lights' in deferred:
+                self.updateLights()
+            if 'record' in deferred:
+                self.writeRecord()
 
     def load(self, filename):
         self.dismiss_popup()
@@ -82,75 +301,163 @@ class WelltoWellWidget(WellLitWidget):
             self.showPopup(TError('Invalid target to load'), 'Unable to load file')
 
         if os.path.isfile(str(filename)):
+            logging.info('User selected file %s to load' % filename)
+            if RECORD_NAME.match(os.path.basename(filename)):
+                # transfer records and journals resume the interrupted session they were written by
+                try:
+                    self.wtw.resumeFromRecord(filename)
+                except TError as err:
+                    self.showPopup(err, 'Load Failed')
+                except TConfirm as conf:
+                    self.loadSuccessful(conf)
+            else:
+                self.startLoad(filename)
+
+    def startLoad(self, filename):
+        """
+        Parses and validates a protocol on the loader thread, keeping the UI responsive. Progress is shown in the
+        status label and the outcome is handed back to the UI thread, see loadFinished.
+        """
+        self.cancelLoad()
+        cancel = threading.Event()
+        self.load_cancel = cancel
+        self.loading = True
+        self.status = 'Loading %s' % os.path.basename(filename)
+
+        def progress(stage):
+            Clock.schedule_once(lambda dt: self.loadProgress(cancel, filename, stage))
+
+        future = self.loader.submit(self.wtw.prepareLoad, filename, progress=progress, cancel=cancel)
+        future.add_done_callback(lambda done: Clock.schedule_once(lambda dt: self.loadFinished(cancel, done)))
+
+    def cancelLoad(self):
+        if self.load_cancel is not None:
+            self.load_cancel.set()
+            self.load_cancel = None
+            self.loading = False
+            self.status = 'Loading cancelled'
+
+    def loadProgress(self, cancel, filename, stage):
+        if cancel is self.load_cancel:
+            self.status = '%s %s' % (self.LOAD_STAGES[stage], os.path.basename(filename))
+
+    def loadFinished(self, cancel, future):
+        """
+        Applies the LoadOutcome of a finished load on the UI thread, unless it was cancelled or superseded
+        """
+        if cancel is not self.load_cancel or cancel.is_set():
+            return
+        self.load_cancel = None
+        self.loading = False
+        try:
+            outcome = future.result()
+        except Exception as err:
+            logging.exception('Unexpected error loading protocol')
+            self.showPopup(TError('Failed to load protocol \n %s' % err), 'Load Failed')
+            self.status = ''
+            return
+
+        if outcome.error is not None or outcome.ok:
             try:
-                logging.info('User selected file %s to load' % filename)
-                self.wtw.loadCsv(filename)
+                self.loadSuccessful(TConfirm(self.wtw.commitLoad(outcome)))
             except TError as err:
                 self.showPopup(err, 'Load Failed')
-            except TConfirm as conf:
-                self.showPopup(conf, 'Load Successful')
-                if not self.initialized:
-                    self.reset_plates(self.config_path)
-                    self.initialized = True
-                self.wtw.tp.id_type = ''
-                self.updateLights()
-                self.dest_plate = self.wtw.dest_plate
-                self.updateLabels()
-                self.next()
+                self.status = ''
+
+    def loadSuccessful(self, conf):
+        self.showPopup(conf, 'Load Successful')
+        self.status = ''
+        if not self.initialized:
+            self.buildPlates()
+            self.reset_plates(self.config_path)
+            self.initialized = True
+        self.wtw.tp.id_type = ''
+        self.updateLights()
+        self.dest_plate = self.wtw.dest_plate
+        self.updateLabels()
+        if self.wtw.tp.current_transfer.status == TStatus.uncompleted:
+            self.next()
 
 
     def updateLabels(self):
         self.source_plate = self.wtw.tp.current_plate_name
 
+    def buildPlates(self):
+        """
+        Builds the source and destination plate widgets, deferred until the first protocol is loaded so that the
+        first screen does not wait for the plate figures
+        """
+        with span('gui.buildPlates'):
+            for plate, plate_type in [('source_plate', 'source_plate'), ('dest_plate', 'dest_plate')]:
+                if plate not in self.ids:
+                    well_plot = Builder.load_string(PLATE_KV % plate_type, filename='%s.kv' % plate)
+                    self.ids[plate + '_box'].add_widget(well_plot)
+                    self.ids[plate] = well_plot
+
     def show_load(self):
+        content = ProtocolBrowser(load=self.load, cancel=self.dismiss_popup, browse=self.showFileChooser,
+                                  catalog=self.catalog)
+        self._popup = Popup(title='Load Transfer Protocol', content=content)
+        self._popup.size_hint = (0.37, .8)
+        self._popup.pos_hint = {'x': 10.0 / Window.width, 'y': 100 / Window.height}
+        self._popup.open()
+        self.refreshCatalog(content)
+
+    def showFileChooser(self):
+        self.dismiss_popup()
         content = LoadDialog(load=self.load, cancel=self.dismiss_popup, load_path=self.load_path)
         self._popup = Popup(title='Load File', content=content)
         self._popup.size_hint = (0.37, .8)
         self._popup.pos_hint = {'x': 10.0 / Window.width, 'y': 100 / Window.height}
         self._popup.open()
 
+    def refreshCatalog(self, browser=None):
+        """
+        Refreshes the protocol catalog on the scanner thread, then the rows of browser if given. A refresh already
+        running is not restarted.
+        """
+        if self.catalog_refresh is not None and not self.catalog_refresh.done():
+            return
+        self.catalog_refresh = self.scanner.submit(self.catalog.refresh, self.load_path, self.wtw.save_path)
+        self.catalog_refresh.add_done_callback(
+            lambda done: Clock.schedule_once(lambda dt: self.catalogRefreshed(browser, done)))
+
+    def catalogRefreshed(self, browser, future):
+        try:
+            num_validated = future.result()
+        except Exception:
+            # raised inside a Clock callback, any error would close the app: keep the rows already listed
+            logging.exception('Failed to refresh protocol catalog')
+            return
+        if num_validated:
+            logging.info('Protocol catalog refreshed, %s protocols validated' % num_validated)
+        if browser is not None:
+            browser.refreshRows()
+
     def updateLights(self):
+        if self.deferred is not None:
+            self.deferred.add('lights')
+        else:
+            self.renderLights()
+
+    @timed('gui.updateLights')
+    def renderLights(self):
         '''
         At each step:
         dest_wells: completed -> filled, uncompleted -> empty
         source_wells: completed -> empty, uncompletled -> full
         color current target wells, and black out wells not involved in transfer
-        '''
-        # self.ids.source_plate.pl.blackoutWells()
-        # self.ids.dest_plate.pl.blackoutWells()
-
-        self.ids.source_plate.pl.emptyWells()
-        self.ids.dest_plate.pl.emptyWells()
 
+        Only wells whose state changed since the previous call are pushed to the plates, see PlateRenderer
+        '''
         if self.wtw.tp_present_bool():
-
-            current_transfers = self.wtw.tp.transfers_by_plate[self.wtw.tp.current_plate_name]
-
-            # For transfer that is complete, color source well empty and dest well as full
-            for tf_id in self.wtw.tp.lists['completed']:
-                self.ids.dest_plate.pl.markFilled(self.wtw.tp.transfers[tf_id]['dest_well'])
-                if tf_id in current_transfers:
-                    self.ids.source_plate.pl.markEmpty(self.wtw.tp.transfers[tf_id]['source_well'])
-
-            # For transfer that is uncomplete, mark source well as full, dest well as empty
-            for tf_id in list(set(current_transfers) & set(self.wtw.tp.lists['uncompleted'])):
-                self.ids.source_plate.pl.markFilled(self.wtw.tp.transfers[tf_id]['source_well'])
-                self.ids.dest_plate.pl.markEmpty(self.wtw.tp.transfers[tf_id]['dest_well'])
-
-            # skipped wells in source are full, and empty in dest
-            for tf_id in list(set(current_transfers) & set(self.wtw.tp.lists['skipped'])):
-                self.ids.source_plate.pl.markFilled(self.wtw.tp.transfers[tf_id]['source_well'])
-                self.ids.dest_plate.pl.markEmpty(self.wtw.tp.transfers[tf_id]['dest_well'])
-
-            # Mark current targets
-            if self.wtw.tp.transfers[self.wtw.tp.current_uid].status == TStatus.started:
-                self.ids.source_plate.pl.markTarget(self.wtw.tp.transfers[self.wtw.tp.current_uid]['source_well'])
-                self.ids.dest_plate.pl.markTarget(self.wtw.tp.transfers[self.wtw.tp.current_uid]['dest_well'])
-
+            self.renderer.render(self.wtw.tp)
             self.current_tf_id = self.wtw.tp.tf_id()
-
-            self.ids.source_plate.pl.show()
-            self.ids.dest_plate.pl.show()
+        else:
+            if self.initialized:
+                self.ids.source_plate.pl.emptyWells()
+                self.ids.dest_plate.pl.emptyWells()
+            self.renderer.invalidate()
 
     def complete(self):
         if self.canUpdate():
@@ -174,8 +481,6 @@ class WelltoWellWidget(WellLitWidget):
         except TConfirm as conf:
             self.showPopup(conf, 'Plate complete', func=self.nextPlate)
             self.status = conf.__str__()
-        if self.wtw.tp_present_bool():
-            self.wtw.writeTransferRecordFiles(None)
 
     def skip(self):
         try:
@@ -188,8 +493,6 @@ class WelltoWellWidget(WellLitWidget):
         except TConfirm as conf:
             self.showPopup(conf, '')
             self.status = conf.__str__()
-        if self.wtw.tp_present_bool():
-            self.wtw.writeTransferRecordFiles(None)
 
     def failed(self):
         try:
@@ -202,8 +505,6 @@ class WelltoWellWidget(WellLitWidget):
         except TConfirm as conf:
             self.showPopup(conf, '')
             self.status = conf.__str__()
-        if self.wtw.tp_present_bool():
-            self.wtw.writeTransferRecordFiles(None)
 
     def undo(self):
         try:
@@ -216,8 +517,18 @@ class WelltoWellWidget(WellLitWidget):
         except TConfirm as conf:
             self.showPopup(conf, '')
             self.status = conf.__str__()
-        if self.wtw.tp_present_bool():
-            self.wtw.writeTransferRecordFiles(None)
+
+    def redo(self):
+        try:
+            self.wtw.redo()
+            self.status = self.wtw.tp.msg
+            self.updateLights()
+        except TError as err:
+            self.showPopup(err, 'Unable to redo transfer')
+            self.status = err.__str__()
+        except TConfirm as conf:
+            self.showPopup(conf, '')
+            self.status = conf.__str__()
 
     def nextPlate(self, _):
         self.status = ''
@@ -231,7 +542,6 @@ class WelltoWellWidget(WellLitWidget):
             self.status = err.__str__()
         except TConfirm as conf:
             self.nextPlateConfirm(None)
-            self.wtw.writeTransferRecordFiles(None)
             self.updateLabels()
             self.updateLights()
             self.next()
@@ -248,8 +558,7 @@ class WelltoWellWidget(WellLitWidget):
             self.showPopup(conf, 'Load next plate')
             self.updateLabels()
             self.updateLights()
-        if self.wtw.tp_present_bool():
-            self.wtw.writeTransferRecordFiles(None)
+        self.writeRecord()
 
     def nextPlateOverride(self, _):
         try:
@@ -263,11 +572,22 @@ class WelltoWellWidget(WellLitWidget):
         except TConfirm as conf:
             self.showPopup(conf, 'Plate skipped')
             self.status = conf.__str__()
-            self.wtw.writeTransferRecordFiles(None)
             self.updateLabels()
             self.updateLights()
-        if self.wtw.tp_present_bool():
-            self.wtw.writeTransferRecordFiles(None)
+        self.writeRecord()
+
+    def writeRecord(self):
+        """
+        Queues a write of the transfer record, which happens on the record writer thread
+        """
+        if self.deferred is not None:
+            self.deferred.add('record')
+        elif self.wtw.tp_present_bool():
+            try:
+                self.wtw.writeTransferRecordFiles(None)
+            except TError as err:
+                self.showPopup(err, 'Unable to write transfer record')
+                self.status = err.__str__()
 
     def finishTransfer(self):
         if self.initialized:
@@ -276,8 +596,6 @@ class WelltoWellWidget(WellLitWidget):
                     'Are you sure you wish to finish this transfer protocol? \n All remaining transfers will be skipped'),
                                'Confirm transfer abort',
                                func=self.finishTransferConfirm)
-                if self.wtw.tp_present_bool():
-                    self.wtw.writeTransferRecordFiles(None)
             else:
                 self.finishTransferConfirm(None)
 
@@ -291,8 +609,8 @@ class WelltoWellWidget(WellLitWidget):
             self.ids.source_plate.pl.show()
             self.ids.dest_plate.pl.show()
 
-            # write transfer record files
-            self.wtw.writeTransferRecordFiles(None)
+            # write transfer record files, waiting for any queued writes to finish
+            self.wtw.writeTransferRecordFiles(None, wait=True)
             self.showPopup(TConfirm('Record file generated, press \'q\' to quit or load a new transfer'),
                            'Transfers complete')
 
@@ -303,8 +621,6 @@ class WelltoWellWidget(WellLitWidget):
         except TError as err:
             self.showPopup(err, 'Error aborting transfer')
             self.status = err.__str__()
-        if self.wtw.tp_present_bool():
-            self.wtw.writeTransferRecordFiles(None)
 
     def setSquareMarker(self):
         """
@@ -325,19 +641,35 @@ class WellToWellApp(App):
     def build(self):
         return WelltoWellWidget()
 
+    def on_start(self):
+        logging.info('First screen ready %.0f ms after start' % ((time.perf_counter() - IMPORT_TIMER.started) * 1000))
+
+    def on_stop(self):
+        widget = self.root
+        widget.cancelLoad()
+        widget.loader.shutdown(wait=False)
+        widget.scanner.shutdown(wait=False)
+        # make sure queued record writes and journal fsyncs reach the disk before exiting
+        widget.wtw.record_writer.stop()
+        widget.wtw.closeJournal()
+        widget.wtw.reportTimings()
+
 
 if __name__ == '__main__':
     cwd = os.getcwd()
-    logdir = os.getcwd() + '/logs/'
-    logfile = 'WelltoWell_Logfile_' + datetime.utcnow().strftime('%Y_%m_%d') + '.txt'
-
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s [%(levelname)s] - %(message)s',
-        filename=Path(logdir + logfile))  # pass explicit filename here
-    logger = logging.getLogger()  # get the root loggers
+    with open(os.path.join(cwd, 'wellLitConfig.json')) as json_file:
+        logdir = json.load(json_file).get('log_dir', '')
+    if not logdir:
+        logdir = os.path.join(cwd, 'logs')
+
+    # records are written by a listener thread, so a slow log drive never holds up a keypress
+    logging_session = LoggingSession(logdir)
     logging.info('Session started')
+    IMPORT_TIMER.logSummary()
 
     Window.size = (1600, 1200)
     Window.fullscreen = True
-    WellToWellApp().run()
\ No newline at end of file
+    try:
+        WellToWellApp().run()
+    finally:
+        logging_session.stop()
\ No newline at end of file
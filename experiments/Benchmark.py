@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for protocol loading, stepping through transfers and writing transfer records.
+
+Synthetic protocols are generated for each scenario, from a single 96-well plate up to hundreds of 384-well source
+plates. For each scenario the benchmark reports:
+* the time of each loadCsv stage: readCsv, checkWellNames, checkDuplicateSource, checkDuplicateDestination and
+  buildTransferProtocol
+* latency percentiles of next, skip, undo and nextPlateOverride
+* the time of writeTransferRecordFiles
+* peak traced memory of loading, measured in a separate pass so that tracing does not skew the timings
+
+Run from the repository folder:
+
+	python experiments/Benchmark.py --output bench.json
+	python experiments/Benchmark.py --scenarios plate96 plate384 --compare bench.json
+
+Results are written as JSON so runs can be compared across releases with --compare.
+"""
+
+import argparse, json, os, platform, subprocess, sys, tempfile, time, tracemalloc
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import numpy as np
+from WellLit.Transfer import TError, TConfirm
+from PlateGeometry import plateGeometry
+from WellToWell import WelltoWell, WTWTransferProtocol
+
+# name: (num_wells, source plates, transfers per source plate)
+# the stress scenarios hold more transfers than a destination plate has wells, so their duplicate destinations are
+# expected: loading stages are timed one by one rather than through loadCsv
+SCENARIOS = {
+	'plate96': ('96', 1, 96),
+	'plate384': ('384', 1, 384),
+	'plate1536': ('1536', 1, 1536),
+	'cherry384x100': ('384', 100, 3),
+	'stress384x10': ('384', 10, 384),
+	'stress384x100': ('384', 100, 384),
+	'stress384x300': ('384', 300, 384),
+}
+ACTIONS = ('next', 'skip', 'undo', 'nextPlateOverride')
+
+
+def wellNames(num_wells):
+	return list(plateGeometry(num_wells).names)
+
+
+def writeProtocol(path, num_wells, num_plates, per_plate, seed=0):
+	"""
+	Writes a synthetic protocol csv with randomly picked, unique source wells in each plate
+	"""
+	rng = np.random.default_rng(seed)
+	wells = wellNames(num_wells)
+	per_plate = min(per_plate, len(wells))
+	with open(path, 'w') as protocol:
+		protocol.write('Benchmark dest,,\n')
+		dest_idx = 0
+		for plate in range(num_plates):
+			for source_idx in rng.choice(len(wells), size=per_plate, replace=False):
+				protocol.write('Source %04d,%s,%s\n' % (plate, wells[source_idx], wells[dest_idx % len(wells)]))
+				dest_idx += 1
+
+
+def timed(func, *args):
+	start = time.perf_counter()
+	try:
+		func(*args)
+	except (TError, TConfirm):
+		pass
+	return time.perf_counter() - start
+
+
+def percentiles(samples):
+	samples = np.asarray(samples) * 1000.0
+	if len(samples) == 0:
+		return {}
+	return {'n': int(len(samples)), 'mean_ms': float(samples.mean()), 'p50_ms': float(np.percentile(samples, 50)),
+			'p95_ms': float(np.percentile(samples, 95)), 'p99_ms': float(np.percentile(samples, 99)),
+			'max_ms': float(samples.max())}
+
+
+def loadStages(wtw, csv):
+	"""
+	Runs the stages of WelltoWell.loadCsv one by one, returning the time of each
+	"""
+	stages = {}
+	stages['readCsv'] = timed(wtw.readCsv, csv)
+	stages['checkWellNames'] = timed(wtw.checkWellNames)
+	stages['checkDuplicateSource'] = timed(wtw.checkDuplicateSource)
+	stages['checkDuplicateDestination'] = timed(wtw.checkDuplicateDestination)
+	start = time.perf_counter()
+	wtw.tp = WTWTransferProtocol(wtw=wtw, df=wtw.df)
+	stages['buildTransferProtocol'] = time.perf_counter() - start
+	stages['total'] = sum(stages.values())
+	return stages
+
+
+def loadProtocol(wtw, csv):
+	wtw.readCsv(csv)
+	wtw.checkWellNames()
+	wtw.tp = WTWTransferProtocol(wtw=wtw, df=wtw.df)
+	wtw.timestamp = datetime.now().strftime('%Y_%m_%d_%H_%M_%S')
+	wtw.openJournal()
+	try:
+		wtw.next()
+	except (TError, TConfirm):
+		pass
+
+
+def actionLatencies(wtw, csv, max_actions):
+	"""
+	Steps through the protocol, timing each call of the benchmarked actions
+	"""
+	latencies = {action: [] for action in ACTIONS}
+
+	def run(action):
+		latencies[action].append(timed(getattr(wtw, action)))
+
+	loadProtocol(wtw, csv)
+	tp = wtw.tp
+	while not tp.protocolComplete() and len(latencies['next']) < max_actions:
+		remaining = tp.numRemaining()
+		# step through most of the plate, exercising skip and undo along the way, then skip the rest of it
+		for step in range(max(remaining - 2, 0)):
+			if step % 10 == 3:
+				run('skip')
+			elif step % 10 == 6:
+				run('next')
+				run('undo')
+			else:
+				run('next')
+		if tp.plateComplete():
+			timed(wtw.nextPlate)
+			timed(wtw.nextPlateConfirm)
+		else:
+			run('nextPlateOverride')
+		timed(wtw.next)
+	return {action: percentiles(samples) for action, samples in latencies.items()}
+
+
+def peakMemory(wtw, csv):
+	tracemalloc.start()
+	try:
+		loadProtocol(wtw, csv)
+		return tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+		wtw.reset()
+
+
+def runScenario(name, work_dir, repeats, max_actions):
+	num_wells, num_plates, per_plate = SCENARIOS[name]
+	csv = os.path.join(work_dir, name + '.csv')
+	writeProtocol(csv, num_wells, num_plates, per_plate)
+	config = os.path.join(work_dir, 'config.json')
+	with open(config, 'w') as config_file:
+		json.dump({'num_wells': num_wells, 'protocol_dir': work_dir, 'records_dir': os.path.join(work_dir, '')},
+				  config_file)
+
+	result = {'num_wells': num_wells, 'plates': num_plates, 'transfers': num_plates * min(per_plate, int(num_wells))}
+
+	# best of several runs of each loading stage
+	load = [loadStages(WelltoWell(config), csv) for _ in range(repeats)]
+	result['load_s'] = {stage: min(run[stage] for run in load) for stage in load[0]}
+
+	wtw = WelltoWell(config)
+	result['actions'] = actionLatencies(wtw, csv, max_actions)
+	result['writeTransferRecordFiles_s'] = min(timed(wtw.writeTransferRecordFiles, None, True) for _ in range(repeats))
+	wtw.reset()
+
+	result['peak_memory_bytes'] = peakMemory(WelltoWell(config), csv)
+	return result
+
+
+def gitCommit():
+	try:
+		return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+									   stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def flatten(result, prefix=''):
+	"""
+	Flattens nested results into {'scenario.stage': value} for comparison
+	"""
+	flat = {}
+	for key, value in result.items():
+		if isinstance(value, dict):
+			flat.update(flatten(value, prefix + key + '.'))
+		elif isinstance(value, (int, float)) and not isinstance(value, bool):
+			flat[prefix + key] = value
+	return flat
+
+
+def compare(baseline, current, out=sys.stdout):
+	"""
+	Prints the ratio current / baseline of every timing and memory result present in both runs
+	"""
+	old, new = flatten(baseline['results']), flatten(current['results'])
+	out.write('%-70s %12s %12s %8s\n' % ('result', 'baseline', 'current', 'ratio'))
+	for key in sorted(set(old) & set(new)):
+		if key.endswith(('_s', '_ms', '_bytes')) or '_s.' in key:
+			ratio = new[key] / old[key] if old[key] else float('nan')
+			out.write('%-70s %12.4g %12.4g %8.2f\n' % (key, old[key], new[key], ratio))
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Benchmark protocol loading, stepping and record writing')
+	parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS),
+						help='scenarios to run (default: all)')
+	parser.add_argument('--repeats', type=int, default=3, help='runs of each timing, the best is kept')
+	parser.add_argument('--max-actions', type=int, default=2000, help='maximum next actions timed per scenario')
+	parser.add_argument('--output', help='write results to this JSON file')
+	parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+	args = parser.parse_args(argv)
+
+	report = {
+		'created': datetime.now().isoformat(timespec='seconds'),
+		'commit': gitCommit(),
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'results': {},
+	}
+	with tempfile.TemporaryDirectory() as work_dir:
+		for name in args.scenarios:
+			report['results'][name] = runScenario(name, work_dir, args.repeats, args.max_actions)
+			result = report['results'][name]
+			sys.stdout.write('%-16s %7s transfers  load %8.1f ms  next p95 %6.3f ms  record %8.1f ms  peak %6.1f MB\n' % (
+				name, result['transfers'], result['load_s']['total'] * 1000,
+				result['actions']['next'].get('p95_ms', float('nan')), result['writeTransferRecordFiles_s'] * 1000,
+				result['peak_memory_bytes'] / 2 ** 20))
+
+	if args.output:
+		with open(args.output, 'w') as output:
+			json.dump(report, output, indent=2)
+	if args.compare:
+		with open(args.compare) as baseline:
+			compare(json.load(baseline), report)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,32 @@
+import json, os, sys
+import pytest
+
+# the modules of the repository are imported as top level modules, as the GUI and command line tools do
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+	sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def config(tmp_path):
+	"""
+	Path of a WellLit config keeping records, cache and logs under tmp_path
+	"""
+	for name in ('records', 'cache', 'logs'):
+		(tmp_path / name).mkdir()
+	path = tmp_path / 'wellLitConfig.json'
+	path.write_text(json.dumps({
+		'num_wells': '96', 'protocol_dir': os.path.join(ROOT, 'protocols'),
+		'records_dir': os.path.join(str(tmp_path / 'records'), ''), 'cache_dir': str(tmp_path / 'cache'),
+		'log_dir': str(tmp_path / 'logs'), 'journal_batch_size': 5}))
+	return str(path)
+
+
+def writeProtocol(path, dest_plate, transfers):
+	"""
+	Writes a protocol csv: the destination plate line, then one (plate, source well, dest well) row per transfer
+	"""
+	with open(path, 'w', newline='') as protocol:
+		protocol.write('%s,,\n' % dest_plate)
+		protocol.writelines('%s,%s,%s\n' % transfer for transfer in transfers)
+	return str(path)
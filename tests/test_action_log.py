@@ -0,0 +1,57 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+from ActionLog import INITIAL_CAPACITY, ActionLog
+
+
+def logAction(log, before, after, changes):
+	log.begin(before)
+	for change in changes:
+		log.append(*change)
+	log.end(after)
+
+
+def test_undo_redo_steps_one_group():
+	log = ActionLog()
+	logAction(log, (0, 0), (1, 0), [(0, 4, 1, -1, 10), (1, 0, 4, -1, -1)])
+	logAction(log, (1, 0), (2, 0), [(1, 4, 2, -1, 20)])
+	assert len(log) == 2 and log.canUndo() and not log.canRedo()
+
+	assert log.undo() == ([(1, 4, -1)], (1, 0))
+	assert log.undo() == ([(1, 0, -1), (0, 4, -1)], (0, 0))
+	assert not log.canUndo()
+	assert log.redo() == ([(0, 1, 10), (1, 4, -1)], (1, 0))
+
+
+def test_new_action_drops_undone_groups_but_empty_actions_do_not():
+	log = ActionLog()
+	logAction(log, (0, 0), (1, 0), [(0, 0, 1, -1, 10)])
+	logAction(log, (1, 0), (2, 0), [(1, 0, 1, -1, 20)])
+	log.undo()
+	logAction(log, (1, 0), (1, 0), [])
+	assert log.canRedo()
+	logAction(log, (1, 0), (1, 1), [])
+	assert len(log) == 2 and not log.canRedo()
+
+
+def test_entries_outside_a_group_are_ignored():
+	log = ActionLog()
+	log.append(0, 0, 1, -1, 10)
+	assert log.num_entries == 0 and not log.recording
+
+
+def test_replay_reconstructs_state_and_grows():
+	log = ActionLog()
+	status = np.zeros(3, dtype=np.int8)
+	timestamp = np.full(3, -1, dtype=np.int64)
+	for step in range(INITIAL_CAPACITY + 10):
+		logAction(log, (step, 0), (step + 1, 0), [(step % 3, step % 5, (step + 1) % 5, step, step + 1)])
+	assert len(log) == INITIAL_CAPACITY + 10
+	cursor = log.replay(status, timestamp)
+	assert cursor == (INITIAL_CAPACITY + 10, 0)
+	# the last entry of each transfer wins
+	last = INITIAL_CAPACITY + 9
+	for idx in range(3):
+		step = max(step for step in range(last + 1) if step % 3 == idx)
+		assert (status[idx], timestamp[idx]) == ((step + 1) % 5, step + 1)
+	assert log.replay(status, timestamp, stop=0) is None
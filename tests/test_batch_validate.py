@@ -0,0 +1,58 @@
+import json
+import pytest
+from conftest import ROOT, writeProtocol
+
+pytest.importorskip('WellLit')
+from WellLit.Transfer import TError
+from BatchValidate import main, validateAll, validateProtocol
+from WellToWell import WelltoWell
+
+
+def test_reports_match_load_errors(config):
+	path = ROOT + '/protocols/dupes.csv'
+	report = validateProtocol(path, '96')
+	assert report['status'] == 'invalid'
+	wtw = WelltoWell(config)
+	with pytest.raises(TError) as err:
+		wtw.loadCsv(path)
+	# the report holds the messages shown when the protocol is loaded, after the summary line
+	assert report['errors'] == str(err.value).split('\n')[1:]
+
+
+def test_bad_wells_and_unreadable_files(tmp_path):
+	bad = writeProtocol(tmp_path / 'bad.csv', 'Dest', [('P1', 'A1', 'Z1'), ('P1', 'A1', 'B1')])
+	report = validateProtocol(bad, '96')
+	assert report['bad_wells'] == [{'column': 'destination', 'row': 2, 'well': 'Z1'}]
+	assert report['duplicate_sources'] == [{'plate': 'P1', 'well': 'A1', 'rows': [2, 3]}]
+	assert validateProtocol(tmp_path / 'missing.csv', '96')['status'] == 'error'
+
+
+def test_pool_keeps_order(tmp_path):
+	good = writeProtocol(tmp_path / 'good.csv', 'Dest', [('P1', 'A1', 'B1')])
+	reports = validateAll([good, ROOT + '/protocols/dupes.csv'], '96', jobs=2)
+	assert [report['status'] for report in reports] == ['ok', 'invalid']
+
+
+def test_validation_never_opens_the_history_database(config, tmp_path, capsys):
+	with open(config) as config_file:
+		configs = json.load(config_file)
+	configs['record_db'] = str(tmp_path / 'history.db')
+	with open(config, 'w') as config_file:
+		json.dump(configs, config_file)
+	writeProtocol(tmp_path / 'protocols.csv', 'Dest', [('P1', 'A1', 'B1')])
+	assert main([str(tmp_path), '--config', config, '--jobs', '1']) == 0
+	assert not (tmp_path / 'history.db').exists()
+
+
+def test_folder_and_plate_format_come_from_the_config(config, tmp_path, capsys):
+	protocols = tmp_path / 'plates384'
+	protocols.mkdir()
+	writeProtocol(protocols / 'wide.csv', 'Dest', [('P1', 'P24', 'A1')])
+	with open(config) as config_file:
+		configs = json.load(config_file)
+	configs.update(protocol_dir=str(protocols), num_wells='384')
+	with open(config, 'w') as config_file:
+		json.dump(configs, config_file)
+	assert main(['--config', config, '--jobs', '1']) == 0
+	assert json.loads(capsys.readouterr().out)[0]['file'].endswith('wide.csv')
+	assert main(['--config', config, '--jobs', '1', '--num-wells', '96']) == 1
@@ -0,0 +1,59 @@
+import pytest
+from conftest import writeProtocol
+
+pytest.importorskip('WellLit')
+from WellToWellCLI import main, parseScript
+
+
+def test_parse_script_expands_repeats_and_skips_comments():
+	actions = list(parseScript(['next 2  # two transfers', '', 'skip', '# done']))
+	assert actions == [(1, 'next'), (1, 'next'), (3, 'skip')]
+	with pytest.raises(ValueError):
+		list(parseScript(['jump']))
+
+
+def run(config, tmp_path, script, capsys):
+	protocol = writeProtocol(tmp_path / 'cli.csv', 'Dest', [
+		('P1', 'A1', 'A1'), ('P1', 'A2', 'A2'), ('P1', 'A3', 'A3'), ('P2', 'A1', 'B1')])
+	script_path = tmp_path / 'actions.txt'
+	script_path.write_text(script)
+	status = main([protocol, '--config', config, '--script', str(script_path)])
+	return status, capsys.readouterr().out
+
+
+def test_summary_counts_every_transfer_once(config, tmp_path, capsys):
+	status, out = run(config, tmp_path, 'next\n', capsys)
+	assert status == 0
+	# the first transfer is started on load: completed A1, started A2, uncompleted A3 and B1
+	assert '2 uncompleted, 1 completed, 0 skipped, 0 failed, 1 started' in out
+	assert list((tmp_path / 'records').glob('cli_transfer_record_*.csv'))
+
+
+def test_session_across_plates_with_undo(config, tmp_path, capsys):
+	status, out = run(config, tmp_path, 'next 3\nnextPlate\nnext\nundo\nredo\n', capsys)
+	assert status == 0
+	assert '0 uncompleted, 3 completed, 0 skipped, 0 failed, 1 started' in out
+
+
+def test_write_after_finish_reports_an_error(config, tmp_path, capsys):
+	status, out = run(config, tmp_path, 'finish\nwrite\n', capsys)
+	assert status == 0
+	assert out.startswith('3 actions, 1 errors.')
+
+
+def test_next_plate_confirm_is_not_a_script_action(config, tmp_path, capsys):
+	# a bare nextPlateConfirm skipped the plateComplete check of nextPlate, and ran past the last plate
+	with pytest.raises(SystemExit):
+		run(config, tmp_path, 'nextPlateConfirm 5\n', capsys)
+
+
+def test_unexpected_error_is_counted_and_the_script_goes_on(config, tmp_path, capsys, monkeypatch):
+	from WellToWell import WelltoWell
+
+	def broken(self):
+		raise RuntimeError('broken action')
+	monkeypatch.setattr(WelltoWell, 'skip', broken)
+	status, out = run(config, tmp_path, 'skip\nnext\n', capsys)
+	assert status == 0
+	assert out.startswith('3 actions, 1 errors.')
+	assert '2 uncompleted, 1 completed, 0 skipped, 0 failed, 1 started' in out
@@ -0,0 +1,40 @@
+from CommandQueue import CommandQueue
+
+
+class FakeClock:
+	def __init__(self):
+		self.now = 0.0
+
+	def __call__(self):
+		return self.now
+
+
+def test_repeat_within_debounce_is_dropped():
+	clock = FakeClock()
+	commands = CommandQueue(debounce=0.1, clock=clock)
+	assert commands.put('next')
+	clock.now = 0.05
+	assert not commands.put('next')
+	# the debounce is per command
+	assert commands.put('undo')
+	clock.now = 0.15
+	assert commands.put('next')
+	assert [commands.get() for _ in range(len(commands))] == ['next', 'undo', 'next']
+
+
+def test_dropped_press_does_not_extend_the_debounce():
+	clock = FakeClock()
+	commands = CommandQueue(debounce=0.1, clock=clock)
+	commands.put('next')
+	clock.now = 0.08
+	commands.put('next')
+	clock.now = 0.12
+	assert commands.put('next')
+
+
+def test_no_debounce_keeps_every_command_in_order():
+	commands = CommandQueue(clock=FakeClock())
+	for command in ('next', 'next', 'redo'):
+		assert commands.put(command)
+	assert commands.clear() == 3
+	assert len(commands) == 0
@@ -0,0 +1,41 @@
+import json
+import pytest
+from Instrumentation import RECORDER, LatencyRecorder, span
+
+
+@pytest.fixture
+def recorder():
+	enabled = RECORDER.enabled
+	RECORDER.reset()
+	RECORDER.enabled = True
+	yield RECORDER
+	RECORDER.enabled = enabled
+	RECORDER.reset()
+
+
+def test_summary_percentiles():
+	recorder = LatencyRecorder(enabled=True, max_samples=100)
+	for ms in range(1, 101):
+		recorder.record('op', ms / 1000.0)
+	stats = recorder.summary()['op']
+	assert stats['count'] == 100 and stats['max_ms'] == pytest.approx(100.0)
+	assert stats['p50_ms'] == pytest.approx(50.5)
+
+
+def test_span_records_blocks_left_by_an_exception(recorder):
+	with pytest.raises(ValueError):
+		with span('failing'):
+			raise ValueError()
+	assert recorder.counts['failing'] == 1
+
+
+def test_timings_are_written_away_from_records(config, recorder, tmp_path):
+	pytest.importorskip('WellLit')
+	from WellToWell import WelltoWell
+	wtw = WelltoWell(config)
+	recorder.record('op', 0.001)
+	wtw.reportTimings()
+	written = list((tmp_path / 'logs' / 'timings').glob('WelltoWell_timings_*.json'))
+	assert len(written) == 1
+	assert 'op' in json.loads(written[0].read_text())['latency']
+	assert not list((tmp_path / 'records').iterdir())
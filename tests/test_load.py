@@ -0,0 +1,53 @@
+import threading
+import pytest
+from conftest import ROOT, writeProtocol
+
+pytest.importorskip('WellLit')
+from WellLit.Transfer import TConfirm, TError
+from WellToWell import WelltoWell
+
+
+@pytest.fixture
+def wtw(config):
+	wtw = WelltoWell(config)
+	yield wtw
+	wtw.closeJournal()
+	wtw.record_writer.stop()
+
+
+def test_prepare_load_leaves_messages_to_commit_load(wtw):
+	wtw.msg = 'status shown to the user'
+	outcome = wtw.prepareLoad(ROOT + '/protocols/dupes.csv')
+	assert outcome.error is not None
+	assert wtw.msg == 'status shown to the user'
+
+	with pytest.raises(TError) as err:
+		wtw.commitLoad(outcome)
+	assert wtw.msg == 'CSV file has duplicate well sources and destinations'
+	assert 'DestWell A2 is duplicated in rows [2, 3, 6]' in str(err.value)
+
+
+def test_unreadable_file_message(wtw, tmp_path):
+	outcome = wtw.prepareLoad(str(tmp_path / 'missing.csv'))
+	with pytest.raises(TError):
+		wtw.commitLoad(outcome)
+	assert wtw.msg.startswith('Failed to load file csv')
+
+
+def test_second_load_is_served_from_cache(wtw, tmp_path):
+	protocol = writeProtocol(tmp_path / 'cached.csv', 'Dest', [('P1', 'a01', 'B1'), ('P1', 'A2', 'B2')])
+	first = wtw.prepareLoad(protocol)
+	second = wtw.prepareLoad(protocol)
+	assert first.ok and not first.cached
+	assert second.ok and second.cached
+	with pytest.raises(TConfirm):
+		wtw.loadCsv(protocol)
+	assert wtw.tp.transfers[0]['source_well'] == 'A1'
+
+
+def test_cancelled_load(wtw, tmp_path):
+	protocol = writeProtocol(tmp_path / 'cancelled.csv', 'Dest', [('P1', 'A1', 'B1')])
+	cancel = threading.Event()
+	cancel.set()
+	outcome = wtw.prepareLoad(protocol, cancel=cancel)
+	assert outcome.cancelled and not outcome.ok and outcome.error is None
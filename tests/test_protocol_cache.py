@@ -0,0 +1,66 @@
+import os
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('WellLit')
+from ProtocolCache import ProtocolCache, protocolKey
+from TransferStore import TransferStore
+
+
+def makeStore(num_transfers):
+	plate = np.zeros(num_transfers, dtype=np.int32)
+	wells = np.arange(num_transfers, dtype=np.int32)
+	names = np.array(['W%s' % idx for idx in range(num_transfers)], dtype=object)
+	return TransferStore(np.array(['P1'], dtype=object), plate, names, wells, wells[::-1].copy())
+
+
+def test_key_changes_with_contents_and_format(tmp_path):
+	path = tmp_path / 'protocol.csv'
+	path.write_text('dest,,\nP1,A1,A1\n')
+	key = protocolKey(path, '96')
+	assert protocolKey(path, '96') == key
+	assert protocolKey(path, '384') != key
+	path.write_text('dest,,\nP1,A1,A2\n')
+	assert protocolKey(path, '96') != key
+
+
+def test_hit_round_trips_the_store(tmp_path):
+	cache = ProtocolCache(tmp_path)
+	assert cache.get('missing') is None
+	store = makeStore(5)
+	cache.put('key', None, store)
+	dest_plate, cached = cache.get('key')
+	assert dest_plate is None
+	assert [dict(cached[idx]) for idx in cached] == [dict(store[idx]) for idx in store]
+
+	cache.put('named', 'Dest', store)
+	assert cache.get('named')[0] == 'Dest'
+
+
+def test_unreadable_entry_is_a_miss_and_removed(tmp_path):
+	cache = ProtocolCache(tmp_path)
+	cache.entryPath('bad').write_bytes(b'not an npz file')
+	assert cache.get('bad') is None
+	assert not cache.entryPath('bad').exists()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+	cache = ProtocolCache(tmp_path)
+	for key in ('old', 'used', 'new'):
+		cache.put(key, 'Dest', makeStore(200))
+	size = cache.entryPath('new').stat().st_size
+	os.utime(cache.entryPath('old'), (1, 1))
+	os.utime(cache.entryPath('used'), (2, 2))
+	os.utime(cache.entryPath('new'), (3, 3))
+	assert cache.get('used') is not None
+
+	cache.max_bytes = 2 * size
+	cache.evict()
+	assert sorted(path.stem for path in tmp_path.glob('*.npz')) == ['new', 'used']
+
+
+def test_disabled_cache_never_writes(tmp_path):
+	cache = ProtocolCache(tmp_path, max_bytes=0)
+	cache.put('key', 'Dest', makeStore(3))
+	assert cache.get('key') is None
+	assert not list(tmp_path.iterdir())
@@ -0,0 +1,53 @@
+import logging, os
+import pytest
+from conftest import writeProtocol
+
+pytest.importorskip('WellLit')
+from ProtocolCatalog import ProtocolCatalog
+
+
+@pytest.fixture
+def folders(tmp_path):
+	protocols, records = tmp_path / 'protocols', tmp_path / 'records'
+	protocols.mkdir()
+	records.mkdir()
+	writeProtocol(protocols / 'good.csv', 'Dest A', [('P1', 'A1', 'B1'), ('P2', 'A1', 'B2')])
+	writeProtocol(protocols / 'bad.csv', 'Dest B', [('P1', 'A1', 'Z1')])
+	(records / 'good_transfer_record_2024_03_01_10_20_30.csv').write_text('')
+	(records / 'good_transfer_journal_2024_03_02_10_20_30.csv').write_text('')
+	return protocols, records
+
+
+def test_refresh_validates_changed_files_only(folders, tmp_path, caplog):
+	protocols, records = folders
+	catalog = ProtocolCatalog('96', tmp_path / 'catalog.json')
+	with caplog.at_level(logging.INFO):
+		assert catalog.refresh(protocols, records) == 2
+	# scans never log per protocol
+	assert not caplog.records
+
+	good = catalog.get(protocols / 'good.csv')
+	assert (good['status'], good['num_plates'], good['num_transfers']) == ('ok', 2, 2)
+	assert good['last_run'] == '2024-03-02 10:20'
+	assert catalog.get(protocols / 'bad.csv')['status'] == 'invalid'
+
+	reloaded = ProtocolCatalog('96', tmp_path / 'catalog.json')
+	assert reloaded.refresh(protocols, records) == 0
+	writeProtocol(protocols / 'bad.csv', 'Dest B', [('P1', 'A1', 'A2')])
+	os.utime(protocols / 'bad.csv', ns=(1, 1))
+	(protocols / 'good.csv').unlink()
+	assert reloaded.refresh(protocols, records) == 1
+	assert [entry['name'] for entry in reloaded.search()] == ['bad.csv']
+	assert reloaded.get(protocols / 'bad.csv')['status'] == 'ok'
+
+	# entries of another plate format are validated again
+	assert ProtocolCatalog('384', tmp_path / 'catalog.json').refresh(protocols, records) == 1
+
+
+def test_search(folders, tmp_path):
+	protocols, records = folders
+	catalog = ProtocolCatalog('96', tmp_path / 'catalog.json')
+	catalog.refresh(protocols, records)
+	assert [entry['name'] for entry in catalog.search('DEST a')] == ['good.csv']
+	assert [entry['name'] for entry in catalog.search(status='invalid')] == ['bad.csv']
+	assert catalog.search('missing') == []
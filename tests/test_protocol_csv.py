@@ -0,0 +1,72 @@
+import pytest
+from conftest import ROOT
+
+pytest.importorskip('WellLit')
+from WellLit.Transfer import TError
+from WellToWell import detectEncoding, isHeaderRow, readProtocolCsv, readProtocolFile
+
+RAVEN = ROOT + '/protocols/raven sga cherrypicking sheet.csv'
+
+
+def writeBytes(path, text, encoding):
+	path.write_bytes(text.encode(encoding))
+	return str(path)
+
+
+def test_sample_sheet_with_bom_and_header():
+	assert detectEncoding(RAVEN) == 'utf-8-sig'
+	dest_plate, df = readProtocolCsv(RAVEN)
+	assert dest_plate is None
+	assert len(df) == 329
+	# the header is line 1, transfers are indexed by their line in the file
+	assert df.index[0] == 2 and df.index[-1] == 330
+	assert list(df.loc[2]) == ['PB11_1F', 'A14', 'A1']
+
+
+def test_utf8_bom_before_the_destination_line(tmp_path):
+	path = writeBytes(tmp_path / 'bom.csv', 'Dest 1,,\nP1,A1,B1\n', 'utf-8-sig')
+	assert detectEncoding(path) == 'utf-8-sig'
+	dest_plate, df = readProtocolCsv(path)
+	assert dest_plate == 'Dest 1'
+	assert list(df.loc[2]) == ['P1', 'A1', 'B1']
+
+
+def test_utf16(tmp_path):
+	path = writeBytes(tmp_path / 'wide.csv', 'Dest,,\r\nSource plate,Source well,Dest well\r\nP1,A1,B1\r\nP2,A2,B2\r\n',
+					  'utf-16')
+	assert detectEncoding(path) == 'utf-16'
+	dest_plate, df = readProtocolCsv(path)
+	assert dest_plate == 'Dest'
+	assert df.index.tolist() == [3, 4]
+	assert df['PlateName'].tolist() == ['P1', 'P2']
+
+
+def test_cp1252_fallback(tmp_path):
+	path = writeBytes(tmp_path / 'excel.csv', 'Destination,,\nPlaque é,A1,B1\n', 'cp1252')
+	assert detectEncoding(path) == 'utf-8'
+	dest_plate, df = readProtocolCsv(path)
+	assert df['PlateName'].tolist() == ['Plaque é']
+
+
+def test_header_rows():
+	assert isHeaderRow(['source plate', 'source well', 'destination well'])
+	assert isHeaderRow(['PlateName', 'SourceWell', 'DestWell'])
+	assert not isHeaderRow(['plate 1', 'A1', 'B01'])
+	assert not isHeaderRow(['P1', 'A1', 'B1'])
+	assert not isHeaderRow(['plate', 'well'])
+
+
+def test_line_numbers_after_blank_rows(tmp_path):
+	path = writeBytes(tmp_path / 'blank.csv', 'Dest,,\n\nPlate,Source,Dest\n,,\nP1,A1,B1\n\nP1,A2,B2\n , , \nP2,A1,B3\n',
+					  'utf-8')
+	dest_plate, df = readProtocolCsv(path)
+	assert dest_plate == 'Dest'
+	assert df.index.tolist() == [5, 7, 9]
+	assert df.loc[9, 'DestWell'] == 'B3'
+
+
+def test_missing_plate_names(tmp_path):
+	path = writeBytes(tmp_path / 'missing.csv', 'Dest,,\nP1,A1,B1\n,A2,B2\n  ,A3,B3\n', 'utf-8')
+	with pytest.raises(TError) as err:
+		readProtocolFile(path)
+	assert '2 rows without a source plate name, in rows [3, 4]' in str(err.value)
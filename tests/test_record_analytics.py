@@ -0,0 +1,119 @@
+import csv, json, os, shutil
+import numpy as np
+import pytest
+from conftest import ROOT
+
+from RecordAnalytics import (AnalyticsIndex, NO_TIMESTAMP, STATUS_CODE, loadTransfers, main, parseRecordFile,
+							 sessionTable)
+from TransferJournal import RECORD_HEADER
+
+SAMPLE = os.path.join(ROOT, 'records', 'raven sga cherrypicking sheet_transfer_record_2021_01_27_00_24_09.csv')
+
+
+def writeRecord(path, rows):
+	with open(path, 'w', newline='') as record:
+		writer = csv.writer(record, lineterminator='\n')
+		writer.writerow(RECORD_HEADER)
+		writer.writerows(rows)
+	return path
+
+
+@pytest.fixture
+def records(tmp_path):
+	"""
+	Copy of the sample transfer records of the repository
+	"""
+	folder = tmp_path / 'samples'
+	folder.mkdir()
+	for path in os.listdir(os.path.join(ROOT, 'records')):
+		if path.endswith('.csv'):
+			shutil.copy(os.path.join(ROOT, 'records', path), folder)
+	return folder
+
+
+def test_parse_sample_record():
+	with open(SAMPLE, newline='') as record:
+		rows = list(csv.DictReader(record))
+	arrays = parseRecordFile(SAMPLE)
+	assert len(arrays['status']) == len(rows)
+	assert [STATUS_CODE[row['Status']] for row in rows] == arrays['status'].tolist()
+	assert list(arrays['plate_names'][arrays['plate']]) == [row['Source plate'] for row in rows]
+	assert ((arrays['timestamp'] == NO_TIMESTAMP) == np.array([not row['Timestamp'] for row in rows])).all()
+
+
+def test_parse_keeps_the_last_row_of_a_journal(tmp_path):
+	journal = writeRecord(tmp_path / 'p_transfer_journal_2021_01_01_00_00_00.csv', [
+		['', 'P1', 'A1', 'D', 'A1', 'uncompleted'], ['', 'P1', 'A2', 'D', 'A2', 'uncompleted'],
+		['2021-01-01 00:00:01.000', 'P1', 'A1', 'D', 'A1', 'completed']])
+	arrays = parseRecordFile(journal)
+	assert sorted(arrays['status'].tolist()) == [STATUS_CODE['uncompleted'], STATUS_CODE['completed']]
+	with pytest.raises(ValueError):
+		parseRecordFile(os.path.join(ROOT, 'protocols', 'good.csv'))
+
+
+def test_index_only_parses_new_or_changed_records(records, tmp_path):
+	index = AnalyticsIndex(tmp_path / 'index')
+	names, df = loadTransfers(records, index)
+	index.save()
+	assert index.num_parsed == len(names) == 7
+
+	index = AnalyticsIndex(tmp_path / 'index')
+	names_again, df_again = loadTransfers(records, index)
+	assert index.num_parsed == 0
+	assert names_again == names
+	assert df_again.equals(df)
+
+	# a record rewritten with one more failed transfer is parsed again
+	changed = records / 'test_sheet1_transfer_record_2020_11_14_01_01_09.csv'
+	with open(changed, 'a', newline='') as record:
+		record.write('2020-11-14 01:20:00.000,Src Plate Z,A1,Dest Plate X,H12,failed\n')
+	os.utime(changed, ns=(os.stat(changed).st_atime_ns, os.stat(changed).st_mtime_ns + 10 ** 9))
+	index = AnalyticsIndex(tmp_path / 'index')
+	names_again, df_again = loadTransfers(records, index)
+	assert index.num_parsed == 1
+	assert len(df_again) == len(df) + 1
+	assert sessionTable(names_again, df_again).loc['test_sheet1_2020_11_14_01_01_09', 'failed'] == \
+		sessionTable(names, df).loc['test_sheet1_2020_11_14_01_01_09', 'failed'] + 1
+
+	# a record that was removed loses its index entry
+	removed = records / 'test_sheet1_transfer_record_2020_11_14_02_06_36.csv'
+	entry = index.entryPath(removed)
+	assert entry.exists()
+	removed.unlink()
+	names_again, _ = loadTransfers(records, index)
+	assert 'test_sheet1_2020_11_14_02_06_36' not in names_again
+	assert str(removed) not in index.files
+	assert not entry.exists()
+
+
+def test_session_table_throughput_and_plate_swaps(tmp_path):
+	folder = tmp_path / 'session'
+	folder.mkdir()
+	writeRecord(folder / 'p_transfer_record_2021_01_01_00_00_00.csv', [
+		['2021-01-01 00:00:00.000', 'P1', 'A1', 'D', 'A1', 'completed'],
+		['2021-01-01 00:00:30.000', 'P1', 'A2', 'D', 'A2', 'completed'],
+		['2021-01-01 00:00:30.000', 'P1', 'A3', 'D', 'A3', 'skipped'],
+		['2021-01-01 00:01:00.000', 'P2', 'A1', 'D', 'B1', 'failed'],
+		['2021-01-01 00:02:00.000', 'P2', 'A2', 'D', 'B2', 'completed'],
+		['', 'P2', 'A3', 'D', 'B3', 'uncompleted']])
+	names, df = loadTransfers(folder, AnalyticsIndex(tmp_path / 'index'))
+	row = sessionTable(names, df).loc['p_2021_01_01_00_00_00']
+	assert (row['transfers'], row['completed'], row['skipped'], row['failed'], row['uncompleted']) == (6, 3, 1, 1, 1)
+	assert row['active_min'] == 2.0
+	assert row['completed_per_min'] == 1.5
+	assert row['plate_swaps'] == 1
+	assert row['median_swap_s'] == 30.0
+
+
+def test_main_never_opens_the_history_database(config, records, tmp_path, capsys):
+	pytest.importorskip('WellLit')
+	with open(config) as config_file:
+		configs = json.load(config_file)
+	configs.update(records_dir=str(records), record_db=str(tmp_path / 'history.db'))
+	with open(config, 'w') as config_file:
+		json.dump(configs, config_file)
+	assert main(['--config', config, '--output', str(tmp_path / 'out')]) == 0
+	assert not (tmp_path / 'history.db').exists()
+	assert (tmp_path / 'cache' / 'analytics' / 'index.json').exists()
+	with open(tmp_path / 'out' / 'sessions.csv', newline='') as sessions:
+		assert len(list(csv.DictReader(sessions))) == 7
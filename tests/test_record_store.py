@@ -0,0 +1,130 @@
+import json, sqlite3
+import pytest
+from conftest import writeProtocol
+from RecordStore import RecordStore, SCHEMA, sessionKey
+from TransferJournal import readRecordRows, writeRecordRows
+
+TRANSFERS = [('P1', 'A1', 'A1'), ('P1', 'A2', 'A2'), ('P2', 'A1', 'B1')]
+
+
+def event(idx, status, timestamp=''):
+	plate, source_well, dest_well = TRANSFERS[idx]
+	return {'unique_id': idx, 'timestamp': timestamp, 'source_plate': plate, 'source_well': source_well,
+			'dest_plate': 'Dest', 'dest_well': dest_well, 'status': status}
+
+
+@pytest.fixture
+def store(tmp_path):
+	store = RecordStore(tmp_path / 'history.db')
+	yield store
+	store.close()
+
+
+def test_database_errors_are_kept_out_of_the_caller(store, caplog):
+	session = store.startSession('protocols/p.csv', 'Dest', TRANSFERS, '2024_01_01_00_00_00', batch_size=1)
+	store.query('DROP TABLE events')
+	session.append(event(0, 'started'))
+	session.append(event(0, 'completed', '2024-01-01 00:00:01.000'))
+	assert session.failing
+	assert sum('Cannot record' in record.message for record in caplog.records) == 1
+
+	with store._lock:
+		store._db.executescript(SCHEMA)
+	session.close()
+	assert not session.failing
+	assert [row[1][5] for row in store.wellHistory('P1', 'A1')] == ['started', 'completed']
+
+
+def withRecordDb(config, tmp_path):
+	with open(config) as config_file:
+		configs = json.load(config_file)
+	configs['record_db'] = str(tmp_path / 'history.db')
+	configs['journal_batch_size'] = 1
+	with open(config, 'w') as config_file:
+		json.dump(configs, config_file)
+
+
+def test_database_errors_never_block_the_record(config, tmp_path):
+	pytest.importorskip('WellLit')
+	from WellLit.Transfer import TConfirm
+	from WellToWell import WelltoWell
+	withRecordDb(config, tmp_path)
+	wtw = WelltoWell(config)
+	with pytest.raises(TConfirm):
+		wtw.loadCsv(writeProtocol(tmp_path / 'p.csv', 'Dest', TRANSFERS))
+	wtw.record_store.query('DROP TABLE events')
+	wtw.next()
+	wtw.next()
+	wtw.writeTransferRecordFiles(None, wait=True)
+	assert wtw.recordPath('record').exists()
+	wtw.closeJournal()
+	wtw.record_writer.stop()
+
+
+def recordRows(statuses):
+	return [['2024-01-01 00:00:0%s.000' % idx if status not in ('uncompleted', 'started') else '', plate, source_well,
+			 'Dest', dest_well, status] for idx, ((plate, source_well, dest_well), status)
+			in enumerate(zip(TRANSFERS, statuses))]
+
+
+def test_import_is_idempotent_per_session(store, tmp_path):
+	record = tmp_path / 'p_transfer_record_2024_01_01_00_00_00.csv'
+	journal = tmp_path / 'p_transfer_journal_2024_01_01_00_00_00.csv'
+	writeRecordRows(record, recordRows(['completed', 'skipped', 'uncompleted']))
+	writeRecordRows(journal, recordRows(['completed', 'skipped', 'started']))
+	session_id = store.importRecord(record)
+	assert session_id is not None
+	assert store.importRecord(record) is None
+	assert store.importRecord(journal) is None
+	assert len(store.sessions()) == 1
+	# transfers never started have no events
+	assert store.sessions()[0][5] == 2
+	assert store.sessionRecord(session_id) == [row[:6] for row in recordRows(['completed', 'skipped', 'uncompleted'])]
+
+
+def test_live_session_and_its_imported_record_are_one_session(store, tmp_path):
+	journal = tmp_path / 'p_transfer_journal_2024_01_01_00_00_00.csv'
+	session = store.startSession('protocols/p.csv', 'Dest', TRANSFERS, '2024_01_01_00_00_00', key=sessionKey(journal))
+	session.append(event(0, 'started'))
+	session.append(event(0, 'completed', '2024-01-01 00:00:00.000'))
+	session.close()
+	record = tmp_path / 'p_transfer_record_2024_01_01_00_00_00.csv'
+	writeRecordRows(record, recordRows(['completed', 'uncompleted', 'uncompleted']))
+	assert store.importRecord(record) is None
+
+	# another run of the same protocol from another folder shares its protocol row
+	writeRecordRows(tmp_path / 'p_transfer_record_2024_02_01_00_00_00.csv', recordRows(['failed', 'uncompleted', 'uncompleted']))
+	assert store.importRecord(tmp_path / 'p_transfer_record_2024_02_01_00_00_00.csv') is not None
+	assert [row[2] for row in store.sessions()] == ['p.csv', 'p.csv']
+	assert len(store.query('SELECT id FROM protocols')) == 1
+	assert [row[1][5] for row in store.wellHistory('P1', 'A1')] == ['started', 'completed', 'failed']
+
+
+def test_changed_protocol_with_the_same_name_is_a_new_protocol(store):
+	store.startSession('p.csv', 'Dest', TRANSFERS, '2024_01_01_00_00_00', key='a')
+	store.startSession('p.csv', 'Dest', TRANSFERS[::-1], '2024_01_02_00_00_00', key='b')
+	assert len(store.query('SELECT id FROM protocols')) == 2
+
+
+def test_session_history_and_export_from_a_live_session(config, tmp_path):
+	pytest.importorskip('WellLit')
+	from WellLit.Transfer import TConfirm
+	from WellToWell import WelltoWell
+	withRecordDb(config, tmp_path)
+	wtw = WelltoWell(config)
+	with pytest.raises(TConfirm):
+		wtw.loadCsv(writeProtocol(tmp_path / 'p.csv', 'Dest', TRANSFERS))
+	wtw.next()
+	wtw.next()
+	wtw.writeTransferRecordFiles(None, wait=True)
+	wtw.closeJournal()
+	record_path = wtw.recordPath('record')
+
+	store = wtw.record_store
+	assert store.importRecord(record_path) is None
+	assert [row[1][5] for row in store.wellHistory('P1', 'A1')] == ['started', 'completed']
+	(session_id, *_), = store.sessions()
+	store.exportRecord(session_id, tmp_path / 'export.csv')
+	assert list(readRecordRows(tmp_path / 'export.csv').values()) == list(readRecordRows(record_path).values())
+	wtw.record_writer.stop()
+	store.close()
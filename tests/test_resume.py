@@ -0,0 +1,97 @@
+import pytest
+from conftest import writeProtocol
+
+pytest.importorskip('WellLit')
+from WellLit.Transfer import TConfirm, TError
+from TransferJournal import readRecordRows
+from WellToWell import WelltoWell
+
+
+@pytest.fixture
+def wtw(config, tmp_path):
+	wtw = WelltoWell(config)
+	protocol = writeProtocol(tmp_path / 'two_plates.csv', 'Dest', [
+		('P1', 'A1', 'A1'), ('P1', 'A2', 'A2'), ('P2', 'A1', 'B1'), ('P2', 'A2', 'B2')])
+	with pytest.raises(TConfirm):
+		wtw.loadCsv(protocol)
+	yield wtw
+	wtw.closeJournal()
+	wtw.record_writer.stop()
+
+
+def statuses(wtw):
+	return [wtw.tp.transfers[idx]['status'] for idx in wtw.tp.tf_seq]
+
+
+def resume(config, path):
+	resumed = WelltoWell(config)
+	with pytest.raises(TConfirm):
+		resumed.resumeFromRecord(path)
+	return resumed
+
+
+def test_resume_prefers_newer_journal(wtw, config):
+	wtw.next()
+	wtw.next()
+	wtw.writeTransferRecordFiles(None, wait=True)
+	with pytest.raises(TError):
+		wtw.skip()
+	expected = statuses(wtw)
+	record_path = wtw.recordPath('record')
+	wtw.closeJournal()
+
+	resumed = resume(config, record_path)
+	assert statuses(resumed) == expected
+	resumed.closeJournal()
+
+
+def test_resume_from_record_alone_snapshots_journal(wtw, config):
+	wtw.next()
+	wtw.next()
+	wtw.writeTransferRecordFiles(None, wait=True)
+	expected = statuses(wtw)
+	record_path, journal_path = wtw.recordPath('record'), wtw.recordPath('journal')
+	wtw.closeJournal()
+	journal_path.unlink()
+
+	resumed = resume(config, record_path)
+	assert statuses(resumed) == expected
+	resumed.writeTransferRecordFiles(None, wait=True)
+	resumed.closeJournal()
+	assert [row[5] for row in readRecordRows(journal_path).values()] == expected
+
+
+def test_journal_compact_resume_round_trip(wtw, config):
+	wtw.next()
+	wtw.failed()
+	wtw.writeTransferRecordFiles(None, wait=True)
+	expected = statuses(wtw)
+	journal_path = wtw.recordPath('journal')
+	wtw.closeJournal()
+
+	resumed = resume(config, journal_path)
+	assert statuses(resumed) == expected
+	assert resumed.tp.cursor() == wtw.tp.cursor()
+	resumed.next()
+	resumed.closeJournal()
+	assert [row[5] for row in readRecordRows(journal_path).values()] == statuses(resumed)
+
+
+def test_resume_stays_on_complete_plate(wtw, config):
+	wtw.next()
+	wtw.next()
+	with pytest.raises(TError):
+		wtw.next()
+	assert statuses(wtw)[:2] == ['completed', 'completed']
+	journal_path = wtw.recordPath('journal')
+	wtw.closeJournal()
+
+	resumed = resume(config, journal_path)
+	assert resumed.tp.current_plate_name == 'P1'
+	with pytest.raises(TConfirm):
+		resumed.nextPlate()
+	with pytest.raises(TConfirm):
+		resumed.nextPlateConfirm()
+	assert resumed.tp.current_plate_name == 'P2'
+	assert resumed.tp.current_uid == 2
+	resumed.closeJournal()
@@ -0,0 +1,104 @@
+import json, logging, queue, sys, threading
+import pytest
+
+from StructuredLogging import LOG_NAME, DroppingQueueHandler, JsonLinesFormatter, LoggingSession
+
+
+def makeRecord(msg, **fields):
+	record = logging.makeLogRecord({'name': 'test', 'levelno': logging.INFO, 'levelname': 'INFO', 'msg': msg})
+	record.__dict__.update(fields)
+	return record
+
+
+def readLog(path):
+	with open(path, encoding='utf-8') as log:
+		return [json.loads(line) for line in log]
+
+
+def test_json_lines_formatter_keeps_fields_and_tracebacks():
+	entry = json.loads(JsonLinesFormatter().format(makeRecord('next', action='next', latency_ms=1.5, other='x')))
+	assert entry['message'] == 'next'
+	assert (entry['level'], entry['logger'], entry['action'], entry['latency_ms']) == ('INFO', 'test', 'next', 1.5)
+	assert 'other' not in entry
+
+	try:
+		raise ValueError('bad csv')
+	except ValueError:
+		record = makeRecord('failed')
+		record.exc_info = sys.exc_info()
+	entry = json.loads(JsonLinesFormatter().format(record))
+	assert entry['message'].startswith('failed\n')
+	assert 'ValueError: bad csv' in entry['message']
+
+
+def test_full_queue_drops_and_reports_records():
+	handler = DroppingQueueHandler(queue.Queue(maxsize=2))
+	for msg in 'abcde':
+		handler.handle(makeRecord(msg))
+	assert handler.dropped == 3
+	assert [handler.queue.get_nowait().getMessage() for _ in range(2)] == ['a', 'b']
+
+	handler.handle(makeRecord('f'))
+	warning = handler.queue.get_nowait()
+	assert warning.levelno == logging.WARNING
+	assert warning.getMessage().startswith('3 log records dropped')
+	assert handler.queue.get_nowait().getMessage() == 'f'
+
+
+@pytest.fixture
+def stalled(tmp_path):
+	"""
+	LoggingSession over a queue of 2 records, whose file writes wait until the returned event is set
+	"""
+	session = LoggingSession(str(tmp_path), queue_size=2, stop_timeout=0.2)
+	release = threading.Event()
+	emit = session.target.emit
+
+	def stalledEmit(record):
+		release.wait()
+		emit(record)
+	session.target.emit = stalledEmit
+	yield session, release
+	release.set()
+
+
+def test_stop_waits_for_room_and_writes_the_drop_count(stalled, tmp_path):
+	session, release = stalled
+	while not session.handler.queue.full():
+		logging.info('record')
+	logging.info('dropped')
+	assert session.handler.dropped == 1
+	threading.Timer(0.05, release.set).start()
+	session.stop()
+
+	entries = readLog(tmp_path / LOG_NAME)
+	assert entries[-1]['level'] == 'WARNING'
+	assert entries[-1]['message'] == '%s log records were dropped in this session' % session.handler.dropped
+	assert logging.getLogger().handlers.count(session.handler) == 0
+
+
+def test_stop_gives_up_on_a_stalled_disk(stalled, capsys):
+	session, release = stalled
+	# the listener is stuck on its first record, the queue fills up behind it
+	while not session.handler.queue.full():
+		logging.info('record')
+	session.stop()
+	assert 'stalled' in capsys.readouterr().err
+	assert logging.getLogger().handlers.count(session.handler) == 0
+
+
+def test_log_rotation_keeps_json_lines(tmp_path):
+	session = LoggingSession(str(tmp_path), backup_days=2)
+	try:
+		logging.info('before midnight', extra={'action': 'next'})
+		session.listener.stop()
+		session.target.doRollover()
+		session.listener.start()
+		logging.info('after midnight')
+	finally:
+		session.stop()
+	rotated = [path for path in tmp_path.iterdir() if path.name.startswith(LOG_NAME + '.')]
+	assert len(rotated) == 1
+	assert [entry['message'] for entry in readLog(rotated[0])] == ['before midnight']
+	assert readLog(rotated[0])[0]['action'] == 'next'
+	assert [entry['message'] for entry in readLog(tmp_path / LOG_NAME)] == ['after midnight']
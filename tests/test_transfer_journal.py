@@ -0,0 +1,80 @@
+import os
+import pytest
+from TransferJournal import RECORD_HEADER, RECORD_NAME, RecordWriter, TransferJournal, readRecordRows, writeRecordRows
+
+
+def transfer(source_well, dest_well, status, timestamp=None, plate='P1'):
+	return {'timestamp': timestamp, 'source_plate': plate, 'source_well': source_well, 'dest_plate': 'D',
+			'dest_well': dest_well, 'status': status}
+
+
+def test_compact_keeps_latest_state_in_protocol_order(tmp_path):
+	journal = TransferJournal(tmp_path / 'p_transfer_journal_2024_01_01_00_00_00.csv', batch_size=2)
+	journal.appendAll([transfer('A1', 'A1', 'uncompleted'), transfer('A2', 'A2', 'uncompleted')])
+	journal.append(transfer('A1', 'A1', 'started'))
+	journal.append(transfer('A1', 'A1', 'completed', '2024-01-01 00:00:01.000'))
+	journal.append(transfer('A2', 'A2', 'skipped', '2024-01-01 00:00:02.000'))
+	record_path = tmp_path / 'p_transfer_record_2024_01_01_00_00_00.csv'
+	journal.compact(record_path)
+	journal.close()
+
+	rows = list(readRecordRows(record_path).values())
+	assert [(row[2], row[5]) for row in rows] == [('A1', 'completed'), ('A2', 'skipped')]
+	assert rows[0][0] == '2024-01-01 00:00:01.000'
+
+
+def test_reopened_journal_appends_without_second_header(tmp_path):
+	path = tmp_path / 'journal.csv'
+	TransferJournal(path).close()
+	journal = TransferJournal(path)
+	journal.append(transfer('A1', 'A1', 'started'))
+	journal.close()
+	with open(path) as lines:
+		assert sum(line.startswith('Timestamp') for line in lines) == 1
+
+
+def test_truncated_last_line_is_ignored(tmp_path):
+	path = tmp_path / 'record.csv'
+	writeRecordRows(path, [['', 'P1', 'A1', 'D', 'A1', 'uncompleted']])
+	with open(path, 'a') as record:
+		record.write('2024-01-01 00:00:01.000,P1,A1')
+	assert [row[5] for row in readRecordRows(path).values()] == ['uncompleted']
+
+
+def test_not_a_record(tmp_path):
+	path = tmp_path / 'protocol.csv'
+	path.write_text('dest,,\nP1,A1,A1\n')
+	with pytest.raises(ValueError):
+		readRecordRows(path)
+
+
+def test_record_writer_leaves_no_temporary_file(tmp_path):
+	writeRecordRows(tmp_path / 'record.csv', [])
+	assert os.listdir(tmp_path) == ['record.csv']
+	assert readRecordRows(tmp_path / 'record.csv') == {}
+	assert open(tmp_path / 'record.csv').readline().strip() == ','.join(RECORD_HEADER)
+
+
+def test_record_name():
+	name = RECORD_NAME.match('test_sheet1_transfer_journal_2021_01_27_00_12_30.csv')
+	assert (name.group('stem'), name.group('kind'), name.group('timestamp')) == (
+		'test_sheet1', 'journal', '2021_01_27_00_12_30')
+	assert RECORD_NAME.match('test_sheet1.csv') is None
+
+
+def test_record_writer_compacts_and_survives_bad_requests(tmp_path):
+	journal = TransferJournal(tmp_path / 'journal.csv')
+	journal.append(transfer('A1', 'A1', 'started'))
+	writer = RecordWriter()
+	writer.compact(None, tmp_path / 'orphan.csv')
+	writer.sync(journal)
+	writer.compact(journal, tmp_path / 'record.csv')
+	writer.flush()
+	path, err = writer.takeError()
+	assert path == tmp_path / 'orphan.csv' and isinstance(err, AttributeError)
+	assert writer.takeError() is None
+	assert [row[5] for row in readRecordRows(tmp_path / 'record.csv').values()] == ['started']
+
+	writer.compact(None, tmp_path / 'orphan.csv')
+	writer.stop()
+	journal.close()
@@ -0,0 +1,54 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+from TransferOrder import ORDERS, constraintBlocks, moveCosts, orderTransfers, pathLength, twoOptOrder
+
+
+def randomPlate(num_transfers, seed=0):
+	rng = np.random.default_rng(seed)
+	source = rng.choice(96, num_transfers, replace=False)
+	dest = rng.choice(96, num_transfers, replace=False)
+	return (np.column_stack([source // 12, source % 12]).astype(float),
+			np.column_stack([dest // 12, dest % 12]).astype(float))
+
+
+@pytest.mark.parametrize('method', ORDERS)
+@pytest.mark.parametrize('constraint', ['none', 'dest_column', 'dest_row'])
+def test_order_is_a_permutation_never_longer_than_csv(method, constraint):
+	source_xy, dest_xy = randomPlate(40)
+	order, before, after = orderTransfers(source_xy, dest_xy, method, constraint)
+	assert sorted(order.tolist()) == list(range(40))
+	assert after <= before
+	assert after == pytest.approx(pathLength(moveCosts(source_xy, dest_xy), order))
+
+
+@pytest.mark.parametrize('constraint, axis', [('dest_column', 1), ('dest_row', 0)])
+def test_constraint_blocks_stay_contiguous_in_csv_order(constraint, axis):
+	source_xy, dest_xy = randomPlate(60, seed=1)
+	order, before, after = orderTransfers(source_xy, dest_xy, '2opt', constraint)
+	blocks = constraintBlocks(dest_xy, constraint)[order]
+	# every block is performed in one run, blocks in order of their first transfer in the csv
+	assert (np.diff(blocks) >= 0).all()
+	_, first = np.unique(dest_xy[:, axis], return_index=True)
+	assert [dest_xy[order[0], axis]] == [dest_xy[0, axis]]
+	assert len(np.unique(blocks)) == len(first)
+
+
+def test_two_opt_improves_a_crossing_path():
+	xy = np.array([[0, 0], [0, 3], [0, 1], [0, 2]], dtype=float)
+	costs = moveCosts(xy, np.zeros_like(xy))
+	order = twoOptOrder(costs, order=[0, 1, 2, 3])
+	assert order.tolist() == [0, 2, 3, 1]
+	assert pathLength(costs, order) == 3.0
+
+
+def test_small_plates_keep_csv_order():
+	source_xy, dest_xy = randomPlate(2)
+	order, before, after = orderTransfers(source_xy, dest_xy, 'nearest')
+	assert order.tolist() == [0, 1] and before == after
+
+
+def test_two_opt_shortens_a_scattered_plate():
+	source_xy, dest_xy = randomPlate(40)
+	_, before, after = orderTransfers(source_xy, dest_xy, '2opt')
+	assert after < 0.8 * before
@@ -0,0 +1,60 @@
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('WellLit')
+from WellLit.Transfer import TStatus
+from PlateGeometry import plateGeometry
+from TransferStore import NO_TIMESTAMP, TransferStore
+
+
+@pytest.fixture
+def store():
+	df = pd.DataFrame({'PlateName': ['P2', 'P1', 'P2', 'P1'], 'SourceWell': ['A1', 'A1', 'A2', 'A2'],
+					   'DestWell': ['B1', 'B2', 'B3', 'B4']})
+	return TransferStore.fromDataFrame(df, plateGeometry('96'), dest_plate='Dest')
+
+
+def test_plates_keep_first_appearance_and_csv_order(store):
+	assert list(store.plate_names) == ['P2', 'P1']
+	assert [store[idx]['dest_well'] for idx in store] == ['B1', 'B3', 'B2', 'B4']
+	assert store.plateSpan(1) == range(2, 4)
+	assert dict(store[0]) == {'unique_id': 0, 'source_plate': 'P2', 'dest_plate': 'Dest', 'source_well': 'A1',
+							  'dest_well': 'B1', 'timestamp': None, 'status': 'uncompleted'}
+
+
+def test_unknown_well_is_rejected():
+	df = pd.DataFrame({'PlateName': ['P1'], 'SourceWell': ['A1'], 'DestWell': ['I1']})
+	with pytest.raises(ValueError):
+		TransferStore.fromDataFrame(df, plateGeometry('96'))
+
+
+def test_status_changes_update_counters_and_index(store):
+	store[0].updateStatus(TStatus.started)
+	assert store.plateRemaining(0) == 2
+	store[0].updateStatus(TStatus.completed)
+	store[1].updateStatus(TStatus.skipped)
+	assert store[0]['timestamp'] is not None
+	assert store.plateRemaining(0) == 0 and store.remaining() == 2
+	assert store.plateMembers(0, [TStatus.completed, TStatus.skipped]) == [0, 1]
+	assert store.plateMembers(0, [TStatus.uncompleted]) == []
+	assert store.takeChanged() == {0, 1} and store.takeChanged() == set()
+
+	store[1].resetTransfer()
+	assert store.timestamp[1] == NO_TIMESTAMP
+	assert store.plateRemaining(0) == 1
+
+
+def test_recount_matches_incremental_counters(store):
+	store[2].updateStatus(TStatus.failed)
+	store[3].updateStatus(TStatus.started)
+	members, finished = [dict(plate) for plate in store.members], store.plate_finished.copy()
+	store.recount()
+	assert store.members == members
+	assert list(store.plate_finished) == list(finished)
+
+
+def test_reorder_within_plates_only(store):
+	store.reorder([1, 0, 2, 3])
+	assert [store[idx]['dest_well'] for idx in store] == ['B3', 'B1', 'B2', 'B4']
+	with pytest.raises(ValueError):
+		store.reorder([2, 1, 0, 3])
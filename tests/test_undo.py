@@ -0,0 +1,87 @@
+import pytest
+from conftest import writeProtocol
+
+pytest.importorskip('WellLit')
+from WellLit.Transfer import TConfirm, TError, TStatus
+from TransferJournal import readRecordRows
+from TransferStore import NO_TIMESTAMP, STATUS_CODE
+from WellToWell import WelltoWell
+
+
+@pytest.fixture
+def wtw(config, tmp_path):
+	wtw = WelltoWell(config)
+	protocol = writeProtocol(tmp_path / 'undo.csv', 'Dest', [
+		('P1', 'A1', 'A1'), ('P1', 'A2', 'A2'), ('P2', 'A1', 'B1'), ('P2', 'A2', 'B2')])
+	with pytest.raises(TConfirm):
+		wtw.loadCsv(protocol)
+	yield wtw
+	wtw.closeJournal()
+	wtw.record_writer.stop()
+
+
+def state(wtw):
+	tp = wtw.tp
+	return [(tp.transfers[idx]['status'], tp.transfers[idx]['timestamp']) for idx in tp.tf_seq], tp.cursor()
+
+
+def act(wtw, action):
+	try:
+		getattr(wtw, action)()
+	except (TError, TConfirm):
+		pass
+
+
+def test_undo_back_to_load_and_redo_across_plates(wtw):
+	states = [state(wtw)]
+	for action in ('next', 'next', 'skip', 'nextPlateConfirm', 'next', 'failed'):
+		act(wtw, action)
+		if state(wtw) != states[-1]:
+			states.append(state(wtw))
+	assert states[-1][1][1] == 1
+
+	for expected in reversed(states[:-1]):
+		wtw.undo()
+		assert state(wtw) == expected
+	wtw.undo()
+	assert state(wtw) == states[0]
+	assert wtw.tp.msg == 'Cannot undo previous operation'
+
+	for expected in states[1:]:
+		wtw.redo()
+		assert state(wtw) == expected
+
+
+def test_new_action_after_undo_clears_redo(wtw):
+	act(wtw, 'next')
+	act(wtw, 'next')
+	wtw.undo()
+	act(wtw, 'skip')
+	wtw.redo()
+	assert wtw.tp.msg == 'Nothing to redo'
+
+
+def test_undo_is_journaled(wtw):
+	act(wtw, 'next')
+	act(wtw, 'next')
+	wtw.undo()
+	wtw.writeTransferRecordFiles(None, wait=True)
+	rows = readRecordRows(wtw.recordPath('record'))
+	assert [row[5] for row in rows.values()] == [wtw.tp.transfers[idx]['status'] for idx in wtw.tp.tf_seq]
+
+
+def test_next_plate_confirm_refuses_an_incomplete_or_last_plate(wtw):
+	act(wtw, 'next')
+	with pytest.raises(TError):
+		wtw.nextPlateConfirm()
+	assert wtw.tp.cursor()[1] == 0
+
+	for action in ('next', 'next', 'nextPlateConfirm', 'next', 'next', 'failed'):
+		act(wtw, action)
+	assert wtw.tp.protocolComplete()
+	wtw.nextPlateConfirm()
+	# the last plate is complete, an unfinished transfer of an earlier plate leaves no plate to move to
+	wtw.tp.transfers.restoreStatus(0, STATUS_CODE[TStatus.uncompleted], NO_TIMESTAMP)
+	with pytest.raises(TError):
+		wtw.nextPlateConfirm()
+	assert wtw.tp.cursor()[1] == 1
@@ -0,0 +1,25 @@
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('WellLit')
+from WellToWell import invalidWellNames, normalizeWellNames
+
+
+def test_normalize_spellings():
+	wells = pd.Series(['b05', ' A04 ', 'H12', 'h1'])
+	assert normalizeWellNames(wells, '96').tolist() == ['B5', 'A4', 'H12', 'H1']
+
+
+def test_wells_outside_the_plate_are_invalid():
+	normalized = normalizeWellNames(pd.Series(['I1', 'A13', 'A0', 'P24', 'AF48', '1A', None]), '96')
+	assert normalized.isna().all()
+	assert normalizeWellNames(pd.Series(['I1', 'P24']), '384').tolist() == ['I1', 'P24']
+	assert normalizeWellNames(pd.Series(['AF48', 'af01']), '1536').tolist() == ['AF48', 'AF1']
+
+
+def test_invalid_well_names_reports_lines_and_normalizes_in_place():
+	df = pd.DataFrame({'PlateName': ['P1'] * 3, 'SourceWell': ['a01', 'Z9', None], 'DestWell': ['B2', 'B3', 'C13']},
+					  index=pd.Index([2, 3, 4], name='Line'))
+	invalid = invalidWellNames(df, '96')
+	assert invalid == [('source', 3, 'Z9'), ('source', 4, None), ('destination', 4, 'C13')]
+	assert df['SourceWell'].iat[0] == 'A1'